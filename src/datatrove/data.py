@@ -1,7 +1,9 @@
 """Data classes for the datatrove package."""
 
 from dataclasses import dataclass, field
-from typing import Generator, NewType
+from typing import Callable, Generator, NewType
+
+from datatrove.utils.typeshelper import Languages
 
 
 class MediaType:
@@ -28,6 +30,66 @@ class Media:
     local_path: str | None = None
 
 
+class DocumentAnalysis:
+    """Lazily computed (and memoized) splits of a document's text, shared by all the steps of a pipeline.
+
+    Use it through `doc.analysis`, which creates a new one whenever `doc.text` is changed, so that a step rewriting the
+    text never sees splits of the old text. Returned lists are shared between callers and should not be modified.
+
+    Args:
+        text: str
+            the text to analyse
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._cache = {}
+
+    def get(self, key, compute: Callable[[str], object]):
+        """Returns compute(text), only computing it the first time a given key is requested"""
+        if key not in self._cache:
+            self._cache[key] = compute(self.text)
+        return self._cache[key]
+
+    def parts(self, mode: str, language: str = Languages.english) -> list[str]:
+        """Same as `datatrove.utils.text.split_into_parts`"""
+        from datatrove.utils.text import split_into_parts
+
+        return self.get(("parts", mode, language), lambda text: split_into_parts(text, mode, language))
+
+    def words(self, language: str = Languages.english) -> list[str]:
+        """Same as `datatrove.utils.text.split_into_words`"""
+        from datatrove.utils.text import SPLIT_TEXT_WORDS
+
+        return self.parts(SPLIT_TEXT_WORDS, language)
+
+    def sentences(self, language: str = Languages.english) -> list[str]:
+        """Same as `datatrove.utils.text.split_into_sentences`"""
+        from datatrove.utils.text import SPLIT_TEXT_SENTENCES
+
+        return self.parts(SPLIT_TEXT_SENTENCES, language)
+
+    def paragraphs(self, language: str = Languages.english) -> list[str]:
+        """Same as `datatrove.utils.text.split_into_paragraphs`"""
+        from datatrove.utils.text import SPLIT_TEXT_PARAGRAPHS
+
+        return self.parts(SPLIT_TEXT_PARAGRAPHS, language)
+
+    def sent_tokenize(self, language: str = Languages.english) -> list[str]:
+        """Sentences from the word tokenizer's `sent_tokenize` (stripped, without the text in between)"""
+        from datatrove.utils.word_tokenizers import load_word_tokenizer
+
+        return self.get(("sent_tokenize", language), load_word_tokenizer(language).sent_tokenize)
+
+    def lines(self) -> list[str]:
+        """`text.splitlines()`"""
+        return self.get("lines", str.splitlines)
+
+    def split(self, separator: str) -> list[str]:
+        """`text.split(separator)`"""
+        return self.get(("split", separator), lambda text: text.split(separator))
+
+
 @dataclass
 class Document:
     """Main Document dataclass going through the processing pipeline
@@ -48,5 +110,14 @@ class Document:
     media: list[Media] = field(default_factory=list)
     metadata: dict[str, str | int | float | bool] = field(default_factory=dict)
 
+    @property
+    def analysis(self) -> DocumentAnalysis:
+        """Cached splits (words, lines, sentences...) of the current text. See `DocumentAnalysis`"""
+        # not a dataclass field: it is not serialized/compared and is recreated when text is assigned a new value
+        analysis = self.__dict__.get("_analysis")
+        if analysis is None or analysis.text is not self.text:
+            analysis = self._analysis = DocumentAnalysis(self.text)
+        return analysis
+
 
 DocumentsPipeline = NewType("DocumentsPipeline", Generator[Document, None, None] | None)
@@ -9,6 +9,7 @@ from datatrove.executor.base import PipelineExecutor
 from datatrove.io import DataFolderLike
 from datatrove.pipeline.base import PipelineStep
 from datatrove.utils.logging import logger
+from datatrove.utils.model_registry import clear_models, get_models_memory, preload_models
 from datatrove.utils.stats import PipelineStats
 
 
@@ -31,6 +32,10 @@ class LocalPipelineExecutor(PipelineExecutor):
         depends: another LocalPipelineExecutor that should run
             before this one
         randomize_start_duration: the maximum number of seconds to delay the start of each task.
+        preload_models: load the models used by the pipeline steps (fastText, KenLM...) in the main process before
+            starting the workers, so that they are shared (copy-on-write) by all the workers instead of being loaded
+            by each of them. Requires start_method="fork". They are removed from the main process once all the
+            workers are done
     """
 
     def __init__(
@@ -45,6 +50,7 @@ class LocalPipelineExecutor(PipelineExecutor):
         local_tasks: int = -1,
         local_rank_offset: int = 0,
         randomize_start_duration: int = 0,
+        preload_models: bool = False,
     ):
         super().__init__(pipeline, logging_dir, skip_completed, randomize_start_duration)
         self.tasks = tasks
@@ -53,6 +59,7 @@ class LocalPipelineExecutor(PipelineExecutor):
         self.local_tasks = local_tasks if local_tasks != -1 else tasks
         self.local_rank_offset = local_rank_offset
         self.depends = depends
+        self.preload_models = preload_models
         if self.local_rank_offset + self.local_tasks > self.tasks:
             raise ValueError(
                 f"Local tasks go beyond the total tasks (local_rank_offset + local_tasks = {self.local_rank_offset + self.local_tasks} > {self.tasks} = tasks)"
@@ -126,6 +133,7 @@ class LocalPipelineExecutor(PipelineExecutor):
                 self.pipeline = deepcopy(pipeline)
                 stats.append(self._launch_run_for_rank(rank, ranks_q))
         else:
+            preloaded_models = self._preload_models() if self.preload_models else []
             completed_counter = mg.Value("i", skipped)
             completed_lock = mg.Lock()
             ctx = multiprocess.get_context(self.start_method)
@@ -141,6 +149,7 @@ class LocalPipelineExecutor(PipelineExecutor):
                         ranks_to_run,
                     )
                 )
+            clear_models(preloaded_models)
         # merged stats
         stats = sum(stats, start=PipelineStats())
         with self.logging_dir.open("stats.json", "wt") as statsfile:
@@ -148,6 +157,23 @@ class LocalPipelineExecutor(PipelineExecutor):
         logger.success(stats.get_repr(f"All {self.local_tasks} tasks"))
         return stats
 
+    def _preload_models(self) -> list:
+        """Loads the pipeline's models in the main process, to be inherited by the forked workers. Returns their keys"""
+        if self.start_method != "fork":
+            logger.warning(
+                f'preload_models=True has no effect with start_method="{self.start_method}": workers do not inherit '
+                f'the memory of the main process. Use start_method="fork" to share the models.'
+            )
+            return []
+        preloaded_models = preload_models(self.pipeline)
+        logger.info(
+            f"The {len(preloaded_models)} preloaded model(s) are shared by the {self.workers} workers. Resident "
+            f"memory measured in the main process while preloading: "
+            f"{get_models_memory(preloaded_models) / 2**20:.1f} MiB (memory mapped models, such as KenLM's, are "
+            f"paged in lazily and are not included)."
+        )
+        return preloaded_models
+
     @property
     def world_size(self) -> int:
         """
@@ -81,6 +81,14 @@ class PipelineStep(ABC):
             self.stats.time_stats.unit = unit
         return self.stats.time_stats
 
+    def preload_models(self):
+        """
+        Loads the models used by this step (through `datatrove.utils.model_registry.get_model`), so that they can
+        be loaded once in the main process and shared with forked workers. Steps that use models should override
+        this method.
+        """
+        pass
+
     def __repr__(self):
         return f"{self.type}: {self.name}"
 
@@ -1 +1 @@
-from .n_grams import NGramsDecontConfig, NGramsDecontFilter, NGramsDecontIndexer
+from .n_grams import AhoCorasickDecontFilter, NGramsDecontConfig, NGramsDecontFilter, NGramsDecontIndexer
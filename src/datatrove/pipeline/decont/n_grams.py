@@ -4,6 +4,7 @@ First build an index using the tasks we want to use to decontaminate our trainin
 Then read your training data and apply the filter with the index loaded.
 """
 
+import json
 import os
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
@@ -17,6 +18,7 @@ from datatrove.io import DataFolderLike, file_exists, get_datafolder, open_file
 from datatrove.pipeline.base import PipelineStep
 from datatrove.pipeline.filters.base_filter import BaseFilter
 from datatrove.pipeline.writers.disk_base import DiskWriter
+from datatrove.utils._import_utils import check_required_dependencies
 from datatrove.utils.binaryio import read_np_from_file
 from datatrove.utils.hashing import HashConfig, create_hash_func
 from datatrove.utils.logging import logger
@@ -25,6 +27,10 @@ from datatrove.utils.typeshelper import Languages
 from datatrove.utils.word_tokenizers import load_word_tokenizer
 
 
+# merged index saved by NGramsDecontFilter in local index folders (doesn't match the *.index.hashes pattern)
+SORTED_INDEX_NAME = "ngrams_decont.sorted_index"
+
+
 @dataclass
 class NGramsDecontConfig:
     """
@@ -62,6 +68,8 @@ class NGramsDecontIndexer(PipelineStep):
       you can also define your custom tasks with `custom_lighteval_tasks`. See explanation for `custom_tasks` here:
       https://github.com/huggingface/lighteval/tree/main?tab=readme-ov-file#evaluate-a-model-on-extended-community-or-custom-tasks
 
+    With `save_ngrams=True`, the normalized n-grams of each task are also saved as text (one per line), which is the
+    index used by `AhoCorasickDecontFilter`.
     """
 
     type = "🦠 - DECONT"
@@ -75,6 +83,7 @@ class NGramsDecontIndexer(PipelineStep):
         custom_lighteval_tasks: str | None = None,
         config: NGramsDecontConfig = None,
         language: str = Languages.english,
+        save_ngrams: bool = False,
     ):
         super().__init__()
         self.output_folder = get_datafolder(output_folder)
@@ -88,11 +97,12 @@ class NGramsDecontIndexer(PipelineStep):
         else:
             self.lighteval_tasks = lighteval_tasks
         self.custom_lighteval_tasks = custom_lighteval_tasks
+        self.save_ngrams = save_ngrams
         self.config = config or NGramsDecontConfig()
         self.tokenizer = load_word_tokenizer(language)
         self.hash_func = create_hash_func(self.config.hash_config)
 
-    def compute_hashes(self, label: str, query: str | None = None) -> list[int]:
+    def compute_ngrams(self, label: str, query: str | None = None) -> list[str]:
         label_tokens = self.tokenizer.word_tokenize(simplify_text(label, self.config.norm_config))
         ngrams_to_compute = list(ngrams(label_tokens, self.config.n_grams))
         if query is not None:
@@ -116,12 +126,23 @@ class NGramsDecontIndexer(PipelineStep):
                         if len(query_tokens) >= self.config.n_grams - 1 - i and len(label_tokens) >= i + 1
                     ]
                 )
-        return list(map(self.hash_func, map(" ".join, ngrams_to_compute)))
+        return list(map(" ".join, ngrams_to_compute))
+
+    def compute_hashes(self, label: str, query: str | None = None) -> list[int]:
+        return list(map(self.hash_func, self.compute_ngrams(label, query)))
 
     def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
         if world_size != 1:
             raise ValueError("Decontamination index building requires a single worker.")
         hashes = defaultdict(set)
+        task_ngrams = defaultdict(set)
+
+        def add_task_data(task_name: str, label: str, query: str | None):
+            n_grams = self.compute_ngrams(label, query)
+            hashes[task_name].update(map(self.hash_func, n_grams))
+            if self.save_ngrams:
+                task_ngrams[task_name].update(n_grams)
+
         # use whatever date is parsed in with the following format:
         # doc.text -> label
         # doc.metadata["input"] -> input
@@ -131,9 +152,7 @@ class NGramsDecontIndexer(PipelineStep):
                     raise ValueError(
                         "only_label_ngrams is False but could not find 'query' field in documents metadata"
                     )
-                hashes[doc.metadata.get("task", "input")].update(
-                    self.compute_hashes(doc.text, doc.metadata.get("query", None))
-                )
+                add_task_data(doc.metadata.get("task", "input"), doc.text, doc.metadata.get("query", None))
 
         # parse data from lighteval defined tasks
         from lighteval.tasks.lighteval_task import LightevalTask
@@ -153,7 +172,7 @@ class NGramsDecontIndexer(PipelineStep):
                     logger.warning(f"Error while fetching doc data: {e}")
                     continue
                 for gold in golds:
-                    hashes[task_name].update(self.compute_hashes(gold, query))
+                    add_task_data(task_name, gold, query)
 
         for task_name, task_hashes in hashes.items():
             hashes_array = np.array(list(task_hashes), dtype=self.config.hash_config.np_descr)
@@ -163,11 +182,15 @@ class NGramsDecontIndexer(PipelineStep):
                     hashes_array.tofile(f)
                 else:
                     f.write(hashes_array.tobytes())
+        for task_name, n_grams in task_ngrams.items():
+            with self.output_folder.open(f"{task_name.replace(' ', '_')}.index.ngrams", mode="wt") as f:
+                f.writelines(f"{n_gram}\n" for n_gram in sorted(n_grams))
 
 
 class NGramsDecontFilter(BaseFilter):
     """
-    Loads list of hashes created by the Indexer step.
+    Loads list of hashes created by the Indexer step, merged into a sorted array of hashes with the task of each hash
+    (memory mapped and shared by all the processes when the index folder is local).
     For each document in the block's input, we will check if any of its ngrams are part of the reference eval tasks.
     If so, they will be removed. The contaminated ngram and task where it was found will be saved in the removed
     document's metadata.
@@ -189,39 +212,151 @@ class NGramsDecontFilter(BaseFilter):
         self.exclusion_writer = exclusion_writer
         self.language = language
         self._index_hashes = None
+        self._index_tasks = None
+        self._task_names = None
         self.hash_func = create_hash_func(self.config.hash_config)
         self.tokenizer = load_word_tokenizer(language)
 
-    def load_index_hashes(self):
+    def build_sorted_index(self, index_files: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Merges the hashes of all the index files.
+
+        Returns:
+            sorted unique hashes and, for each hash, the position in index_files of its task
+        """
+        hash_dtype = np.dtype(self.config.hash_config.np_descr)
+
         def load_index_from_file(file):
             with self.index_folder.open(file, mode="rb") as f:
-                return file, read_np_from_file(
-                    f, np.dtype(self.config.hash_config.np_descr), self.index_folder.is_local()
-                ).tolist()
+                return read_np_from_file(f, hash_dtype, self.index_folder.is_local())
 
         with ThreadPoolExecutor() as pool:
-            hashes = pool.map(load_index_from_file, self.index_folder.list_files(glob_pattern="**/*.index.hashes"))
+            hashes = list(pool.map(load_index_from_file, index_files))
+        for filename, task_hashes in zip(index_files, hashes):
+            logger.info(f"Loading {len(task_hashes)} hashes for {filename.removesuffix('.index.hashes')}")
+
+        task_ids = np.repeat(np.arange(len(hashes), dtype=np.uint32), [len(task_hashes) for task_hashes in hashes])
+        hashes = np.concatenate([np.zeros(0, dtype=hash_dtype)] + hashes)
+        # a hash present in several tasks is attributed to the last one (np.unique returns the first occurrence)
+        hashes, first_idx = np.unique(hashes[::-1], return_index=True)
+        return hashes, task_ids[::-1][first_idx]
 
-        self._index_hashes = {}
-        for filename, hashlist in hashes:
-            taskname = filename.removesuffix(".index.hashes")
-            logger.info(f"Loading {len(hashlist)} hashes for {taskname}")
-            for hash in hashlist:
-                self._index_hashes[hash] = taskname
+    def load_shared_index(self, index_files: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Builds the sorted index once in the (local) index folder and memory maps it, so that it is shared by all
+        the processes. It is rebuilt when the list (or sizes) of the index files change.
+        """
+        check_required_dependencies("NGramsDecontFilter shared index", ["fasteners"])
+        from fasteners import InterProcessLock
+
+        manifest = {file: self.index_folder.size(file) for file in index_files}
+        base_path = self.index_folder.resolve_paths(SORTED_INDEX_NAME)
+        with InterProcessLock(f"{base_path}.lock"):
+            current_manifest = None
+            if os.path.exists(f"{base_path}.json"):
+                with open(f"{base_path}.json") as f:
+                    current_manifest = json.load(f)
+            if current_manifest != manifest:
+                logger.info(f"Building sorted index {base_path} from {len(index_files)} index files.")
+                hashes, task_ids = self.build_sorted_index(index_files)
+                hashes.tofile(f"{base_path}.hashes")
+                task_ids.tofile(f"{base_path}.tasks")
+                with open(f"{base_path}.json", "w") as f:
+                    json.dump(manifest, f)
+        if os.path.getsize(f"{base_path}.hashes") == 0:
+            return np.zeros(0, dtype=self.config.hash_config.np_descr), np.zeros(0, dtype=np.uint32)
+        return (
+            np.memmap(f"{base_path}.hashes", dtype=self.config.hash_config.np_descr, mode="r"),
+            np.memmap(f"{base_path}.tasks", dtype=np.uint32, mode="r"),
+        )
+
+    def load_index_hashes(self):
+        index_files = self.index_folder.list_files(glob_pattern="**/*.index.hashes")
+        if self.index_folder.is_local():
+            self._index_hashes, self._index_tasks = self.load_shared_index(index_files)
+        else:
+            self._index_hashes, self._index_tasks = self.build_sorted_index(index_files)
+        self._task_names = [file.removesuffix(".index.hashes") for file in index_files]
 
     def filter(self, doc: Document) -> bool | Tuple[bool, str]:
         if self._index_hashes is None:
             self.load_index_hashes()
 
         text_tokens = self.tokenizer.word_tokenize(simplify_text(doc.text, self.config.norm_config))
-        ngrams_to_compute = list(ngrams(text_tokens, self.config.n_grams))
-        for n_gram in map(" ".join, ngrams_to_compute):
-            task = self._index_hashes.get(self.hash_func(n_gram), None)
-            if task is not None:
-                doc.metadata["contaminated_ngram"] = n_gram
-                doc.metadata["contaminated_task"] = task
-                self.stat_update(f"contaminated_{task}")
-                if ":" in task:
-                    self.stat_update(f"contaminated_tg_{task[:task.index(':')]}")
-                return False, "contaminated"
+        n_grams = list(map(" ".join, ngrams(text_tokens, self.config.n_grams)))
+        if not n_grams or not len(self._index_hashes):
+            return True
+        hashes = np.fromiter(map(self.hash_func, n_grams), dtype=self._index_hashes.dtype, count=len(n_grams))
+        positions = np.minimum(np.searchsorted(self._index_hashes, hashes), len(self._index_hashes) - 1)
+        contaminated = np.flatnonzero(self._index_hashes[positions] == hashes)
+        if len(contaminated):
+            # first contaminated n-gram of the document
+            ngram_i = contaminated[0]
+            task = self._task_names[self._index_tasks[positions[ngram_i]]]
+            doc.metadata["contaminated_ngram"] = n_grams[ngram_i]
+            doc.metadata["contaminated_task"] = task
+            self.stat_update(f"contaminated_{task}")
+            if ":" in task:
+                self.stat_update(f"contaminated_tg_{task[:task.index(':')]}")
+            return False, "contaminated"
+        return True
+
+
+class AhoCorasickDecontFilter(BaseFilter):
+    """
+    Exact string version of `NGramsDecontFilter`: the n-grams saved by `NGramsDecontIndexer` with `save_ngrams=True`
+    are compiled into a single Aho-Corasick automaton, and each document is normalized with `simplify_text` and
+    scanned in one linear pass, without word tokenization.
+    N-grams only match on whole words (whitespace boundaries), so results are the same as `NGramsDecontFilter` as long
+    as the word tokenizer splits the normalized text on whitespace (the case for most latin script languages).
+    The contaminated ngram and task where it was found will be saved in the removed document's metadata.
+    """
+
+    type = "🦠 - DECONT"
+    name = "💥 Aho-Corasick decontaminate"
+    _requires_dependencies = [("ahocorasick", "pyahocorasick")]
+
+    def __init__(
+        self,
+        index_folder: DataFolderLike,
+        config: NGramsDecontConfig = None,
+        exclusion_writer: DiskWriter = None,
+    ):
+        super().__init__(exclusion_writer)
+        self.index_folder = get_datafolder(index_folder)
+        self.config = config or NGramsDecontConfig()
+        self._automaton = None
+
+    def load_automaton(self):
+        import ahocorasick
+
+        index_files = self.index_folder.list_files(glob_pattern="**/*.index.ngrams")
+        self._automaton = ahocorasick.Automaton(ahocorasick.STORE_ANY)
+        for file in index_files:
+            task_name = file.removesuffix(".index.ngrams")
+            with self.index_folder.open(file, mode="rt") as f:
+                n_grams = f.read().splitlines()
+            logger.info(f"Loading {len(n_grams)} ngrams for {task_name}")
+            for n_gram in n_grams:
+                # pad with spaces so that we only match whole words. Later tasks overwrite earlier ones
+                self._automaton.add_word(f" {n_gram} ", (task_name, len(n_gram) + 2))
+        if len(self._automaton):
+            self._automaton.make_automaton()
+
+    def filter(self, doc: Document) -> bool | Tuple[bool, str]:
+        if self._automaton is None:
+            self.load_automaton()
+        if not len(self._automaton):
+            return True
+
+        text = f" {simplify_text(doc.text, self.config.norm_config)} "
+        # matches are returned by end position: all n-grams have the same number of words, so the first match is
+        # also the first contaminated n-gram of the document
+        match = next(self._automaton.iter(text), None)
+        if match is not None:
+            end, (task, length) = match
+            doc.metadata["contaminated_ngram"] = text[end - length + 2 : end]
+            doc.metadata["contaminated_task"] = task
+            self.stat_update(f"contaminated_{task}")
+            if ":" in task:
+                self.stat_update(f"contaminated_tg_{task[:task.index(':')]}")
+            return False, "contaminated"
         return True
@@ -1,11 +1,14 @@
-from .bloom_filter import SingleBloomFilter
-from .exact_substrings import ESDatasetToSequence, ESMergeSequences, ESRangeRemover
+from .bloom_filter import SharedBloomFilter, SingleBloomFilter
+from .exact_dedup import ExactDedupConfig, ExactDedupFilter, ExactDedupSignature, ExactFindDedups
+from .exact_substrings import ESDatasetToSequence, ESFindDuplicateRanges, ESMergeSequences, ESRangeRemover
 from .minhash import (
     MinhashBuildIndex,
+    MinhashCompactIndex,
     MinhashConfig,
     MinhashDedupBuckets,
     MinhashDedupCluster,
     MinhashDedupFilter,
+    MinhashDedupInMemory,
     MinhashDedupSignature,
 )
 from .sentence_dedup import SentDedupConfig, SentenceDedupFilter, SentenceDedupSignature, SentenceFindDedups
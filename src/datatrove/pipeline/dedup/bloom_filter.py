@@ -1,11 +1,13 @@
 import contextlib
 import math
+import os
+import shutil
 from dataclasses import dataclass, field
 
 import numpy as np
 
 from datatrove.data import Document, DocumentsPipeline
-from datatrove.io import DataFolderLike, get_datafolder
+from datatrove.io import DataFileLike, DataFolderLike, get_datafolder, open_file
 from datatrove.pipeline.base import PipelineStep
 from datatrove.pipeline.writers.disk_base import DiskWriter
 from datatrove.utils.hashing import HashConfig, create_hash_func
@@ -17,13 +19,12 @@ from datatrove.utils.word_tokenizers import load_word_tokenizer
 
 # http://en.wikipedia.org/wiki/Mersenne_prime
 _mersenne_prime = np.uint64((1 << 61) - 1)
-MAX_HASH = 1 << 32 - 1
 
 
 @dataclass
 class BloomFilterConfig:
     """
-    m_bytes: bloom filter size in bytes (actual size x8 bigger)
+    m_bytes: bloom filter size in bytes (actual size x8 bigger). Can be larger than 4Gbit, up to 2^61 bits
     k: number of hashes
     expected_elements: expected number of elements, aka
         shingles.
@@ -87,18 +88,15 @@ class SingleBloomFilter(PipelineStep):
         self.output_folder = get_datafolder(output_folder)
         self.tokenizer = load_word_tokenizer(language)
         self.config = config
-        self.bit_vector = bytearray(([0] * self.config.m_bytes))
+        self._bit_vector = None
         self.save_bloom_filter = save_bloom_filter
         self.exclusion_writer = exclusion_writer
-        # TODO: Add support for 64-bit
-        assert self.config.hash_config.precision == 32, "Bloom filter only supports 32-bit hashes"
         self.hash_fc = create_hash_func(self.config.hash_config)
-        assert self.config.m < MAX_HASH
 
         self.total_shingles = 0
         self._parameters = None
 
-        assert self.config.m_bytes < MAX_HASH, f"{MAX_HASH=} is smaller than {self.config.m_bytes=}"
+        assert self.config.m <= _mersenne_prime, f"{_mersenne_prime=} is smaller than {self.config.m=}"
         if self.config.expected_elements:
             fp = get_false_positive_prob(self.config.m_bytes, n=self.config.expected_elements, k=self.config.k)
             if fp > 0.05:
@@ -107,11 +105,20 @@ class SingleBloomFilter(PipelineStep):
                 logger.info(f"False probability = {fp:.3}")
         self.language = language
 
+    @property
+    def bit_vector(self) -> np.ndarray:
+        """Bit array of the filter, allocated on first use.
+        Bit i is bit (i % 64) of word i // 64. Little endian words give the same layout as a bytearray
+        """
+        if self._bit_vector is None:
+            self._bit_vector = np.zeros((self.config.m_bytes + 7) // 8, dtype="<u8")
+        return self._bit_vector
+
     @property
     def parameters(self):
         """Returns the parameters for the hash functions.
-            Create parameters for a random bijective permutation function
-            that maps a 32-bit hash value to another 32-bit hash value.
+            Create parameters for the random hash functions (a * x + b) % p, that map a hash value to a value
+            smaller than the mersenne prime p = 2^61 - 1.
             http://en.wikipedia.org/wiki/Universal_hashing
 
         Returns:
@@ -141,27 +148,50 @@ class SingleBloomFilter(PipelineStep):
             dtype=np.uint64,
         ).reshape((-1, 1))
 
-    def get_indexes(self, shingles: np.ndarray) -> list[list[int]]:
-        """Get indexes for the shingles with the k hashing functions"""
+    def get_indexes(self, shingles: np.ndarray) -> np.ndarray:
+        """Get indexes for the shingles with the k hashing functions
+
+        Returns:
+            numpy uint64 array of shape (len(shingles), k) with bit positions in [0, m)
+        """
         a, b = self.parameters
-        phv = np.bitwise_and((shingles * a + b) % _mersenne_prime, self.config.m_bytes)
-        return phv.tolist()
-
-    def update_bf(self, indexes: list[int]):
-        """Update the bloom filter with the indexes"""
-        for index in indexes:
-            byte_index, bit_index = divmod(index, 8)
-            mask = 1 << bit_index
-            self.bit_vector[byte_index] |= mask
-
-    def query(self, indexes: list[int]) -> bool:
-        """Query the bloom filter with the indexes"""
-        for idx in indexes:
-            byte_index, bit_index = divmod(idx, 8)
-            mask = 1 << bit_index
-            if (self.bit_vector[byte_index] & mask) == 0:
-                return False
-        return True
+        return (shingles * a + b) % _mersenne_prime % np.uint64(self.config.m)
+
+    def update_bf(self, indexes: np.ndarray):
+        """Update the bloom filter with the indexes (any shape)"""
+        indexes = indexes.ravel()
+        # bitwise_or.at so that repeated words accumulate all their bits
+        np.bitwise_or.at(self.bit_vector, indexes >> np.uint64(6), np.uint64(1) << (indexes & np.uint64(63)))
+
+    def query(self, indexes: np.ndarray) -> np.ndarray:
+        """Query the bloom filter with the indexes of each shingle
+
+        Args:
+            indexes: numpy array of shape (nr_shingles, k), see `get_indexes`
+
+        Returns:
+            boolean numpy array, True for the shingles whose k bits are all set
+        """
+        bits = (self.bit_vector[indexes >> np.uint64(6)] >> (indexes & np.uint64(63))) & np.uint64(1)
+        return np.all(bits, axis=-1)
+
+    def save_bf(self, rank: int = 0, world_size: int = 1):
+        """Save the bloom filter to `output_folder`/bloom_filter.bloom"""
+        with self.output_folder.open("bloom_filter.bloom", mode="wb") as f:
+            f.write(self.bit_vector.view(np.uint8)[: self.config.m_bytes].tobytes())
+
+    def bit_vector_lock(self, indexes: np.ndarray) -> contextlib.AbstractContextManager:
+        """Context manager held while the filter is queried and updated at `indexes` (see `get_indexes`) for a
+        document"""
+        return contextlib.nullcontext()
+
+    def task_started(self, rank: int = 0, world_size: int = 1):
+        """Called before the task processes its first document"""
+
+    def task_done(self, rank: int = 0, world_size: int = 1):
+        """Called once the task has processed all of its documents"""
+        if self.save_bloom_filter:
+            self.save_bf(rank, world_size)
 
     def step(self, doc: Document) -> bool:
         """Deduplication step
@@ -173,21 +203,17 @@ class SingleBloomFilter(PipelineStep):
             return True
         shingle_indexes = self.get_indexes(shingles)
 
-        duplicate_shingles = 0
-        indexes_to_update = []
-        for indexes in shingle_indexes:
-            if self.query(indexes):
-                duplicate_shingles += 1
-            else:
-                indexes_to_update.extend(indexes)
-
-        self.update_bf(indexes_to_update)
-        if duplicate_shingles / len(shingles) > self.config.duplicate_threshold:
+        # all the shingles are queried before the filter is updated with the new ones
+        with self.bit_vector_lock(shingle_indexes):
+            is_duplicate = self.query(shingle_indexes)
+            self.update_bf(shingle_indexes[~is_duplicate])
+        if np.count_nonzero(is_duplicate) / len(shingles) > self.config.duplicate_threshold:
             self.stat_update(StatHints.dropped)
             return False
         return True
 
     def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
+        self.task_started(rank, world_size)
         with self.exclusion_writer if self.exclusion_writer else contextlib.nullcontext() as writer:
             for doc_idx, doc in enumerate(data):
                 with self.track_time():
@@ -199,12 +225,248 @@ class SingleBloomFilter(PipelineStep):
                         continue
                 self.stat_update(StatHints.forwarded)
                 yield doc
-            if self.save_bloom_filter:
-                with self.output_folder.open("bloom_filter.bloom", mode="wb") as f:
-                    f.write(self.bit_vector)
+            self.task_done(rank, world_size)
 
         logger.info(f"{self.total_shingles=}")
         logger.info(
             f"False probability = {get_false_positive_prob(self.config.m_bytes, n=self.total_shingles, k=self.config.k):.3}"
         )
         logger.info(f"Optimal K given total shingles = {get_optimal_k(self.config.m_bytes, self.total_shingles)}")
+
+
+class SharedBloomFilter(SingleBloomFilter):
+    """Bloom filter shared by all the local workers (for instance of a LocalPipelineExecutor with workers > 1), so
+    that duplicates are also found across ranks.
+
+    The bit array is a memory mapped local file (`shared_file`, preferably on a tmpfs such as /dev/shm) that every
+    task maps. The filter is cache-line blocked: the k bits of a shingle all fall in the same 512-bit (64 bytes)
+    block, so each query/update touches a single cache line per shingle.
+    numpy has no atomic OR, so the blocks are split in `lock_stripes` contiguous ranges, each with its own
+    inter-process lock (a byte-range lock on `{shared_file}.stripes`, POSIX only). While a document is queried and
+    inserted, the stripes of all its shingles are locked, in increasing order so that workers can't deadlock. Workers
+    whose documents touch different stripes run concurrently, and two workers processing the same document at the
+    same time can't both keep it. Documents are still serialized when they share a stripe: a document with many
+    shingles touches most stripes, so only the shingling and hashing (done without any lock) run fully in parallel.
+
+    The first 64 bytes of `shared_file` (and of the saved `bloom_filter.bloom`) are a header with the layout and the
+    config of the filter (m_bytes, k, seed, n_grams and hash config) followed by the number of finished tasks.
+    If `shared_file` does not exist, or was left by a run where all the tasks finished, it is (re)created and,
+    optionally, initialized with a `bloom_filter.bloom` saved by a previous run of this block with the same config
+    (incremental dedup). Otherwise it belongs to an unfinished run and is reused, so that the tasks of that run that
+    never started can still complete it. The ranks that started are recorded in `{shared_file}.ranks`: a bloom filter
+    can not forget the documents inserted by a task that failed, so rerunning it would drop its own documents as
+    duplicates. Such a rerun raises a ValueError instead: delete `shared_file` and rerun all the tasks. A file (or
+    `load_bloom_filter`) with a different layout or config also raises a ValueError.
+    The file is not deleted at the end.
+
+    Args:
+        output_folder: output folder: local or on S3
+        config: bloom filter config. m_bytes must be a multiple of 64
+        shared_file: local path of the memory mapped filter, shared by all the workers
+        load_bloom_filter: bloom_filter.bloom file to initialize the filter with
+        save_bloom_filter: if true the last task to finish saves the bloom filter for later use
+        exclusion_writer: saves duplicated data
+        lock_stripes: number of ranges of blocks that can be locked independently
+    """
+
+    name = "🪷 Shared Bloom-filter"
+    _requires_dependencies = ["fasteners"]
+
+    BLOCK_BITS = 512
+    HEADER_BYTES = 64
+    # first word of the header, the last byte is the version of the layout
+    MAGIC = int.from_bytes(b"DTBLOOM1", "little")
+    # value of the finished tasks counter once all the tasks of a run are done
+    FINISHED = np.iinfo(np.uint64).max
+
+    def __init__(
+        self,
+        output_folder: DataFolderLike,
+        config: BloomFilterConfig,
+        shared_file: str,
+        load_bloom_filter: DataFileLike | None = None,
+        save_bloom_filter: bool = False,
+        exclusion_writer: DiskWriter = None,
+        language: str = Languages.english,
+        lock_stripes: int = 64,
+    ):
+        super().__init__(output_folder, config, save_bloom_filter, exclusion_writer, language)
+        if self.config.m_bytes % (self.BLOCK_BITS // 8):
+            raise ValueError(f"m_bytes must be a multiple of {self.BLOCK_BITS // 8}, got {self.config.m_bytes}")
+        self.shared_file = shared_file
+        self.load_bloom_filter = load_bloom_filter
+        self.lock_stripes = lock_stripes
+        self._header = None
+        self._lock = None
+        self._stripes_fd = None
+
+    @property
+    def parameters(self):
+        """Same as `SingleBloomFilter.parameters`, with an additional hash function to choose the block"""
+        if self._parameters is None:
+            gen = np.random.RandomState(self.config.seed)
+            self._parameters = (
+                gen.randint(1, _mersenne_prime, dtype=np.uint64, size=(1, self.config.k + 1)),
+                gen.randint(0, _mersenne_prime, dtype=np.uint64, size=(1, self.config.k + 1)),
+            )
+        return self._parameters
+
+    def get_indexes(self, shingles: np.ndarray) -> np.ndarray:
+        """Get indexes for the shingles: the first hash function picks a block and the k others a bit inside it
+
+        Returns:
+            numpy uint64 array of shape (len(shingles), k) with bit positions in [0, m)
+        """
+        a, b = self.parameters
+        phv = (shingles * a + b) % _mersenne_prime
+        nr_blocks = np.uint64(self.config.m // self.BLOCK_BITS)
+        return (phv[:, :1] % nr_blocks) * np.uint64(self.BLOCK_BITS) + phv[:, 1:] % np.uint64(self.BLOCK_BITS)
+
+    @property
+    def lock(self):
+        if self._lock is None:
+            from fasteners import InterProcessLock
+
+            self._lock = InterProcessLock(f"{self.shared_file}.lock")
+        return self._lock
+
+    @property
+    def header(self) -> np.ndarray:
+        """Header identifying the layout and config of the filter. The last word is the finished tasks counter"""
+        return np.array(
+            [
+                self.MAGIC,
+                self.config.m_bytes,
+                self.config.k,
+                self.config.seed,
+                self.config.n_grams,
+                self.config.hash_config.precision,
+                ("sha1", "xxhash").index(self.config.hash_config.hash_fc),
+                0,
+            ],
+            dtype="<u8",
+        )
+
+    def check_header(self, header: bytes, size: int, path: str):
+        """Raise a ValueError if the file at `path`, of `size` bytes and starting with `header`, is not a filter with
+        this layout and config"""
+        if size != self.HEADER_BYTES + self.config.m_bytes:
+            raise ValueError(
+                f"{path} has {size} bytes instead of {self.HEADER_BYTES + self.config.m_bytes}. Was it created with a "
+                f"different m_bytes, or by a SingleBloomFilter?"
+            )
+        header = np.frombuffer(header, dtype="<u8")
+        if header[0] != self.MAGIC:
+            raise ValueError(f"{path} is not a {type(self).__name__} file. Was it created by a SingleBloomFilter?")
+        if not np.array_equal(header[1:-1], self.header[1:-1]):
+            raise ValueError(
+                f"{path} was created with a different config: (m_bytes, k, seed, n_grams, hash precision, hash_fc) "
+                f"is {tuple(header[1:-1].tolist())} instead of {tuple(self.header[1:-1].tolist())}"
+            )
+
+    @property
+    def bit_vector(self) -> np.ndarray:
+        """Memory mapped bit array, created (and initialized) by the first task to use it"""
+        if self._bit_vector is None:
+            with self.lock:
+                if not os.path.exists(self.shared_file) or os.path.getsize(self.shared_file) == 0:
+                    self._create_shared_file()
+                else:
+                    with open(self.shared_file, "rb") as f:
+                        header = f.read(self.HEADER_BYTES)
+                    self.check_header(header, os.path.getsize(self.shared_file), self.shared_file)
+                    if np.frombuffer(header, dtype="<u8")[-1] == self.FINISHED:
+                        logger.info(f"All the tasks of the run that created {self.shared_file} ended, recreating it.")
+                        self._create_shared_file()
+                    else:
+                        logger.info(f"Reusing {self.shared_file} of an unfinished run.")
+            # the header keeps the number of finished tasks, see `task_done`
+            self._header = np.memmap(self.shared_file, dtype="<u8", mode="r+", shape=(self.HEADER_BYTES // 8,))
+            self._bit_vector = np.memmap(
+                self.shared_file, dtype="<u8", mode="r+", offset=self.HEADER_BYTES, shape=(self.config.m_bytes // 8,)
+            )
+        return self._bit_vector
+
+    @property
+    def ranks_folder(self) -> str:
+        """Folder with a file per rank that started inserting documents in `shared_file`"""
+        return f"{self.shared_file}.ranks"
+
+    def _create_shared_file(self):
+        data = None
+        if self.load_bloom_filter:
+            logger.info(f"Initializing the bloom filter with {self.load_bloom_filter}")
+            path, kwargs = self.load_bloom_filter, {}
+            if isinstance(path, tuple):
+                path, kwargs = path
+            with open_file(path, mode="rb", **kwargs) as bf:
+                data = bf.read()
+            self.check_header(data[: self.HEADER_BYTES], len(data), path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.shared_file)), exist_ok=True)
+        with open(self.shared_file, "wb") as f:
+            f.truncate(self.HEADER_BYTES + self.config.m_bytes)
+            f.write(self.header.tobytes())
+            if data is not None:
+                f.write(data[self.HEADER_BYTES :])
+        shutil.rmtree(self.ranks_folder, ignore_errors=True)
+
+    def get_stripes(self, indexes: np.ndarray) -> np.ndarray:
+        """Sorted unique lock stripes of the blocks of `indexes`"""
+        nr_blocks = np.uint64(self.config.m // self.BLOCK_BITS)
+        blocks = indexes[:, 0] // np.uint64(self.BLOCK_BITS)
+        return np.unique(blocks * np.uint64(self.lock_stripes) // nr_blocks)
+
+    @contextlib.contextmanager
+    def bit_vector_lock(self, indexes: np.ndarray):
+        import fcntl
+
+        # map the file (which may need the global lock to create it) before taking any lock
+        _ = self.bit_vector
+        if self._stripes_fd is None:
+            self._stripes_fd = os.open(f"{self.shared_file}.stripes", os.O_RDWR | os.O_CREAT)
+        # byte i of the stripes file is the lock of stripe i. Runs of consecutive stripes are locked with one call
+        stripes = self.get_stripes(indexes)
+        breaks = np.flatnonzero(np.diff(stripes) > 1) + 1
+        runs = [(int(run[0]), len(run)) for run in np.split(stripes, breaks)]
+        locked = []
+        try:
+            for start, length in runs:
+                fcntl.lockf(self._stripes_fd, fcntl.LOCK_EX, length, start)
+                locked.append((start, length))
+            yield
+        finally:
+            for start, length in locked:
+                fcntl.lockf(self._stripes_fd, fcntl.LOCK_UN, length, start)
+
+    def task_started(self, rank: int = 0, world_size: int = 1):
+        """Records that `rank` inserts documents in the filter, refusing to rerun a rank that already did"""
+        _ = self.bit_vector
+        with self.lock:
+            rank_file = os.path.join(self.ranks_folder, f"{rank:05d}")
+            if os.path.exists(rank_file):
+                raise ValueError(
+                    f"Task {rank} already inserted documents in {self.shared_file} in a run that did not finish. They "
+                    f"can not be removed from the filter, so rerunning this task would drop its own documents as "
+                    f"duplicates. Delete {self.shared_file} and rerun all the tasks."
+                )
+            os.makedirs(self.ranks_folder, exist_ok=True)
+            open(rank_file, "w").close()
+
+    def task_done(self, rank: int = 0, world_size: int = 1):
+        """Only the last task to finish saves the filter, as it is the only one that has seen all the documents"""
+        bit_vector = self.bit_vector
+        with self.lock:
+            self._header[-1] += 1
+            if self._header[-1] < world_size:
+                return
+            if self.save_bloom_filter:
+                self.save_bf(rank, world_size)
+            self._header[-1] = self.FINISHED
+            self._header.flush()
+            bit_vector.flush()
+
+    def save_bf(self, rank: int = 0, world_size: int = 1):
+        """Save the header and the bloom filter to `output_folder`/bloom_filter.bloom"""
+        with self.output_folder.open("bloom_filter.bloom", mode="wb") as f:
+            f.write(self.header.tobytes())
+            f.write(self.bit_vector.view(np.uint8)[: self.config.m_bytes].tobytes())
@@ -0,0 +1,131 @@
+"""
+Exact document deduplication: documents whose normalized text is identical are removed.
+It works exactly like url deduplication, with the hash of the normalized text instead of the hash of the url. As it is
+much cheaper than minhash, it can be used to remove exact duplicates before `MinhashDedupSignature`.
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable
+
+from datatrove.data import Document
+from datatrove.io import DataFolderLike
+from datatrove.utils.hashing import HashConfig
+from datatrove.utils.text import TextNormConfig, simplify_text
+
+from ..writers.disk_base import DiskWriter
+from .url_dedup import UrlDedupBuildIndex, UrlDedupFilter, UrlDedupSignature, UrlFindDedups
+
+
+@dataclass
+class ExactDedupConfig:
+    """
+    Args:
+        norm_config: normalization applied to the text (with `simplify_text`) before hashing it
+        document_priority: Callable[[Document], int] Function for determining the priority of a document.
+            Only the document with the highest priority will be preserved, out of duplicates.
+            The document priority must be in range [1, 65535]
+    """
+
+    norm_config: TextNormConfig = field(default_factory=TextNormConfig)
+    document_priority: Callable[[Document], int] | None = None
+    hash_config: HashConfig = field(default_factory=HashConfig)
+    only_dedup_in_index: bool = True
+
+
+class ExactDedupSignature(UrlDedupSignature):
+    """ExactDedup: First pipeline step
+        Creates a signature for each document from the hash of its normalized text, the priority and the doc id.
+        Signatures are sorted and split across `finder_workers` by hash range, see `UrlDedupSignature`.
+
+    Args:
+        output_folder: folder where signatures are saved
+        finder_workers: number of workers used in finder stage of deduplication
+        config: configuration for the dedup
+        batch_size: number of documents normalized and hashed together
+    """
+
+    name = "💥 exact-deduplication stage 1"
+
+    def __init__(
+        self,
+        output_folder: DataFolderLike,
+        finder_workers: int = 1,
+        config: ExactDedupConfig | None = None,
+        batch_size: int = 1000,
+    ):
+        # texts are rarely repeated exactly before normalization, so caching them is not worth the memory
+        super().__init__(output_folder, finder_workers, config or ExactDedupConfig(), batch_size, url_cache_size=0)
+
+    def get_keys(self, docs: list[Document]) -> list[str]:
+        """Strings that are hashed to build the signatures: the normalized text of each document"""
+        return [simplify_text(doc.text, self.config.norm_config) for doc in docs]
+
+
+class ExactFindDedups(UrlFindDedups):
+    """ExactDedup: Second pipeline step
+        Merges the signatures of the first step and saves the ids of the documents whose normalized text was already
+        seen (or is in the index), keeping the one with the highest priority. See `UrlFindDedups`.
+
+    Args:
+        data_folder: data folder where signatures are saved
+        output_folder: folder where duplicates are saved
+        index_folder: folder where index files are saved
+        config: configuration for the dedup
+        lines_to_buffer: number of signatures read at a time from each file
+    """
+
+    name = "💥 exact-deduplication stage 2"
+
+    def __init__(
+        self,
+        data_folder: DataFolderLike,
+        output_folder: DataFolderLike,
+        index_folder: DataFolderLike | None = None,
+        config: ExactDedupConfig | None = None,
+        lines_to_buffer: int = 1000,
+    ):
+        super().__init__(data_folder, output_folder, index_folder, config or ExactDedupConfig(), lines_to_buffer)
+
+
+class ExactDedupFilter(UrlDedupFilter):
+    """ExactDedup: Third pipeline step
+        ExactDedupFilter reads a DocumentPipeline and removes the duplicated documents found at stage 2
+
+    Args:
+        data_folder: data folder to get duplicate files.
+        config: config for the dedup
+        exclusion_writer: writer to save excluded documents
+    """
+
+    name = "💥 exact-deduplication stage 3"
+
+    def __init__(
+        self,
+        data_folder: DataFolderLike,
+        config: ExactDedupConfig | None = None,
+        exclusion_writer: DiskWriter | None = None,
+    ):
+        super().__init__(data_folder, config or ExactDedupConfig(), exclusion_writer)
+
+
+class ExactDedupBuildIndex(UrlDedupBuildIndex):
+    """ExactDedup: Only build an index
+    Works exactly the same as UrlDedupBuildIndex
+
+    Args:
+        data_folder: data folder to get signature files.
+        output_folder: folder where index is saved
+        index_name: name of the index
+    """
+
+    name = "💥 exact-deduplication build index"
+
+    def __init__(
+        self,
+        data_folder: DataFolderLike,
+        output_folder: DataFolderLike,
+        index_name: str,
+        config: ExactDedupConfig | None = None,
+        lines_to_buffer: int = 1000,
+    ):
+        super().__init__(data_folder, output_folder, index_name, config or ExactDedupConfig(), lines_to_buffer)
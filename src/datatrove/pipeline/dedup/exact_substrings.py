@@ -9,12 +9,19 @@ TLDR
 
  ... call deduplicate-text-datasets scripts
      in particular `cargo run self-similar ...` and `cargo run self-similar` need to be called
+     or run ESFindDuplicateRanges, which finds the same duplicated ranges without leaving python
+
 
 3) DedupReader reads docs and ranges at the same time and remove duplicates.
 
 """
 
+import json
+import os
 import struct
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import BinaryIO, Generator
 
 import numpy as np
@@ -85,12 +92,20 @@ class ESDatasetToSequence(PipelineStepWithTokenizer):
 class ESMergeSequences(PipelineStep):
     """STAGE 2
     It merges all the sequences from stage 1 into a big sequence. It saves a file with the cumulative bytes offset
-    of every single sequence.
+    of every single sequence, and the dtype of the offsets (uint64) in a `.info.dtype` file next to it.
+
+    With `virtual=True` the sequences are not copied: the big sequence is only described by a manifest (json with the
+    sequence files, in order, and their offsets) and later stages read (memory map) the sequence files directly.
+    The big sequence (or manifest) left by a previous run in the other mode is deleted.
+    Otherwise, the sequences are read in ranges of `bytes_per_batch` bytes by `max_workers` threads (useful for remote
+    files) and written in order to the big sequence. Up to `max_workers * bytes_per_batch` bytes are kept in memory.
 
     Args:
         data_folder: folder where sequences were saved in stage 1 and where the big sequence will be saved
         tasks_stage_1: number of tasks used in stage 1
         bytes_per_batch: number of bytes read per sequence
+        virtual: only save a manifest instead of copying the sequences
+        max_workers: number of threads reading the sequences
     """
 
     type = "🫂 - DEDUP"
@@ -101,32 +116,277 @@ class ESMergeSequences(PipelineStep):
         data_folder: DataFolderLike,
         tasks_stage_1: int,
         bytes_per_batch: int = int(500e6),
+        virtual: bool = False,
+        max_workers: int = 4,
     ):
         super().__init__()
         self.data_folder = get_datafolder(data_folder)
         self.tasks_stage_1 = tasks_stage_1
         self.bytes_per_batch = bytes_per_batch
+        self.virtual = virtual
+        self.max_workers = max_workers
+
+    def read_ranges(self, files: list[str], sizes: list[int]) -> Generator[bytes, None, None]:
+        """Reads the files in ranges of `bytes_per_batch` bytes, in parallel, and yields the ranges in order"""
+        ranges = [
+            (file, start, min(start + self.bytes_per_batch, size))
+            for file, size in zip(files, sizes)
+            for start in range(0, size, self.bytes_per_batch)
+        ]
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            pending = deque()
+            for file, start, end in ranges:
+                pending.append(pool.submit(self.data_folder.cat_file, file, start=start, end=end))
+                if len(pending) >= self.max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
     def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
-        bytes_per_sequence = [0]
         with self.stats.time_stats:
             assert world_size == 1, f"{world_size=} can't be greater than 1!"
             all_files: list[str] = self.data_folder.list_files(glob_pattern=EH.stage_1_sequence)
             assert len(all_files) == self.tasks_stage_1
-            with self.data_folder.open(f"dataset{EH.stage_2_big_sequence}", mode="wb") as f_sequence:
-                for file in all_files:
-                    len_sequence = 0
-                    with self.data_folder.open(file, "rb") as f:
-                        while True:
-                            sequence = f.read(self.bytes_per_batch)
-                            f_sequence.write(sequence)
-                            len_sequence += len(sequence)
-                            if len(sequence) != self.bytes_per_batch:
-                                break
-                        bytes_per_sequence.append(bytes_per_sequence[-1] + len_sequence)
-
-                with self.data_folder.open(f"bytes_offsets{EH.stage_2_bytes_offset}", mode="wb") as f_bytes:
-                    f_bytes.write(np.array([bytes_per_sequence], np.uint32).tobytes())
+            sizes = [self.data_folder.size(file) for file in all_files]
+            bytes_per_sequence = np.cumsum([0] + sizes, dtype=np.uint64)
+            # later stages read the big sequence or the manifest: only keep the one written by this run
+            stale_file = f"dataset{EH.stage_2_big_sequence if self.virtual else EH.stage_2_manifest}"
+            if self.data_folder.exists(stale_file):
+                self.data_folder.rm(stale_file)
+            if self.virtual:
+                with self.data_folder.open(f"dataset{EH.stage_2_manifest}", mode="wt") as f_manifest:
+                    json.dump({"files": all_files, "offsets": bytes_per_sequence.tolist()}, f_manifest)
+            else:
+                with self.data_folder.open(f"dataset{EH.stage_2_big_sequence}", mode="wb") as f_sequence:
+                    for sequence in self.read_ranges(all_files, sizes):
+                        f_sequence.write(sequence)
+
+            with self.data_folder.open(f"bytes_offsets{EH.stage_2_bytes_offset}", mode="wb") as f_bytes:
+                f_bytes.write(bytes_per_sequence.astype("<u8").tobytes())
+            with self.data_folder.open(f"bytes_offsets{EH.stage_2_bytes_offset_dtype}", mode="wt") as f_dtype:
+                f_dtype.write(np.dtype("<u8").str)
+
+
+class ConcatenatedSequence:
+    """Read-only concatenation of memory mapped files, that can be sliced like a single 1D array
+
+    Args:
+        paths: local paths of the files, in order
+        dtype: dtype of the values in the files
+    """
+
+    def __init__(self, paths: list[str], dtype: np.dtype):
+        self.dtype = np.dtype(dtype)
+        self.pieces = [np.memmap(path, dtype=self.dtype, mode="r") for path in paths if os.path.getsize(path)]
+        self.offsets = np.cumsum([0] + [len(piece) for piece in self.pieces])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, key: slice) -> np.ndarray:
+        start, stop, step = key.indices(len(self))
+        assert step == 1, "only contiguous slices are supported"
+        piece_i = np.searchsorted(self.offsets, start, side="right") - 1
+        parts = []
+        while start < stop:
+            end = min(stop, self.offsets[piece_i + 1])
+            parts.append(self.pieces[piece_i][start - self.offsets[piece_i] : end - self.offsets[piece_i]])
+            start, piece_i = end, piece_i + 1
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=self.dtype)
+
+
+class ESFindDuplicateRanges(PipelineStep):
+    """STAGE 2.5
+    Replaces `cargo run self-similar` + `cargo run collect` of deduplicate-text-datasets: finds all the substrings of
+    the big sequence of at least `length_threshold` bytes that appear more than once and saves their (merged) byte
+    ranges, in the `.bytearange` format read by ESRangeRemover.
+
+    The big sequence is memory mapped as uint16 tokens (all documents have an even number of bytes). Instead of the
+    full suffix array, we only need to know which suffixes share a prefix of at least `length_threshold` bytes with
+    another one, so we use prefix doubling up to that length: the windows of 2k tokens starting at i are ranked from
+    the ranks of the windows of k tokens starting at i and i + k. Each doubling step groups the rank pairs with an
+    external sort: pairs are partitioned by range of the first rank into bucket files of about `chunk_size` pairs,
+    that are sorted one at a time (each chunk appends its slices to the bucket files, which are not kept open). Ranks
+    are saved to memory mapped files, so sequences much larger than memory can be processed (with a few times the
+    size of the sequence of free space in `tmp_dir`).
+
+    Args:
+        data_folder: folder where the big sequence was saved in stage 2 and where the byte ranges will be saved
+        length_threshold: minimum length in bytes of the duplicated substrings (--length-threshold of
+            deduplicate-text-datasets)
+        chunk_size: number of positions processed at a time (and size of the sorted buckets)
+        tmp_dir: local folder for the temporary files. Defaults to the system temporary folder
+    """
+
+    type = "🫂 - DEDUP"
+    name = "🪞 - exact-substrings find duplicates"
+
+    def __init__(
+        self,
+        data_folder: DataFolderLike,
+        length_threshold: int = 100,
+        chunk_size: int = 2**24,
+        tmp_dir: str | None = None,
+    ):
+        super().__init__()
+        self.data_folder = get_datafolder(data_folder)
+        if length_threshold < 2:
+            raise ValueError("length_threshold must be >= 2")
+        self.length_threshold = length_threshold
+        self.chunk_size = chunk_size
+        self.tmp_dir = tmp_dir
+
+    def sorted_pairs(
+        self, ranks: np.ndarray | ConcatenatedSequence, max_rank: int, shift: int, nr_pairs: int, tmp_dir: str
+    ) -> Generator[tuple[np.ndarray, np.ndarray], None, None]:
+        """Sorts the pairs (ranks[i], ranks[i + shift]) for i < nr_pairs out-of-core.
+
+        Yields:
+            for each bucket, in increasing order of pairs: positions i sorted by pair and a boolean array that is True
+            where a new pair starts
+        """
+        nr_buckets = max(1, -(-nr_pairs // self.chunk_size))
+        # pairs of 32 bits ranks are packed in a single uint64 key, which is much faster to sort than 2 columns
+        packed = ranks.dtype.itemsize <= 4
+        pair_fields = [("key", "<u8")] if packed else [("first", ranks.dtype), ("second", ranks.dtype)]
+        pair_dtype = np.dtype(pair_fields + [("pos", "<u8")])
+        paths = [os.path.join(tmp_dir, f"{bucket:05d}.pairs") for bucket in range(nr_buckets)]
+        for start in range(0, nr_pairs, self.chunk_size):
+            end = min(start + self.chunk_size, nr_pairs)
+            first = ranks[start:end].astype(np.uint64)
+            second = ranks[start + shift : end + shift]
+            pairs = np.empty(end - start, dtype=pair_dtype)
+            if packed:
+                pairs["key"] = (first << np.uint64(32)) | second
+            else:
+                pairs["first"], pairs["second"] = first, second
+            pairs["pos"] = np.arange(start, end, dtype=np.uint64)
+            bounds = np.array([0, len(pairs)])
+            if nr_buckets > 1:
+                buckets = first * np.uint64(nr_buckets) // np.uint64(max_rank + 1)
+                # (stable) radix sort when the bucket ids fit in 16 bits
+                order = np.argsort(buckets.astype(np.uint16) if nr_buckets <= 2**16 else buckets, kind="stable")
+                pairs, bounds = pairs[order], np.searchsorted(buckets[order], np.arange(nr_buckets + 1))
+            # each slice is appended to its bucket file, so that only one file is open at a time
+            for bucket in np.flatnonzero(np.diff(bounds)):
+                with open(paths[bucket], "ab") as f:
+                    pairs[bounds[bucket] : bounds[bucket + 1]].tofile(f)
+
+        for path in paths:
+            if not os.path.exists(path):
+                # no pairs in this bucket
+                continue
+            pairs = np.fromfile(path, dtype=pair_dtype)
+            os.remove(path)
+            if packed:
+                keys = pairs["key"]
+                order = np.argsort(keys)
+                keys = keys[order]
+                is_new_pair = np.ones(len(pairs), dtype=bool)
+                is_new_pair[1:] = keys[1:] != keys[:-1]
+            else:
+                order = np.lexsort((pairs["second"], pairs["first"]))
+                first, second = pairs["first"][order], pairs["second"][order]
+                is_new_pair = np.ones(len(pairs), dtype=bool)
+                is_new_pair[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+            yield pairs["pos"][order], is_new_pair
+
+    def find_duplicates(self, tokens: np.ndarray | ConcatenatedSequence, window: int, tmp_dir: str) -> np.ndarray:
+        """Marks the positions whose `window` tokens also appear somewhere else in tokens
+
+        Returns:
+            memory mapped boolean array with one value per window start
+        """
+        nr_windows = len(tokens) - window + 1
+        rank_dtype = np.uint32 if len(tokens) < 2**32 else np.uint64
+        ranks, max_rank, length, ranks_path = tokens, np.iinfo(tokens.dtype).max, 1, None
+        # prefix doubling: ranks of the windows of `length` tokens, up to the largest power of 2 <= window
+        while 2 * length <= window:
+            nr_pairs = len(tokens) - 2 * length + 1
+            new_ranks_path = os.path.join(tmp_dir, f"ranks_{2 * length}")
+            new_ranks = np.memmap(new_ranks_path, dtype=rank_dtype, mode="w+", shape=(nr_pairs,))
+            next_rank = 0
+            for positions, is_new_pair in self.sorted_pairs(ranks, max_rank, length, nr_pairs, tmp_dir):
+                new_ranks[positions] = next_rank + np.cumsum(is_new_pair) - 1
+                next_rank += int(np.count_nonzero(is_new_pair))
+            new_ranks.flush()
+            del ranks
+            if ranks_path:
+                os.remove(ranks_path)
+            ranks, max_rank, length, ranks_path = new_ranks, next_rank - 1, 2 * length, new_ranks_path
+
+        # windows of `window` tokens are made of two overlapping windows of `length` tokens
+        is_duplicate = np.memmap(os.path.join(tmp_dir, "duplicates"), dtype=bool, mode="w+", shape=(nr_windows,))
+        for positions, is_new_pair in self.sorted_pairs(ranks, max_rank, window - length, nr_windows, tmp_dir):
+            group_ids = np.cumsum(is_new_pair) - 1
+            is_duplicate[positions] = np.bincount(group_ids)[group_ids] > 1
+        return is_duplicate
+
+    def get_ranges(self, is_duplicate: np.ndarray, window: int) -> Generator[tuple[int, int], None, None]:
+        """Merges the overlapping (or touching) windows [i, i + window) of the duplicated positions i"""
+        current = None
+        for start in range(0, len(is_duplicate), self.chunk_size):
+            starts = np.flatnonzero(is_duplicate[start : start + self.chunk_size]) + start
+            if not len(starts):
+                continue
+            # all the windows have the same length: a new range starts after each gap
+            breaks = np.flatnonzero(starts[1:] > starts[:-1] + window) + 1
+            range_starts = starts[np.concatenate([[0], breaks])]
+            range_ends = starts[np.concatenate([breaks - 1, [len(starts) - 1]])] + window
+            for a, b in zip(range_starts.tolist(), range_ends.tolist()):
+                if current and a <= current[1]:
+                    current = (current[0], b)
+                    continue
+                if current:
+                    yield current
+                current = (a, b)
+        if current:
+            yield current
+
+    def load_tokens(self, tmp_dir: str) -> ConcatenatedSequence:
+        """Memory maps the big sequence, or the sequence files listed in its manifest (see ESMergeSequences).
+        Remote files are downloaded to `tmp_dir` first.
+        """
+        has_big_sequence = self.data_folder.exists(f"dataset{EH.stage_2_big_sequence}")
+        if has_big_sequence and self.data_folder.exists(f"dataset{EH.stage_2_manifest}"):
+            raise ValueError(
+                f"Found both dataset{EH.stage_2_big_sequence} and dataset{EH.stage_2_manifest}: delete the one that "
+                f"was not written by the last run of stage 2."
+            )
+        if has_big_sequence:
+            files = [f"dataset{EH.stage_2_big_sequence}"]
+        else:
+            with self.data_folder.open(f"dataset{EH.stage_2_manifest}", mode="rt") as f_manifest:
+                files = json.load(f_manifest)["files"]
+        paths = []
+        for file_i, file in enumerate(files):
+            if self.data_folder.is_local():
+                paths.append(self.data_folder.resolve_paths(file))
+            else:
+                paths.append(os.path.join(tmp_dir, f"{file_i:05d}{EH.stage_1_sequence}"))
+                self.data_folder.get(file, paths[-1])
+            # documents are made of 2 bytes tokens and separators
+            assert os.path.getsize(paths[-1]) % 2 == 0, f"{file} should have an even number of bytes"
+        return ConcatenatedSequence(paths, dtype="<u2")
+
+    def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
+        assert world_size == 1, f"{world_size=} can't be greater than 1!"
+        # a byte range of length_threshold bytes always contains this many whole tokens
+        window = -(-self.length_threshold // 2)
+        with self.stats.time_stats, tempfile.TemporaryDirectory(dir=self.tmp_dir) as tmp_dir:
+            tokens = self.load_tokens(tmp_dir)
+            nr_ranges = 0
+            with self.data_folder.open(f"dataset{EH.stage_3_bytes_ranges}", mode="wt") as f_ranges:
+                # same format as the output of `cargo run collect`
+                f_ranges.write("out\n")
+                if len(tokens) >= window:
+                    for a, b in self.get_ranges(self.find_duplicates(tokens, window, tmp_dir), window):
+                        f_ranges.write(f"{2 * a} {2 * b}\n")
+                        nr_ranges += 1
+                        self.stat_update("duplicated_bytes", value=2 * (b - a))
+            logger.info(f"Found {nr_ranges} duplicated ranges.")
 
 
 def read_bytes(x):
@@ -181,7 +441,13 @@ class ESRangeRemover(PipelineStepWithTokenizer):
         offset_array_file: str = self.sequence_folder.list_files(glob_pattern=EH.stage_2_bytes_offset)[0]
         with self.sequence_folder.open(offset_array_file, "rb") as f:
             offset_array = f.read()
-        self.sequence_bytes_offset = np.frombuffer(offset_array, dtype=np.uint32)
+        # offsets saved without a dtype file are uint32
+        offsets_dtype = "<u4"
+        dtype_file = offset_array_file.removesuffix(EH.stage_2_bytes_offset) + EH.stage_2_bytes_offset_dtype
+        if self.sequence_folder.exists(dtype_file):
+            with self.sequence_folder.open(dtype_file, "rt") as f:
+                offsets_dtype = f.read().strip()
+        self.sequence_bytes_offset = np.frombuffer(offset_array, dtype=offsets_dtype).astype(np.int64)
         logger.info(f"{self.rank=}, -> {self.sequence_bytes_offset[self.rank]=}")
 
     def get_bytearange(self, bytes_range_file: BinaryIO):
@@ -1,23 +1,34 @@
 import contextlib
-import heapq
+import json
 import os
 import re
 import struct
+import time
+import uuid
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Generator
+from typing import Callable, Generator
 
 import numpy as np
 from fsspec.spec import AbstractBufferedFile
 from tqdm import tqdm
 
 from datatrove.data import DocumentsPipeline
-from datatrove.io import DataFolderLike, get_datafolder
+from datatrove.io import DataFolder, DataFolderLike, get_datafolder
 from datatrove.pipeline.base import PipelineStep
 from datatrove.pipeline.writers.disk_base import DiskWriter
-from datatrove.utils.binaryio import read_tuples_from_file, seek_to_start
+from datatrove.utils.batching import batched
+from datatrove.utils.binaryio import (
+    get_lookup_array,
+    merge_sorted_np_chunks,
+    read_np_chunks_from_file,
+    read_np_from_files,
+    read_tuples_from_file,
+    seek_to_start,
+)
 from datatrove.utils.hashing import HashConfig, create_hash_func
 from datatrove.utils.logging import logger
+from datatrove.utils.stats import MetricStats
 from datatrove.utils.text import TextNormConfig, ngrams, simplify_text
 from datatrove.utils.typeshelper import Languages, StatHints
 from datatrove.utils.word_tokenizers import load_word_tokenizer
@@ -45,18 +56,45 @@ class MinhashConfig:
         num_buckets: number of buckets to use
         hashes_per_bucket: number of hashes per bucket
         seed: random seed used to generate the hash function parameters. Should be the same on all workers to ensure they all have the same parameters
+        one_permutation: use one permutation hashing (a single hash per shingle, split into num_buckets *
+            hashes_per_bucket bins) with densification of the empty bins, instead of one permutation per hash.
+            Much cheaper to compute, with a similar collision probability for documents with enough shingles
+        bits_per_hash: only keep the lowest `bits_per_hash` bits of each hash (b-bit minhash) and pack several of
+            them in each stored value. Reduces the size of the signature files and the I/O of the next stages, at the
+            cost of a few more false positive candidates (two different hashes collide with probability 2^-b)
     """
 
     n_grams: int = 5
     num_buckets: int = 14
     hashes_per_bucket: int = 8
     seed: int = 1
+    one_permutation: bool = False
+    bits_per_hash: int | None = None
 
     norm_config: TextNormConfig = field(default_factory=TextNormConfig)
     hash_config: HashConfig = field(default_factory=HashConfig)
 
+    def __post_init__(self):
+        # packed values must stay below the largest hash stage 2 considers (see `MinhashDedupBuckets`)
+        self._bits_per_word = 60 if self.hash_config.precision == 64 else 31
+        if self.bits_per_hash is not None and not 1 <= self.bits_per_hash <= self._bits_per_word:
+            raise ValueError(f"bits_per_hash must be between 1 and {self._bits_per_word}")
+
+    @property
+    def hashes_per_word(self) -> int:
+        """Number of b-bit hashes packed in each stored value (when bits_per_hash is set)"""
+        return self._bits_per_word // self.bits_per_hash if self.bits_per_hash else 1
+
+    @property
+    def sig_width(self) -> int:
+        """Number of values stored per bucket signature"""
+        return -(-self.hashes_per_bucket // self.hashes_per_word)
+
     def __str__(self):
-        return f"{self.n_grams}ng_{self.num_buckets}bs_{self.hashes_per_bucket}hs_{self.hash_config}"
+        return (
+            f"{self.n_grams}ng_{self.num_buckets}bs_{self.hashes_per_bucket}hs_{self.hash_config}"
+            f"{'_oph' if self.one_permutation else ''}{f'_{self.bits_per_hash}b' if self.bits_per_hash else ''}"
+        )
 
 
 @dataclass(order=True)
@@ -80,6 +118,11 @@ class HashSig:
         return self.reader_id != self.file_id
 
 
+def get_sig_dtype(config: MinhashConfig) -> np.dtype:
+    """Numpy dtype of a record (sig_width hashes followed by the doc id) in a .minhash.sig file"""
+    return np.dtype([("sig", f"<{config.hash_config.struct_format}", (config.sig_width,)), ("doc", "<u4")])
+
+
 def read_sigs(
     file: AbstractBufferedFile,
     reader_id: int,
@@ -98,7 +141,7 @@ def read_sigs(
         config: minhash configuration (a MinhashConfig object)
         index_file: is index file
     """
-    line_format = f"{config.hashes_per_bucket}{config.hash_config.struct_format}{'I' if not index_file else ''}"
+    line_format = f"{config.sig_width}{config.hash_config.struct_format}{'I' if not index_file else ''}"
     with file as f:
         if f.size == 0:
             return
@@ -120,14 +163,164 @@ def read_sigs(
             )
 
 
+def read_sig_chunks(
+    file: AbstractBufferedFile,
+    config: MinhashConfig,
+    index_file: bool = False,
+    min_hash: int = 0,
+    max_hash: int = _mersenne_prime,
+    chunk_size: int = 1000,
+) -> Generator[np.ndarray, None, None]:
+    """Read signatures from a file in numpy chunks (see `get_sig_dtype`)
+
+    Args:
+        file: file to read from
+        config: minhash configuration (a MinhashConfig object)
+        index_file: is index file. Index signatures are returned with doc id = SENTINEL
+        min_hash: only return signatures whose first hash is >= min_hash
+        max_hash: only return signatures whose first hash is < max_hash
+        chunk_size: number of signatures to read at a time
+    """
+    sig_dtype = get_sig_dtype(config)
+    line_format = f"{config.sig_width}{config.hash_config.struct_format}{'I' if not index_file else ''}"
+    with file as f:
+        if f.size == 0:
+            return
+        seek_to_start(f, min_hash, line_format, config.hash_config.struct_format)
+        file_dtype = sig_dtype if not index_file else np.dtype([("sig", sig_dtype["sig"])])
+        for chunk in read_np_chunks_from_file(f, file_dtype, chunk_size):
+            first_hashes = chunk["sig"][:, 0]
+            assert np.all(first_hashes[1:] >= first_hashes[:-1]), f"Hash order error. {f.tell()=}"
+            end = np.searchsorted(first_hashes, max_hash, side="left")
+            if index_file:
+                sigs = np.empty(end, dtype=sig_dtype)
+                sigs["sig"] = chunk["sig"][:end]
+                sigs["doc"] = SENTINEL
+            else:
+                sigs = chunk[:end]
+            if end:
+                yield sigs
+            if end < len(chunk):
+                break
+
+
+# evenly spaced first hashes of a sorted sig file, with the number of signatures each of them stands for
+SKETCH_DTYPE = np.dtype([("hash", "<u8"), ("count", "<u8")])
+
+
+def get_sketch_rows(nr_sigs: int, sketch_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """Rows sampled from a sorted sig file with nr_sigs signatures, and the number of signatures each of them stands for"""
+    nr_samples = min(nr_sigs, sketch_size)
+    rows = np.arange(nr_samples, dtype=np.int64) * nr_sigs // max(nr_samples, 1)
+    return rows, np.diff(np.append(rows, nr_sigs))
+
+
+def sample_sig_file(file: AbstractBufferedFile, config: MinhashConfig, sketch_size: int = 64) -> np.ndarray:
+    """Build the hash sketch of a sorted sig file by reading the first hash of evenly spaced signatures"""
+    hash_size = struct.calcsize(config.hash_config.struct_format)
+    line_size = struct.calcsize(f"<{config.sig_width}{config.hash_config.struct_format}I")
+    with file as f:
+        nr_sigs, rem = divmod(f.size, line_size)
+        assert rem == 0, "file size not divisible by line size"
+        rows, counts = get_sketch_rows(nr_sigs, sketch_size)
+        sketch = np.empty(len(rows), dtype=SKETCH_DTYPE)
+        for i, row in enumerate(rows):
+            f.seek(int(row) * line_size, os.SEEK_SET)
+            sketch["hash"][i] = struct.unpack(f"<{config.hash_config.struct_format}", f.read(hash_size))[0]
+        sketch["count"] = counts
+    return sketch
+
+
+def merge_unique_sigs(
+    sig_readers: list[Generator[np.ndarray, None, None]], config: MinhashConfig
+) -> Generator[np.ndarray, None, None]:
+    """Merge sorted signature readers (see `read_sig_chunks`) and yield sorted (N, sig_width) chunks of unique
+    signatures"""
+    for records, _ in merge_sorted_np_chunks(
+        sig_readers,
+        key=lambda records: records["sig"][:, 0],
+        lexsort_keys=lambda records, _: tuple(records["sig"][:, i] for i in reversed(range(config.sig_width))),
+    ):
+        sigs = records["sig"]
+        # equal signatures are always in the same batch. only keep the first one
+        new_sig = np.ones(len(sigs), dtype=bool)
+        new_sig[1:] = np.any(sigs[1:] != sigs[:-1], axis=1)
+        yield sigs[new_sig]
+
+
+# per bucket manifest with the fences of the compacted index segments
+INDEX_MANIFEST = "manifest.json"
+
+
+class MinhashIndexSegmentWriter:
+    """Writes an immutable index segment (a sorted .minhash.index file) and its fences: the first hash of its first and
+    last signatures and its number of signatures. The fences are saved to a .minhash.index.json file next to the
+    segment until `MinhashCompactIndex` moves them to the bucket's manifest.
+
+    Args:
+        folder: index folder
+        filename: segment file, relative to the index folder
+    """
+
+    def __init__(self, folder: DataFolder, filename: str):
+        self.folder = folder
+        self.filename = filename
+        self.file = folder.open(filename, mode="wb")
+        self.fences = {"min_hash": None, "max_hash": None, "count": 0}
+
+    def write(self, sigs: np.ndarray):
+        """Write sorted (N, sig_width) signatures"""
+        if len(sigs) == 0:
+            return
+        if self.fences["min_hash"] is None:
+            self.fences["min_hash"] = int(sigs[0, 0])
+        self.fences["max_hash"] = int(sigs[-1, 0])
+        self.fences["count"] += len(sigs)
+        self.file.write(np.ascontiguousarray(sigs).tobytes())
+
+    def close(self):
+        self.file.close()
+        with self.folder.open(f"{self.filename}.json", mode="wt") as f:
+            json.dump(self.fences, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_index_fences(index_folder: DataFolder, bucket: int) -> dict[str, dict]:
+    """Fences of the index segments of a bucket (by segment file name), from the bucket's manifest and from the .json
+    files of the segments that were not compacted yet. Segments written before fences existed are missing"""
+    fences = {}
+    if index_folder.exists(f"bucket_{bucket:03d}/{INDEX_MANIFEST}"):
+        with index_folder.open(f"bucket_{bucket:03d}/{INDEX_MANIFEST}", mode="rt") as f:
+            fences.update(json.load(f)["segments"])
+    for file in index_folder.list_files(subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.index.json"):
+        with index_folder.open(file, mode="rt") as f:
+            fences[Path(file).name.removesuffix(".json")] = json.load(f)
+    return fences
+
+
 class MinhashDedupSignature(PipelineStep):
     """Minhash Deduplication: First Pipeline Step
 
         Compute the minhash signature for each document and write it to disk.
+        Signatures are kept in a numpy buffer and each bucket is sorted and written in bulk. If the buffer exceeds
+        `sig_buffer_size` bytes, sorted chunks are spilled to disk and merged at the end.
 
     Args:
         output_folder: output folder
         config: minhash configuration (a MinhashConfig object)
+        language: language used for word tokenization
+        skip_existing_sigs: skip the computation if all the sig files for this rank already exist
+        sig_buffer_size: memory budget (in bytes) for the in-memory signature buffer
+        local_working_dir: local folder where sorted chunks are spilled when the buffer is full.
+            if None they are written to `output_folder/tmp`
+        batch_size: number of documents whose shingles and signatures are computed together
+        hash_sketch_size: number of evenly spaced hashes saved next to each sig file (in a .minhash.quantiles file),
+            used by stage 2 to split each bucket into equal hash ranges. Set to 0 to disable
     """
 
     type = "🫂 - DEDUP"
@@ -139,16 +332,27 @@ class MinhashDedupSignature(PipelineStep):
         config: MinhashConfig = None,
         language: str = Languages.english,
         skip_existing_sigs: bool = False,
+        sig_buffer_size: int = 2**30,
+        local_working_dir: DataFolderLike | None = None,
+        batch_size: int = 1000,
+        hash_sketch_size: int = 256,
     ):
         super().__init__()
-        self.output_folder = get_datafolder(output_folder)
+        self.output_folder = get_datafolder(output_folder) if output_folder else None
         self.config = config or MinhashConfig()
+        self.batch_size = batch_size
+        self.hash_sketch_size = hash_sketch_size
         self.num_hashes = self.config.num_buckets * self.config.hashes_per_bucket
         self._parameters = None
+        self._densification_probes = None
         self._hash_func = create_hash_func(self.config.hash_config)
         self.language = language
         self.word_tokenizer = load_word_tokenizer(language)
         self.skip_existing_sigs = skip_existing_sigs
+        self.sig_buffer_size = sig_buffer_size
+        self.local_working_dir = get_datafolder(local_working_dir) if local_working_dir else None
+        if self.local_working_dir and not self.local_working_dir.is_local():
+            raise ValueError("local_working_dir must be a local path")
 
     @property
     def parameters(self):
@@ -168,23 +372,33 @@ class MinhashDedupSignature(PipelineStep):
             )
         return self._parameters
 
-    def get_signature(self, shingles: np.ndarray) -> list[list[int]]:
-        """Get the signature for a set of shingles (n-grams)
+    def get_signature_array(self, shingles: np.ndarray) -> np.ndarray:
+        """Get the signature for a set of shingles (n-grams) as a flat numpy array
 
         Args:
             shingles: shingles (n-grams) numpy uint64 array of size (N, 1)
 
         Returns:
-            list (num buckets) of lists of integers (hashes)
+            numpy array of size (num_buckets * sig_width) with the hash_config dtype
         """
+        if self.config.one_permutation:
+            return self.get_signatures_batch(shingles.reshape(-1), np.array([0, len(shingles)]))[0]
         a, b = self.parameters
         phv = (shingles * a + b) % _mersenne_prime
         if self.config.hash_config.precision == 32:
             phv = np.bitwise_and(phv, self.config.hash_config.max)
-        return [
-            x.tolist()
-            for x in np.split(np.min(phv, axis=0).astype(self.config.hash_config.np_dtype), self.config.num_buckets)
-        ]
+        return self.pack_signatures(np.min(phv, axis=0, keepdims=True).astype(self.config.hash_config.np_dtype))[0]
+
+    def get_signature(self, shingles: np.ndarray) -> list[list[int]]:
+        """Get the signature for a set of shingles (n-grams)
+
+        Args:
+            shingles: shingles (n-grams) numpy uint64 array of size (N, 1)
+
+        Returns:
+            list (num buckets) of lists of integers (hashes)
+        """
+        return [x.tolist() for x in np.split(self.get_signature_array(shingles), self.config.num_buckets)]
 
     def get_shingles(self, text: str) -> np.ndarray:
         """Get shingles (hashed n-grams) from a string of text
@@ -208,6 +422,136 @@ class MinhashDedupSignature(PipelineStep):
             dtype=np.uint64,
         ).reshape((-1, 1))
 
+    def get_shingles_batch(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Get shingles (hashed n-grams) for a batch of texts, as a single flat array
+
+        Args:
+            texts: input texts
+
+        Returns:
+            tuple (shingles, offsets): flat uint64 array with the shingles of all texts and int64 array of size
+            len(texts) + 1 such that the shingles of text i are shingles[offsets[i]:offsets[i + 1]]
+        """
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+
+        def hash_all():
+            for text_i, text in enumerate(texts):
+                n_grams = [
+                    " ".join(x)
+                    for x in ngrams(
+                        self.word_tokenizer.word_tokenize(simplify_text(text, self.config.norm_config)),
+                        self.config.n_grams,
+                    )
+                ]
+                offsets[text_i + 1] = len(n_grams)
+                yield from map(self._hash_func, n_grams)
+
+        shingles = np.fromiter(hash_all(), dtype=np.uint64)
+        return shingles, np.cumsum(offsets)
+
+    def get_signatures_batch(self, shingles: np.ndarray, offsets: np.ndarray, chunk_size: int = 2048) -> np.ndarray:
+        """Get the signatures for a batch of documents from their flat shingles (see `get_shingles_batch`)
+
+        The permutations are applied to blocks of at most `chunk_size` shingles (or a single document, if it is larger)
+        so that the intermediate (chunk_size, num_hashes) matrix stays small, and the minimum of each document is
+        computed with a segmented reduction.
+
+        Args:
+            shingles: flat uint64 array of shingles
+            offsets: shingles of document i are shingles[offsets[i]:offsets[i + 1]]
+            chunk_size: number of shingles to permute at a time
+
+        Returns:
+            numpy array of size (number of documents with at least 1 shingle, num_buckets * sig_width)
+        """
+        a, b = self.parameters
+        non_empty = np.diff(offsets) > 0
+        starts, ends = offsets[:-1][non_empty], offsets[1:][non_empty]
+        if self.config.one_permutation:
+            return self.pack_signatures(self.get_one_permutation_signatures(shingles, starts, ends))
+        sigs = np.empty((len(starts), self.num_hashes), dtype=self.config.hash_config.np_dtype)
+        doc_i = 0
+        while doc_i < len(starts):
+            # take as many documents as fit in chunk_size shingles (at least one)
+            end_doc = max(doc_i + 1, int(np.searchsorted(ends, starts[doc_i] + chunk_size, side="right")))
+            phv = (shingles[starts[doc_i] : ends[end_doc - 1]].reshape((-1, 1)) * a + b) % _mersenne_prime
+            if self.config.hash_config.precision == 32:
+                phv = np.bitwise_and(phv, self.config.hash_config.max)
+            sigs[doc_i:end_doc] = np.minimum.reduceat(phv, starts[doc_i:end_doc] - starts[doc_i], axis=0)
+            doc_i = end_doc
+        return self.pack_signatures(sigs)
+
+    def get_densification_probes(self, attempt: int) -> np.ndarray:
+        """Bin each bin borrows its hash from at a given densification attempt (the same on all workers)"""
+        if self._densification_probes is None:
+            self._densification_probes = ([], np.random.RandomState(self.config.seed))
+        probes, gen = self._densification_probes
+        while len(probes) <= attempt:
+            probes.append(gen.randint(0, self.num_hashes, size=self.num_hashes))
+        return probes[attempt]
+
+    def get_one_permutation_signatures(self, shingles: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Get the signatures of non-empty documents with one permutation hashing
+
+        Each shingle is hashed once. The remainder of the hash modulo num_hashes selects its bin and the quotient is
+        its value: each bin keeps its minimum value. Empty bins are then densified (optimal densification,
+        Shrivastava 2017): they borrow the value of another bin chosen by a fixed random probe sequence, retried
+        until a non-empty bin is found, so that two documents borrow from the same bins.
+
+        Args:
+            shingles: flat uint64 array of shingles
+            starts: start offset of each document's shingles
+            ends: end offset of each document's shingles
+
+        Returns:
+            numpy array of size (len(starts), num_hashes) with the hash_config dtype
+        """
+        a, b = self.parameters
+        empty_bin = np.iinfo(np.uint64).max
+        sigs = np.full((len(starts), self.num_hashes), empty_bin, dtype=np.uint64)
+        if len(starts) == 0:
+            return sigs.astype(self.config.hash_config.np_dtype)
+        # documents with at least 1 shingle are contiguous in the flat shingles array
+        hv = (shingles[starts[0] : ends[-1]] * a[0, 0] + b[0, 0]) % _mersenne_prime
+        values = hv // np.uint64(self.num_hashes)
+        if self.config.hash_config.precision == 32:
+            values = np.bitwise_and(values, self.config.hash_config.max)
+        doc_ids = np.repeat(np.arange(len(starts)), ends - starts)
+        np.minimum.at(sigs, (doc_ids, (hv % np.uint64(self.num_hashes)).astype(np.int64)), values)
+
+        # densification
+        filled = sigs != empty_bin
+        rows, cols = np.nonzero(~filled)
+        attempt = 0
+        while len(rows):
+            sources = self.get_densification_probes(attempt)[cols]
+            found = filled[rows, sources]
+            sigs[rows[found], cols[found]] = sigs[rows[found], sources[found]]
+            rows, cols = rows[~found], cols[~found]
+            attempt += 1
+        return sigs.astype(self.config.hash_config.np_dtype)
+
+    def pack_signatures(self, sigs: np.ndarray) -> np.ndarray:
+        """Truncate the hashes to their lowest bits_per_hash bits and pack them (b-bit minhash)
+
+        Args:
+            sigs: numpy array of size (N, num_buckets * hashes_per_bucket)
+
+        Returns:
+            numpy array of size (N, num_buckets * sig_width). The first hash of each word is in its highest bits
+        """
+        if not self.config.bits_per_hash:
+            return sigs
+        bits, per_word, width = self.config.bits_per_hash, self.config.hashes_per_word, self.config.sig_width
+        values = np.bitwise_and(sigs, (1 << bits) - 1).astype(np.uint64)
+        values = values.reshape((len(sigs), self.config.num_buckets, self.config.hashes_per_bucket))
+        # pad each bucket to a whole number of words
+        values = np.pad(values, ((0, 0), (0, 0), (0, width * per_word - self.config.hashes_per_bucket)))
+        values = values.reshape((len(sigs), self.config.num_buckets, width, per_word))
+        shifts = np.arange(per_word - 1, -1, -1, dtype=np.uint64) * np.uint64(bits)
+        words = np.bitwise_or.reduce(values << shifts, axis=-1)
+        return words.reshape((len(sigs), -1)).astype(self.config.hash_config.np_dtype)
+
     def check_can_skip_sig_writing(self, rank):
         if not self.skip_existing_sigs:
             return False
@@ -227,56 +571,171 @@ class MinhashDedupSignature(PipelineStep):
             return False
 
         # check if they aren't empty and if they have a multiple of a full sig
-        sig_doc_size = struct.calcsize(f"<{self.config.hashes_per_bucket}{self.config.hash_config.struct_format}I")
+        sig_doc_size = struct.calcsize(f"<{self.config.sig_width}{self.config.hash_config.struct_format}I")
         if fsizes[0] == 0 or fsizes[0] % sig_doc_size != 0:
             return False
 
         logger.info(f"Found existing sig files with {fsizes[0] // sig_doc_size} entries. Skipping sig writing step.")
         return True
 
+    def write_sorted_sigs(self, folder: DataFolder, filename: str, sigs: np.ndarray, doc_ids: np.ndarray):
+        """Sort the signatures of a single bucket and write them with a single bulk write
+
+        Args:
+            folder: folder to write to
+            filename: file to write to
+            sigs: numpy array of size (N, sig_width)
+            doc_ids: numpy array of size N
+
+        Returns:
+            the sorted records
+        """
+        records = np.empty(len(doc_ids), dtype=get_sig_dtype(self.config))
+        order = np.lexsort((doc_ids,) + tuple(sigs[:, i] for i in reversed(range(sigs.shape[1]))))
+        records["sig"] = sigs[order]
+        records["doc"] = doc_ids[order]
+        with folder.open(filename, mode="wb") as f:
+            if folder.is_local():
+                records.tofile(f)
+            else:
+                f.write(records.tobytes())
+        return records
+
+    def get_sketch_hashes(self, records: np.ndarray) -> np.ndarray:
+        """First hashes of sorted records at the rows returned by `get_sketch_rows`"""
+        return records["sig"][get_sketch_rows(len(records), self.hash_sketch_size)[0], 0]
+
+    def write_hash_sketch(self, bucket: int, rank: int, first_hashes: np.ndarray, nr_sigs: int):
+        """Save the hash sketch of a sig file (see `get_sketch_rows`)
+
+        Args:
+            bucket: bucket of the sig file
+            rank: rank of the sig file
+            first_hashes: first hash of the signatures at the rows returned by `get_sketch_rows`
+            nr_sigs: number of signatures in the sig file
+        """
+        if self.hash_sketch_size <= 0:
+            return
+        sketch = np.empty(len(first_hashes), dtype=SKETCH_DTYPE)
+        sketch["hash"] = first_hashes
+        sketch["count"] = get_sketch_rows(nr_sigs, self.hash_sketch_size)[1]
+        with self.output_folder.open(f"bucket_{bucket:03d}/{rank:05d}.minhash.quantiles", mode="wb") as f:
+            f.write(sketch.tobytes())
+
+    def merge_sorted_chunks(self, filename: str, chunk_files: list[str], chunk_size: int, nr_sigs: int) -> np.ndarray:
+        """Merge sorted chunks (spilled when the signature buffer was full) of a single bucket into its final file
+
+        Args:
+            filename: final sig file
+            chunk_files: sorted chunk files to merge, relative to the working folder
+            chunk_size: number of records to read at a time from each chunk file
+            nr_sigs: total number of signatures in the chunk files
+
+        Returns:
+            the first hashes at the sketch rows of the merged file (see `get_sketch_rows`)
+        """
+        working_folder = self.local_working_dir or self.output_folder
+        sig_dtype = get_sig_dtype(self.config)
+        readers = [
+            read_np_chunks_from_file(file, sig_dtype, chunk_size)
+            for file in working_folder.open_files(chunk_files, mode="rb")
+        ]
+        sketch_rows, _ = get_sketch_rows(nr_sigs, self.hash_sketch_size)
+        sketch_hashes, written = [], 0
+        with self.output_folder.open(filename, mode="wb") as fo:
+            for records, _ in merge_sorted_np_chunks(
+                readers,
+                key=lambda records: records["sig"][:, 0],
+                lexsort_keys=lambda records, _: (
+                    (records["doc"],) + tuple(records["sig"][:, i] for i in reversed(range(self.config.sig_width)))
+                ),
+            ):
+                fo.write(records.tobytes())
+                rows = sketch_rows[(sketch_rows >= written) & (sketch_rows < written + len(records))]
+                sketch_hashes.append(records["sig"][rows - written, 0])
+                written += len(records)
+        for chunk_file in chunk_files:
+            working_folder.rm(chunk_file)
+        return np.concatenate([np.zeros(0, dtype=np.uint64)] + sketch_hashes)
+
     def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
         with self.track_time():
+            hpb = self.config.sig_width
             # check if we can skip the sig writing step
-            if not self.check_can_skip_sig_writing(rank):
-                buckets = [
-                    self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="wb")
-                    for bi in range(self.config.num_buckets)
-                ]
-                for doc_idx, doc in enumerate(data):
+            if self.check_can_skip_sig_writing(rank):
+                # make sure existing files are sorted
+                logger.info("Sorting buckets...")
+                for bi in range(self.config.num_buckets):
+                    with self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="rb") as fi:
+                        records = np.frombuffer(fi.read(), dtype=get_sig_dtype(self.config))
+                    records = self.write_sorted_sigs(
+                        self.output_folder, f"bucket_{bi:03d}/{rank:05d}.minhash.sig", records["sig"], records["doc"]
+                    )
+                    self.write_hash_sketch(bi, rank, self.get_sketch_hashes(records), len(records))
+                return
+
+            working_folder = self.local_working_dir or self.output_folder
+            capacity = max(1, self.sig_buffer_size // get_sig_dtype(self.config).itemsize // self.config.num_buckets)
+            sigs = np.empty((capacity, self.config.num_buckets * hpb), dtype=self.config.hash_config.np_dtype)
+            doc_ids = np.empty(capacity, dtype=np.uint32)
+            nr_sigs, total_sigs, chunk_files = 0, 0, [[] for _ in range(self.config.num_buckets)]
+
+            def spill():
+                # sort the current buffer and write one chunk per bucket
+                chunk_i = len(chunk_files[0])
+                for bi in range(self.config.num_buckets):
+                    chunk_file = f"tmp/{rank:05d}/bucket_{bi:03d}_{chunk_i:04d}.minhash.sig.chunk"
+                    self.write_sorted_sigs(
+                        working_folder, chunk_file, sigs[:nr_sigs, bi * hpb : (bi + 1) * hpb], doc_ids[:nr_sigs]
+                    )
+                    chunk_files[bi].append(chunk_file)
+
+            batch_start = 0
+            for batch in batched(data, self.batch_size):
+                for _ in batch:
                     self.stat_update(StatHints.total)
-                    shingles = self.get_shingles(doc.text)
-                    if shingles.size != 0:
-                        sig = self.get_signature(shingles)
-                        for bi, (bucket, bucket_sig) in enumerate(zip(buckets, sig)):
-                            # print(f"{self.hashes_per_bucket=} {bucket_sig=}")
-                            bucket.write(
-                                struct.pack(
-                                    f"<{self.config.hashes_per_bucket}{self.config.hash_config.struct_format}I",
-                                    *bucket_sig,
-                                    doc_idx,
-                                )
-                            )
-                for file in buckets:
-                    file.close()
+                shingles, offsets = self.get_shingles_batch([doc.text for doc in batch])
+                batch_sigs = self.get_signatures_batch(shingles, offsets)
+                batch_doc_ids = batch_start + np.flatnonzero(np.diff(offsets) > 0)
+                batch_start += len(batch)
+                total_sigs += len(batch_sigs)
+                sig_i = 0
+                while sig_i < len(batch_sigs):
+                    to_copy = min(capacity - nr_sigs, len(batch_sigs) - sig_i)
+                    sigs[nr_sigs : nr_sigs + to_copy] = batch_sigs[sig_i : sig_i + to_copy]
+                    doc_ids[nr_sigs : nr_sigs + to_copy] = batch_doc_ids[sig_i : sig_i + to_copy]
+                    nr_sigs += to_copy
+                    sig_i += to_copy
+                    if nr_sigs == capacity:
+                        logger.info(f"Signature buffer is full ({capacity} docs). Spilling sorted chunk to disk...")
+                        spill()
+                        nr_sigs = 0
 
             logger.info("Sorting buckets...")
+            if not chunk_files[0]:
+                # everything fit in memory
+                for bi in range(self.config.num_buckets):
+                    records = self.write_sorted_sigs(
+                        self.output_folder,
+                        f"bucket_{bi:03d}/{rank:05d}.minhash.sig",
+                        sigs[:nr_sigs, bi * hpb : (bi + 1) * hpb],
+                        doc_ids[:nr_sigs],
+                    )
+                    self.write_hash_sketch(bi, rank, self.get_sketch_hashes(records), nr_sigs)
+                return
+
+            if nr_sigs:
+                spill()
+            # free the buffer before merging the chunks
+            sigs = doc_ids = None
             for bi in range(self.config.num_buckets):
-                # read all records, sort and write back
-                dtype = np.dtype(
-                    [
-                        (f"field{i + 1}", f"<{self.config.hash_config.struct_format}")
-                        for i in range(self.config.hashes_per_bucket)
-                    ]
-                    + [(f"field{self.config.hashes_per_bucket + 1}", "<I")]
+                sketch_hashes = self.merge_sorted_chunks(
+                    f"bucket_{bi:03d}/{rank:05d}.minhash.sig",
+                    chunk_files[bi],
+                    max(1, capacity * self.config.num_buckets // len(chunk_files[bi])),
+                    total_sigs,
                 )
-                with self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="rb") as fi:
-                    records = np.frombuffer(fi.read(), dtype=dtype)
-
-                indices = np.argsort(records, order=dtype.names)
-
-                with self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="wb") as fo:
-                    for idx in indices:
-                        fo.write(records[idx].tobytes())
+                self.write_hash_sketch(bi, rank, sketch_hashes, total_sigs)
 
 
 class MinhashDedupBuckets(PipelineStep):
@@ -291,6 +750,10 @@ class MinhashDedupBuckets(PipelineStep):
         config: minhash configuration (a MinhashConfig object)
         only_dedup_in_index: only deduplicate versus index (ignore any matches between 2 documents in our input dataset)
         create_index_name: create index name. If this parameter is set, index files will be created with this name that other datasets can use as a reference for dedup. Set to `None` to disable index file creation.
+        lines_to_buffer: number of signatures read at a time from each file (and index segment): the size of the
+            chunks merged by the k-way merge
+
+    Index segments whose fences (see `MinhashIndexSegmentWriter`) do not overlap the hash range of a worker are skipped.
     """
 
     type = "🫂 - DEDUP"
@@ -304,7 +767,7 @@ class MinhashDedupBuckets(PipelineStep):
         config: MinhashConfig = None,
         only_dedup_in_index: bool = True,
         create_index_name: str = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = 1000,
     ):
         super().__init__()
         self.input_folder = get_datafolder(input_folder)
@@ -315,6 +778,31 @@ class MinhashDedupBuckets(PipelineStep):
         self.create_index_name = create_index_name
         self.lines_to_buffer = lines_to_buffer
 
+    def get_hash_sketch(self, sig_files: list[str]) -> np.ndarray:
+        """Combined hash sketch of all the sig files of a bucket. Uses the .minhash.quantiles files saved by stage 1
+        when they exist and samples the sig files otherwise"""
+        sketch_files = {
+            file.removesuffix(".minhash.quantiles")
+            for file in self.input_folder.list_files(
+                subdirectory=str(Path(sig_files[0]).parent), glob_pattern="*.minhash.quantiles"
+            )
+        }
+        with_sketch = [file for file in sig_files if file.removesuffix(".minhash.sig") in sketch_files]
+        sketches = [
+            read_np_from_files(
+                self.input_folder,
+                [file.removesuffix(".minhash.sig") + ".minhash.quantiles" for file in with_sketch],
+                SKETCH_DTYPE,
+            )
+        ]
+        without_sketch = [file for file in sig_files if file.removesuffix(".minhash.sig") not in sketch_files]
+        if without_sketch:
+            logger.info(f"Sampling hashes from {len(without_sketch)} sig files without a .minhash.quantiles file.")
+            sketches.extend(
+                sample_sig_file(file, self.config) for file in self.input_folder.open_files(without_sketch, mode="rb")
+            )
+        return np.concatenate(sketches)
+
     def get_worker_hash_range(self, sig_files, rank, world_size):
         workers_per_bucket = world_size // self.config.num_buckets
         bucket, bucket_worker = divmod(rank, workers_per_bucket)
@@ -323,27 +811,21 @@ class MinhashDedupBuckets(PipelineStep):
             _mersenne_prime if self.config.hash_config.precision == 64 else self.config.hash_config.max,
         )
         if workers_per_bucket > 1 and len(sig_files):
-            # take the first file and find bucket_worker boundaries. all workers in a bucket process the same set of
-            # files, so this should be consistent across workers (and span the entire range of hashes)
-            with self.input_folder.open(sig_files[0], mode="rb") as f:
-                line_size = struct.calcsize(f"{self.config.hashes_per_bucket}{self.config.hash_config.struct_format}I")
-                L, rem = divmod(f.size, line_size)
-                assert rem == 0, "file size not divisible by line size"
-                assert L >= workers_per_bucket, f"tried to use {workers_per_bucket=} but there are only {L} lines"
+            # split the signatures of all the files into equal parts. all workers in a bucket process the same set of
+            # files, so this is consistent across workers (and spans the entire range of hashes)
+            sketch = np.sort(self.get_hash_sketch(sig_files), order="hash")
+            if len(sketch):
+                cumulative_counts = np.cumsum(sketch["count"])
+                targets = cumulative_counts[-1] * np.arange(1, workers_per_bucket) // workers_per_bucket
+                boundaries = sketch["hash"][
+                    np.minimum(np.searchsorted(cumulative_counts, targets, side="right"), len(sketch) - 1)
+                ]
                 if bucket_worker > 0:
                     # not first
-                    f.seek(line_size * (L // workers_per_bucket) * bucket_worker, os.SEEK_SET)
-                    hash_min = struct.unpack(
-                        self.config.hash_config.struct_format,
-                        f.read(struct.calcsize(self.config.hash_config.struct_format)),
-                    )[0]
+                    hash_min = int(boundaries[bucket_worker - 1])
                 if bucket_worker + 1 < workers_per_bucket:
                     # not last
-                    f.seek(line_size * (L // workers_per_bucket) * (bucket_worker + 1), os.SEEK_SET)
-                    hash_max = struct.unpack(
-                        self.config.hash_config.struct_format,
-                        f.read(struct.calcsize(self.config.hash_config.struct_format)),
-                    )[0]
+                    hash_max = int(boundaries[bucket_worker])
         return hash_min, hash_max
 
     def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
@@ -353,7 +835,7 @@ class MinhashDedupBuckets(PipelineStep):
         bucket, bucket_worker = divmod(rank, workers_per_bucket)
 
         with self.track_time():
-            sig_files = self.input_folder.list_files(subdirectory=f"bucket_{bucket:03d}")
+            sig_files = self.input_folder.list_files(subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.sig")
             hash_min, hash_max = self.get_worker_hash_range(sig_files, rank, world_size)
 
             logger.info(
@@ -362,87 +844,111 @@ class MinhashDedupBuckets(PipelineStep):
             )
 
             sig_readers = [
-                read_sigs(
+                read_sig_chunks(
                     file,
-                    file_i,
                     self.config,
                     min_hash=hash_min,
                     max_hash=hash_max,
-                    lines_to_buffer=self.lines_to_buffer,
+                    chunk_size=self.lines_to_buffer,
                 )
-                for file_i, file in enumerate(self.input_folder.open_files(sig_files, mode="rb"))
+                for file in self.input_folder.open_files(sig_files, mode="rb")
             ]
+            # file stem of each reader, written to the .dups files
+            file_stems = [int(Path(file).name.removesuffix(".minhash.sig")) for file in sig_files]
 
             own_index_regex = re.compile(rf"bucket_{bucket:03d}/{self.create_index_name}_\d{{2}}.minhash.index")
-            index_files = (
-                [
+            index_files, dedup_only_in_index = None, False
+            if self.index_folder:
+                index_files = [
                     filename
-                    for filename in self.index_folder.list_files(subdirectory=f"bucket_{bucket:03d}")
+                    for filename in self.index_folder.list_files(
+                        subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.index"
+                    )
                     # exclude "itself" if the index was partially uploaded/ended midway + other workers
                     if not self.create_index_name or not own_index_regex.fullmatch(filename)
                 ]
-                if self.index_folder
-                else None
-            )
+                # if there is an index and we are only deduping in relation to it
+                dedup_only_in_index = self.only_dedup_in_index and bool(index_files)
+                # skip the segments that don't overlap our hash range
+                fences = load_index_fences(self.index_folder, bucket)
+                overlapping = [
+                    filename
+                    for filename in index_files
+                    if (segment_fences := fences.get(Path(filename).name)) is None
+                    or (
+                        segment_fences["count"] > 0
+                        and segment_fences["max_hash"] >= hash_min
+                        and segment_fences["min_hash"] < hash_max
+                    )
+                ]
+                if len(overlapping) < len(index_files):
+                    logger.info(f"Skipping {len(index_files) - len(overlapping)} index segment(s) outside hash range.")
+                    self.stat_update("skipped_index_segments", value=len(index_files) - len(overlapping))
+                index_files = overlapping
             if index_files:
                 logger.info(f"Found {len(index_files)} index file(s): {', '.join(index_files)}")
                 sig_readers.extend(
                     [
-                        read_sigs(
+                        read_sig_chunks(
                             file,
-                            len(sig_readers) + file_i,
                             self.config,
                             index_file=True,
                             min_hash=hash_min,
                             max_hash=hash_max,
-                            lines_to_buffer=self.lines_to_buffer,
+                            chunk_size=self.lines_to_buffer,
                         )
-                        for file_i, file in enumerate(self.index_folder.open_files(index_files, mode="rb"))
+                        for file in self.index_folder.open_files(index_files, mode="rb")
                     ]
                 )
-
-            pq = [x for x in [next(sig_reader, None) for sig_reader in sig_readers] if x is not None]
-            heapq.heapify(pq)
-            logger.info("Finished initializing signatures priority queue.")
+                file_stems.extend([SENTINEL] * len(index_files))
+            file_stems = np.array(file_stems, dtype=np.uint32)
+            nr_sig_files = len(sig_files)
+            hpb = self.config.sig_width
+
+            def lexsort_keys(records, reader_ids):
+                # same order as HashSig: signature, then index entries first, then file and doc id
+                return (records["doc"], reader_ids, reader_ids < nr_sig_files) + tuple(
+                    records["sig"][:, i] for i in reversed(range(hpb))
+                )
 
             # out index file
             out_index = None
             if self.index_folder and self.create_index_name:
-                out_index = self.index_folder.open(
-                    f"bucket_{bucket:03d}/{self.create_index_name}_{bucket_worker:02d}.minhash.index", mode="wb"
+                out_index = MinhashIndexSegmentWriter(
+                    self.index_folder,
+                    f"bucket_{bucket:03d}/{self.create_index_name}_{bucket_worker:02d}.minhash.index",
                 )
 
             with self.output_folder.open(f"{bucket:05d}_{bucket_worker:02d}.dups", mode="wb") as out_f:
-                last: HashSig | None = None
-                while pq:
-                    v: HashSig = heapq.heappop(pq)
-                    assert last is None or v >= last, f"Sig queue sort error. {v=} < {last=}"
-                    if not v.is_from_index():
-                        if last is not None and last.sig == v.sig:
-                            # write (file_id1, doc_id1, file_id2, doc_id2)
-                            if last.is_from_index():
-                                # we can't actually write -1, so we use SENTINEL instead
-                                out_f.write(struct.pack("<4I", SENTINEL, SENTINEL, int(v.file_stem), v.doc_id))
-                                self.stat_update("index_match", "total_matches")
-                            # if there isn't an index, or we are not only deduping in relation to the index
-                            elif not index_files or not self.only_dedup_in_index:
-                                out_f.write(
-                                    struct.pack("<4I", int(last.file_stem), last.doc_id, int(v.file_stem), v.doc_id)
-                                )
-                                self.stat_update("total_matches")
-                        elif out_index:
-                            # new sig that isn't part of any index, save to our new index
-                            out_index.write(
-                                struct.pack(
-                                    f"<%d{self.config.hash_config.struct_format}" % self.config.hashes_per_bucket,
-                                    *v.sig,
-                                )
-                            )
-                    last = v
-                    next_sig = next(sig_readers[v.reader_id], None)
-                    if next_sig:
-                        assert next_sig >= v, f"Next sig sort error. {next_sig=} < {v=}"
-                        heapq.heappush(pq, next_sig)
+                for records, reader_ids in merge_sorted_np_chunks(
+                    sig_readers, key=lambda records: records["sig"][:, 0], lexsort_keys=lexsort_keys
+                ):
+                    sigs = records["sig"]
+                    from_index = reader_ids >= nr_sig_files
+                    # equal signatures are always in the same batch: compare each sig with the previous one
+                    same_as_prev = np.zeros(len(records), dtype=bool)
+                    same_as_prev[1:] = np.all(sigs[1:] == sigs[:-1], axis=1)
+                    # non-index sigs equal to the previous one: match with the previous sig
+                    matches = np.flatnonzero(same_as_prev & ~from_index)
+                    index_matches = from_index[matches - 1]
+                    if dedup_only_in_index:
+                        matches, index_matches = matches[index_matches], index_matches[index_matches]
+                    if len(matches):
+                        # write (file_id1, doc_id1, file_id2, doc_id2)
+                        pairs = np.empty((len(matches), 4), dtype="<u4")
+                        pairs[:, 0] = file_stems[reader_ids[matches - 1]]
+                        pairs[:, 1] = records["doc"][matches - 1]
+                        pairs[:, 2] = file_stems[reader_ids[matches]]
+                        pairs[:, 3] = records["doc"][matches]
+                        # we can't actually write -1, so we use SENTINEL instead
+                        pairs[index_matches, :2] = SENTINEL
+                        out_f.write(pairs.tobytes())
+                        if nr_index_matches := int(np.count_nonzero(index_matches)):
+                            self.stat_update("index_match", value=nr_index_matches)
+                        self.stat_update("total_matches", value=len(matches))
+                    if out_index:
+                        # new sigs that aren't part of any index, save to our new index
+                        out_index.write(sigs[~same_as_prev & ~from_index])
                 if out_index:
                     out_index.close()
 
@@ -451,6 +957,36 @@ class MinhashDedupCluster(PipelineStep):
     """Minhash Deduplication: Third Pipeline Step
 
     Cluster the documents using the previously found duplicate pairs. If A-B and B-C are duplicate pairs, then we will have the A-B-C cluster. Only one document per cluster will be kept after filtering
+
+    Each (file, doc) pair is mapped to a dense integer id (using the highest doc id seen for each file) and the
+    union-find is kept in a numpy parent array, optionally memory-mapped from `local_working_dir`. Duplicate pairs are
+    processed in chunks of `lines_to_buffer` pairs with vectorized pointer-jumping. The document kept in each cluster
+    is the one with the smallest (file, doc) id, or the index if the cluster matched it.
+
+    When run with more than one task, the clustering is distributed: each task owns a range of node ids (aligned to
+    file boundaries) and the duplicate edges are partitioned by node range. Tasks then iterate rounds of star
+    contraction (each task turns every connected component it sees into a star centered on its smallest node) and
+    exchange the resulting edges through files in `output_folder/cluster_rounds/` until no task changes its edges.
+    The outputs are the same as with a single task. All the tasks must run at the same time (for example, on slurm
+    `max_array_launch_parallel` should not prevent any task from starting) and, if one of them fails, the step must
+    be rerun with all of its tasks (not only the failed one, e.g. with `skip_completed=False`). Each run starts with a
+    handshake where task 0 picks a new run id and every other task joins it, so files left by previous runs are
+    never used. A task waiting more than `timeout` seconds for the others raises an error. The `cluster_rounds` folder
+    can be deleted once the step has finished.
+
+    Args:
+        input_folder: folder with the .dups files from stage 2
+        output_folder: folder where the .remove (and optionally .clusters and .sizes) files are saved
+        config: minhash configuration (a MinhashConfig object)
+        save_cluster_id: save the cluster id of each duplicate document
+        save_cluster_size: save the cluster size of each duplicate document
+        ignore_index_matches: ignore matches with the index
+        lines_to_buffer: number of duplicate pairs processed at a time
+        local_working_dir: if set, the union-find arrays are memory-mapped from files in this local folder instead
+            of being kept in memory (single task mode only)
+        poll_interval: number of seconds between checks for the other tasks to finish a round (distributed mode)
+        timeout: maximum number of seconds to wait for the other tasks at each synchronization point (distributed
+            mode). None to wait forever
     """
 
     type = "🫂 - DEDUP"
@@ -464,7 +1000,10 @@ class MinhashDedupCluster(PipelineStep):
         save_cluster_id: bool = False,
         save_cluster_size: bool = False,
         ignore_index_matches: bool = False,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = 2**20,
+        local_working_dir: DataFolderLike | None = None,
+        poll_interval: float = 5,
+        timeout: float | None = 6 * 3600,
     ):
         super().__init__()
         self.input_folder = get_datafolder(input_folder)
@@ -474,76 +1013,361 @@ class MinhashDedupCluster(PipelineStep):
         self.save_cluster_size = save_cluster_size
         self.ignore_index_matches = ignore_index_matches
         self.lines_to_buffer = lines_to_buffer
+        self.local_working_dir = get_datafolder(local_working_dir) if local_working_dir else None
+        if self.local_working_dir and not self.local_working_dir.is_local():
+            raise ValueError("local_working_dir must be a local path")
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._run_folder = "cluster_rounds"
+
+    def read_pairs(self, dup_files: list[str]) -> Generator[np.ndarray, None, None]:
+        """Read duplicate pairs from .dups files in (N, 4) uint32 chunks of (file1, doc1, file2, doc2)"""
+        for dup_file in dup_files:
+            with self.input_folder.open(dup_file, "rb") as dupf:
+                for chunk in read_np_chunks_from_file(dupf, np.dtype(("<u4", (4,))), self.lines_to_buffer):
+                    if self.ignore_index_matches:
+                        # if we are skipping matches with the index and "a" is from the index
+                        chunk = chunk[chunk[:, 0] != SENTINEL]
+                    yield chunk
+
+    def get_docs_per_file(self, dup_files: list[str]) -> np.ndarray:
+        """Highest doc id (+1) of each file found in the given .dups files"""
+        docs_per_file = np.zeros(0, dtype=np.int64)
+        for pairs in tqdm(self.read_pairs(dup_files), desc="Counting documents per file"):
+            files, docs = pairs[:, [0, 2]].ravel(), pairs[:, [1, 3]].ravel()
+            not_index = files != SENTINEL
+            files, docs = files[not_index], docs[not_index]
+            if len(files) == 0:
+                continue
+            if files.max() >= len(docs_per_file):
+                docs_per_file = np.pad(docs_per_file, (0, int(files.max()) + 1 - len(docs_per_file)))
+            np.maximum.at(docs_per_file, files, docs.astype(np.int64) + 1)
+        return docs_per_file
+
+    @staticmethod
+    def get_file_offsets(docs_per_file: np.ndarray) -> np.ndarray:
+        """Dense id offset of each file: node (file, doc) gets id offsets[file] + doc. Id 0 is the index"""
+        offsets = np.empty(len(docs_per_file) + 1, dtype=np.int64)
+        offsets[0] = 1
+        np.cumsum(docs_per_file, out=offsets[1:])
+        offsets[1:] += 1
+        return offsets
+
+    @staticmethod
+    def get_nodes(pairs: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """Convert (N, 4) duplicate pairs into (N, 2) dense node ids"""
+        nodes = np.empty((len(pairs), 2), dtype=np.int64)
+        for col in range(2):
+            files, docs = pairs[:, 2 * col], pairs[:, 2 * col + 1]
+            from_index = files == SENTINEL
+            nodes[:, col] = np.where(from_index, 0, offsets[np.where(from_index, 0, files)] + docs)
+        return nodes
+
+    def new_array(self, name: str, size: int, dtype) -> np.ndarray:
+        if not self.local_working_dir:
+            return np.zeros(size, dtype=dtype)
+        self.local_working_dir.makedirs("", exist_ok=True)
+        return np.memmap(self.local_working_dir.resolve_paths(name), dtype=dtype, mode="w+", shape=(size,))
+
+    @staticmethod
+    def find(parent: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        """Vectorized find with pointer jumping. Compresses the paths of `nodes`"""
+        roots = parent[nodes]
+        while True:
+            grand_parents = parent[roots]
+            if np.array_equal(grand_parents, roots):
+                break
+            roots = grand_parents
+        parent[nodes] = roots
+        return roots
+
+    def union(self, parent: np.ndarray, a: np.ndarray, b: np.ndarray):
+        """Vectorized union of the sets of a[i] and b[i] for every i. The smallest id becomes the root"""
+        while len(a):
+            root_a, root_b = self.find(parent, a), self.find(parent, b)
+            to_merge = root_a != root_b
+            if not np.any(to_merge):
+                return
+            a, b, root_a, root_b = a[to_merge], b[to_merge], root_a[to_merge], root_b[to_merge]
+            # when several roots are linked to the same one, only one write wins: the others are retried
+            parent[np.maximum(root_a, root_b)] = np.minimum(root_a, root_b)
 
-    def run(self, data: DocumentsPipeline = None, _: int = 0, world_size: int = 1):
+    def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
         dup_files = self.input_folder.list_files(glob_pattern="*.dups")
         assert (
             len(dup_files) % self.config.num_buckets
         ) == 0, "Number of .dups files should be divisible by number of buckets"
-        assert world_size == 1, "World size must be 1 for clustering"
-        union_set = {}
-        set_size = {}
-
-        def parent(x):
-            if x not in union_set or union_set[x] == x:
-                union_set[x] = x
-                return x
-            # Path Compression
-            union_set[x] = parent(union_set[x])
-            return union_set[x]
-
-        def union(v_a, v_b):
-            root_a = parent(v_a)
-            root_b = parent(v_b)
-
-            if root_a != root_b:
-                # Union by size
-                size_a = set_size.get(root_a, 1)
-                size_b = set_size.get(root_b, 1)
-                if root_b == (SENTINEL, SENTINEL) or (root_a != (SENTINEL, SENTINEL) and size_a < size_b):
-                    root_a, root_b = root_b, root_a
-                # a is SENTINEL or #a >= #b
-                union_set[root_b] = root_a  # make the smallest one join the biggest one to keep sets shallow
-                set_size[root_a] = size_a + size_b
-                set_size.pop(root_b, None)  # clear up space
 
         with self.track_time():
-            logger.info("Loading dup files...")
-            for dup_file in tqdm(dup_files, desc="Reading dup files"):
-                with self.input_folder.open(dup_file, "rb") as dupf:
-                    for f1, d1, f2, d2 in read_tuples_from_file(dupf, "4I", lines_to_buffer=self.lines_to_buffer):
-                        a, b = (f1, d1), (f2, d2)
-                        if self.ignore_index_matches and a == (SENTINEL, SENTINEL):
-                            # if we are skipping matches with the index and "a" is from the index
-                            continue
-                        union(a, b)
-
-            logger.info("Finished reading dup files.")
-            ci = 0
-            cluster_ids = {}
-            with self.output_folder.get_output_file_manager(mode="wb") as output_mg:
-                for node in sorted(union_set):
-                    self.stat_update("duplicates")
-                    file, doc = node
-                    p = parent(node)
-                    if node != p:
-                        output_mg.write(f"{file:06d}.remove", struct.pack("<I", doc))
-                        self.stat_update("to_remove")
-
-                    # additional metadata
-                    if self.save_cluster_id:
-                        if p not in cluster_ids:
-                            cluster_ids[p] = ci
-                            ci += 1
-                            self.stat_update("clusters")
-                        output_mg.write(f"{file:06d}.clusters", struct.pack("<I", doc))
-                        output_mg.write(f"{file:06d}.clusters", struct.pack("<I", cluster_ids[p]))
-                    if node == p:
-                        # only run once per cluster
-                        self.stat_update("cluster_size", value=set_size[p], unit="cluster")
-                    if self.save_cluster_size:
-                        output_mg.write(f"{file:06d}.sizes", struct.pack("<I", doc))
-                        output_mg.write(f"{file:06d}.sizes", struct.pack("<I", set_size[p]))
+            if world_size == 1:
+                self.cluster(dup_files)
+            else:
+                self.cluster_distributed(dup_files, rank, world_size)
+
+    def cluster(self, dup_files: list[str]):
+        offsets = self.get_file_offsets(self.get_docs_per_file(dup_files))
+        nr_nodes = int(offsets[-1])
+        logger.info(f"Clustering {len(offsets) - 1} files with up to {nr_nodes - 1} documents.")
+        parent = self.new_array("parent.npy", nr_nodes, np.int64)
+        parent[:] = np.arange(nr_nodes, dtype=np.int64)
+        is_duplicate = self.new_array("is_duplicate.npy", nr_nodes, np.bool_)
+
+        logger.info("Loading dup files...")
+        for pairs in tqdm(self.read_pairs(dup_files), desc="Reading dup files"):
+            nodes = self.get_nodes(pairs, offsets)
+            is_duplicate[nodes.ravel()] = True
+            self.union(parent, nodes[:, 0], nodes[:, 1])
+        logger.info("Finished reading dup files.")
+
+        # nodes are sorted by (file, doc). The root of each cluster is its smallest node (or the index)
+        nodes = np.flatnonzero(is_duplicate)
+        roots = self.find(parent, nodes)
+        cluster_roots, cluster_ids, cluster_sizes = np.unique(roots, return_inverse=True, return_counts=True)
+        self.stats["cluster_size"] += MetricStats.from_values(cluster_sizes, unit="cluster")
+        self.stat_update("clusters", value=len(cluster_roots))
+        self.save_clusters(offsets, nodes, roots, cluster_ids, cluster_sizes[cluster_ids])
+
+        if self.local_working_dir:
+            del parent, is_duplicate
+            for name in ("parent.npy", "is_duplicate.npy"):
+                self.local_working_dir.rm(name)
+
+    def save_clusters(
+        self, offsets: np.ndarray, nodes: np.ndarray, roots: np.ndarray, cluster_ids: np.ndarray, sizes: np.ndarray
+    ):
+        """Write the outputs of each file. `nodes` must be sorted and the root of each cluster is kept"""
+        to_remove = nodes != roots
+        # the index (node 0) is not a document
+        is_doc = nodes != 0
+        nodes, cluster_ids, sizes, to_remove = nodes[is_doc], cluster_ids[is_doc], sizes[is_doc], to_remove[is_doc]
+        self.stat_update("duplicates", value=len(nodes))
+        self.stat_update("to_remove", value=int(np.count_nonzero(to_remove)))
+        if len(nodes) == 0:
+            # no duplicates: nothing to write
+            return
+
+        files = np.searchsorted(offsets, nodes, side="right") - 1
+        docs = (nodes - offsets[files]).astype("<u4")
+        file_bounds = np.flatnonzero(np.diff(files)) + 1
+        for start, end in zip(np.r_[0, file_bounds], np.r_[file_bounds, len(nodes)]):
+            file = int(files[start])
+            if np.any(to_remove[start:end]):
+                self.write_array(f"{file:06d}.remove", docs[start:end][to_remove[start:end]])
+            # additional metadata
+            if self.save_cluster_id:
+                self.write_array(f"{file:06d}.clusters", np.stack([docs[start:end], cluster_ids[start:end]], axis=1))
+            if self.save_cluster_size:
+                self.write_array(f"{file:06d}.sizes", np.stack([docs[start:end], sizes[start:end]], axis=1))
+
+    def write_array(self, filename: str, data: np.ndarray, dtype: str = "<u4"):
+        with self.output_folder.open(filename, mode="wb") as f:
+            f.write(data.astype(dtype).tobytes())
+
+    def read_arrays(self, filenames: list[str], dtype: str, shape: tuple = ()) -> np.ndarray:
+        """Read and concatenate files written with `write_array`"""
+        arrays = [np.zeros((0, *shape), dtype=dtype)]
+        for filename in filenames:
+            with self.output_folder.open(filename, mode="rb") as f:
+                arrays.append(np.frombuffer(f.read(), dtype=dtype).reshape(-1, *shape))
+        return np.concatenate(arrays)
+
+    def wait_until(self, condition: Callable[[], bool], waiting_for: str):
+        """Poll `condition` until it is true, raising a TimeoutError after `self.timeout` seconds"""
+        start = time.time()
+        while not condition():
+            if self.timeout is not None and time.time() - start > self.timeout:
+                raise TimeoutError(
+                    f"Timed out after {self.timeout}s waiting for {waiting_for}. All the tasks of {self.name} must "
+                    f"run at the same time: if some of them failed, rerun the step with all of its tasks."
+                )
+            time.sleep(self.poll_interval)
+
+    def join_run(self, rank: int, world_size: int) -> str:
+        """Handshake between all the tasks to agree on a new run id, without relying on (possibly stale) files.
+
+        Each task writes a random nonce, that task 0 echoes back along with the run id it picked for this run. A task
+        only accepts a run id received with its own nonce, and then marks itself as joined in the folder of the run,
+        which only contains files of this run.
+        """
+        if rank == 0:
+            run_id = uuid.uuid4().hex
+            joined_folder = f"cluster_rounds/run_{run_id}/joined"
+            echoed = {}
+
+            def all_joined():
+                for task in range(1, world_size):
+                    if not self.output_folder.exists(f"cluster_rounds/join/{task:05d}"):
+                        continue
+                    with self.output_folder.open(f"cluster_rounds/join/{task:05d}", "rt") as f:
+                        nonce = f.read()
+                    if nonce and echoed.get(task) != nonce:
+                        with self.output_folder.open(f"cluster_rounds/accept/{task:05d}", "wt") as f:
+                            f.write(f"{nonce} {run_id}")
+                        echoed[task] = nonce
+                return len(self.output_folder.list_files(joined_folder)) == world_size - 1
+
+            self.wait_until(all_joined, "the other tasks to join the run")
+            # remove the files of previous runs
+            for folder in self.output_folder.glob("cluster_rounds/run_*"):
+                if folder != f"cluster_rounds/run_{run_id}":
+                    self.output_folder.rm(folder, recursive=True)
+            return run_id
+
+        nonce = uuid.uuid4().hex
+        with self.output_folder.open(f"cluster_rounds/join/{rank:05d}", "wt") as f:
+            f.write(nonce)
+        run_id = None
+
+        def accepted():
+            nonlocal run_id
+            if self.output_folder.exists(f"cluster_rounds/accept/{rank:05d}"):
+                with self.output_folder.open(f"cluster_rounds/accept/{rank:05d}", "rt") as f:
+                    parts = f.read().split()
+                if len(parts) == 2 and parts[0] == nonce:
+                    run_id = parts[1]
+            return run_id is not None
+
+        self.wait_until(accepted, "task 0 to start the run")
+        with self.output_folder.open(f"cluster_rounds/run_{run_id}/joined/{rank:05d}", mode="wb"):
+            pass
+        return run_id
+
+    def wait_for_tasks(self, step: str, rank: int, world_size: int):
+        """Mark this task as done with `step` and wait until all the other tasks are too"""
+        with self.output_folder.open(f"{self._run_folder}/{step}/{rank:05d}.done", mode="wb"):
+            pass
+        self.wait_until(
+            lambda: (
+                len(self.output_folder.list_files(f"{self._run_folder}/{step}", glob_pattern="*.done")) >= world_size
+            ),
+            f"the other tasks to finish {step}",
+        )
+
+    def send_edges(self, step: str, edges: np.ndarray, owners: np.ndarray, rank: int, world_size: int):
+        """Write the (N, k) `edges` to the task(s) in each column of `owners`"""
+        targets = np.concatenate([owners[:, col] for col in range(owners.shape[1])])
+        rows = np.tile(np.arange(len(edges)), owners.shape[1])
+        # don't send the same edge twice to a task
+        first = np.ones(len(targets), dtype=bool)
+        for col in range(1, owners.shape[1]):
+            first[col * len(edges) : (col + 1) * len(edges)] = np.all(owners[:, col, None] != owners[:, :col], axis=1)
+        targets, rows = targets[first], rows[first]
+        order = np.argsort(targets, kind="stable")
+        targets, rows = targets[order], rows[order]
+        bounds = np.searchsorted(targets, np.arange(world_size + 1))
+        for target in range(world_size):
+            if bounds[target] < bounds[target + 1]:
+                self.write_array(
+                    f"{self._run_folder}/{step}/{target:05d}_{rank:05d}.edges",
+                    edges[rows[bounds[target] : bounds[target + 1]]],
+                    dtype="<i8",
+                )
+
+    def receive_edges(self, step: str, rank: int, width: int = 2) -> np.ndarray:
+        """Read (and delete) the edges sent to this task"""
+        files = self.output_folder.list_files(f"{self._run_folder}/{step}", glob_pattern=f"{rank:05d}_*.edges")
+        edges = self.read_arrays(files, "<i8", (width,))
+        for file in files:
+            self.output_folder.rm(file)
+        return edges
+
+    def cluster_distributed(self, dup_files: list[str], rank: int, world_size: int):
+        # all the files of this run are in its own folder, so leftovers of previous runs are never read
+        self._run_folder = f"cluster_rounds/run_{self.join_run(rank, world_size)}"
+        logger.info(f"Joined clustering run {self._run_folder}.")
+        my_dup_files = dup_files[rank::world_size]
+
+        # dense node ids
+        self.write_array(
+            f"{self._run_folder}/docs_per_file/{rank:05d}.npy", self.get_docs_per_file(my_dup_files), "<i8"
+        )
+        self.wait_for_tasks("docs_per_file", rank, world_size)
+        docs_per_file = np.zeros(0, dtype=np.int64)
+        for file in self.output_folder.list_files(f"{self._run_folder}/docs_per_file", glob_pattern="*.npy"):
+            task_docs_per_file = self.read_arrays([file], "<i8")
+            if len(task_docs_per_file) > len(docs_per_file):
+                docs_per_file = np.pad(docs_per_file, (0, len(task_docs_per_file) - len(docs_per_file)))
+            docs_per_file[: len(task_docs_per_file)] = np.maximum(
+                docs_per_file[: len(task_docs_per_file)], task_docs_per_file
+            )
+        offsets = self.get_file_offsets(docs_per_file)
+        nr_nodes = int(offsets[-1])
+        # each task owns a range of nodes, starting at a file boundary
+        node_bounds = offsets[
+            np.minimum(np.searchsorted(offsets, np.arange(world_size + 1) * nr_nodes / world_size), len(offsets) - 1)
+        ]
+        node_bounds[0], node_bounds[-1] = 0, nr_nodes
+
+        def get_owners(nodes):
+            return np.searchsorted(node_bounds, nodes, side="right") - 1
+
+        logger.info(f"Task {rank} owns nodes {node_bounds[rank]} to {node_bounds[rank + 1]} of {nr_nodes}.")
+
+        # edges are (larger node, smaller node) and are sent to the owners of both nodes
+        edges = np.concatenate(
+            [np.zeros((0, 2), dtype=np.int64)]
+            + [np.sort(self.get_nodes(pairs, offsets), axis=1)[:, ::-1] for pairs in self.read_pairs(my_dup_files)]
+        )
+        self.send_edges("round_000", edges, get_owners(edges), rank, world_size)
+        self.wait_for_tasks("round_000", rank, world_size)
+
+        round_i = 0
+        while True:
+            edges = np.unique(self.receive_edges(f"round_{round_i:03d}", rank), axis=0)
+            # turn every connected component into a star centered on its smallest node
+            nodes, local_edges = np.unique(edges, return_inverse=True)
+            parent = np.arange(len(nodes))
+            local_edges = local_edges.reshape(-1, 2)
+            self.union(parent, local_edges[:, 0], local_edges[:, 1])
+            stars = np.stack([nodes, nodes[self.find(parent, np.arange(len(nodes)))]], axis=1)
+            stars_owners = get_owners(stars)
+            round_i += 1
+            # stars are already sorted. The roots owned by other tasks are not sent back to this one
+            if not np.array_equal(stars[(stars[:, 0] != stars[:, 1]) | (stars_owners[:, 0] == rank)], edges):
+                with self.output_folder.open(f"{self._run_folder}/round_{round_i:03d}/{rank:05d}.changed", mode="wb"):
+                    pass
+            self.send_edges(f"round_{round_i:03d}", stars, stars_owners, rank, world_size)
+            self.wait_for_tasks(f"round_{round_i:03d}", rank, world_size)
+            if not self.output_folder.list_files(f"{self._run_folder}/round_{round_i:03d}", glob_pattern="*.changed"):
+                # no task changed its edges: they are the same as the ones that were just sent
+                self.receive_edges(f"round_{round_i:03d}", rank)
+                break
+        logger.info(f"Clustering converged after {round_i} rounds.")
+        self.stat_update("rounds", value=round_i)
+
+        # every node points to its root. The root of each cluster has an edge from each of its nodes
+        owned = get_owners(edges[:, 0]) == rank
+        nodes, roots = edges[owned, 0], edges[owned, 1]
+        cluster_roots = nodes[nodes == roots]
+        in_edges = edges[np.isin(edges[:, 1], cluster_roots)]
+        cluster_sizes = np.bincount(np.searchsorted(cluster_roots, in_edges[:, 1]), minlength=len(cluster_roots))
+        self.stats["cluster_size"] += MetricStats.from_values(cluster_sizes, unit="cluster")
+        self.stat_update("clusters", value=len(cluster_roots))
+
+        # cluster ids follow the order of the roots
+        self.write_array(f"{self._run_folder}/clusters/{rank:05d}.count", np.array([len(cluster_roots)]), "<i8")
+        self.wait_for_tasks("clusters", rank, world_size)
+        counts = self.read_arrays(
+            [f"{self._run_folder}/clusters/{task:05d}.count" for task in range(world_size)], "<i8"
+        )
+        cluster_ids = counts[:rank].sum() + np.arange(len(cluster_roots))
+
+        # send the cluster id and size to the nodes owned by other tasks
+        in_edges = in_edges[get_owners(in_edges[:, 0]) != rank]
+        root_i = np.searchsorted(cluster_roots, in_edges[:, 1])
+        cluster_info = np.stack([in_edges[:, 0], cluster_ids[root_i], cluster_sizes[root_i]], axis=1)
+        self.send_edges("cluster_info", cluster_info, get_owners(cluster_info[:, :1]), rank, world_size)
+        self.wait_for_tasks("cluster_info", rank, world_size)
+        cluster_info = self.receive_edges("cluster_info", rank, width=3)
+        cluster_info = cluster_info[np.argsort(cluster_info[:, 0])]
+
+        node_cluster_ids, node_sizes = np.empty(len(nodes), dtype=np.int64), np.empty(len(nodes), dtype=np.int64)
+        local_root = get_owners(roots) == rank
+        root_i = np.searchsorted(cluster_roots, roots[local_root])
+        node_cluster_ids[local_root], node_sizes[local_root] = cluster_ids[root_i], cluster_sizes[root_i]
+        info_i = np.searchsorted(cluster_info[:, 0], nodes[~local_root])
+        node_cluster_ids[~local_root], node_sizes[~local_root] = cluster_info[info_i, 1], cluster_info[info_i, 2]
+        self.save_clusters(offsets, nodes, roots, node_cluster_ids, node_sizes)
 
 
 class MinhashDedupFilter(PipelineStep):
@@ -551,6 +1375,17 @@ class MinhashDedupFilter(PipelineStep):
 
     Filter the documents based on the minhash clusters to keep only one per cluster
     or, in annotate-only mode, keep all documents but add cluster metadata.
+
+    The .remove (and .clusters/.sizes) files of each rank are loaded with a single bulk read into arrays indexed by
+    document id.
+
+    Args:
+        input_folder: folder with the outputs of stage 3
+        exclusion_writer: writer to save the removed documents
+        load_cluster_ids: add the cluster id of each document to its metadata
+        load_cluster_sizes: add the cluster size of each document to its metadata
+        lines_to_buffer: deprecated and ignored, the files are loaded in full
+        keep_all: keep all documents, only adding the metadata
     """
 
     type = "🫂 - DEDUP"
@@ -562,7 +1397,7 @@ class MinhashDedupFilter(PipelineStep):
         exclusion_writer: DiskWriter = None,
         load_cluster_ids: bool = False,
         load_cluster_sizes: bool = False,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int | None = None,
         keep_all: bool = False,
     ):
         super().__init__()
@@ -570,9 +1405,17 @@ class MinhashDedupFilter(PipelineStep):
         self.exclusion_writer = exclusion_writer
         self.load_cluster_ids = load_cluster_ids
         self.load_cluster_sizes = load_cluster_sizes
-        self.lines_to_buffer = lines_to_buffer
+        if lines_to_buffer is not None:
+            logger.warning(
+                "MinhashDedupFilter's lines_to_buffer is deprecated and has no effect: the files are loaded in full."
+            )
         self.keep_all = keep_all
 
+    def load_metadata(self, filename: str, fill_value: int) -> np.ndarray:
+        """Load a file of (doc, value) pairs into an array indexed by doc"""
+        metadata = read_np_from_files(self.data_folder, [filename], np.dtype(("<u4", (2,))))
+        return get_lookup_array(metadata[:, 0], metadata[:, 1], fill_value=fill_value, dtype=np.int64)
+
     def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
         if not self.data_folder.isfile(f"{rank:06d}.remove") and not self.keep_all:
             logger.warning(f"No .remove file for {rank=}.")
@@ -591,55 +1434,256 @@ class MinhashDedupFilter(PipelineStep):
             logger.warning(f"No .sizes file for {rank=}.")
             raise FileNotFoundError
 
-        with self.data_folder.open(f"{rank:06d}.remove", "rb") as f:
-            with self.exclusion_writer if (self.exclusion_writer and not self.keep_all) else contextlib.nullcontext() as exc_writer:
-
-                def get_next():
-                    data = f.read(struct.calcsize("I"))
-                    if data:
-                        return struct.unpack("<I", data)[0]
-
-                def metadata_loader(file):
-                    with self.data_folder.open(file, "rb") as metadata_f:
-                        yield from read_tuples_from_file(metadata_f, "2I", lines_to_buffer=self.lines_to_buffer)
-
-                if self.load_cluster_ids:
-                    cluster_loader = metadata_loader(f"{rank:06d}.clusters")
-                    next_cluster = next(cluster_loader, None)
-
-                if self.load_cluster_sizes:
-                    sizes_loader = metadata_loader(f"{rank:06d}.sizes")
-                    next_size = next(sizes_loader, None)
-
-                next_removal = get_next() if not self.keep_all else None
-                for idx, doc in enumerate(data):
-                    with self.track_time():
-                        # load and save metadata
-                        if self.load_cluster_ids:
-                            if next_cluster and idx == next_cluster[0]:
-                                doc.metadata["minhash_cluster_id"] = next_cluster[1]
-                                next_cluster = next(cluster_loader, None)
-                            else:
-                                doc.metadata["minhash_cluster_id"] = -1
-
-                        if self.load_cluster_sizes:
-                            if next_size and idx == next_size[0]:
-                                doc.metadata["minhash_cluster_size"] = next_size[1]
-                                next_size = next(sizes_loader, None)
-                            else:
-                                doc.metadata["minhash_cluster_size"] = 1
-
-                        self.stat_update(StatHints.total)
-                        if next_removal == idx and not self.keep_all:
-                            # to remove
-                            self.stat_update(StatHints.dropped)
-                            if self.exclusion_writer:
-                                exc_writer.write(doc, rank)
-                            next_removal = get_next()
-                            continue
-                        self.stat_update(StatHints.forwarded)
+        to_remove = get_lookup_array(
+            read_np_from_files(self.data_folder, [f"{rank:06d}.remove"], np.dtype("<u4"))
+            if not self.keep_all
+            else np.zeros(0, dtype=np.uint32)
+        )
+        if self.load_cluster_ids:
+            cluster_ids = self.load_metadata(f"{rank:06d}.clusters", fill_value=-1)
+        if self.load_cluster_sizes:
+            cluster_sizes = self.load_metadata(f"{rank:06d}.sizes", fill_value=1)
+
+        with self.exclusion_writer if (self.exclusion_writer and not self.keep_all) else contextlib.nullcontext() as exc_writer:
+            for idx, doc in enumerate(data):
+                with self.track_time():
+                    # load and save metadata
+                    if self.load_cluster_ids:
+                        doc.metadata["minhash_cluster_id"] = int(cluster_ids[idx]) if idx < len(cluster_ids) else -1
+
+                    if self.load_cluster_sizes:
+                        doc.metadata["minhash_cluster_size"] = (
+                            int(cluster_sizes[idx]) if idx < len(cluster_sizes) else 1
+                        )
+
+                    self.stat_update(StatHints.total)
+                    if idx < len(to_remove) and to_remove[idx]:
+                        # to remove
+                        self.stat_update(StatHints.dropped)
+                        if self.exclusion_writer:
+                            exc_writer.write(doc, rank)
+                        continue
+                    self.stat_update(StatHints.forwarded)
+                yield doc
+
+
+class MinhashSigTable:
+    """Set of bucket signatures kept in memory, as a numpy open addressing (linear probing) hash table
+
+    Signatures are stored as 64-bit fingerprints: the signature itself when it is a single value (see
+    `MinhashConfig.bits_per_hash`), otherwise a hash of its values. The table doubles its capacity when it is half full.
+
+    Args:
+        config: minhash configuration (a MinhashConfig object)
+        capacity: initial number of slots (rounded up to a power of 2)
+    """
+
+    EMPTY = np.uint64(np.iinfo(np.uint64).max)
+
+    def __init__(self, config: MinhashConfig, capacity: int = 2**16):
+        self.config = config
+        self.slots = np.full(1 << max(1, (capacity - 1).bit_length()), self.EMPTY, dtype=np.uint64)
+        self.size = 0
+        # odd multipliers used to mix the values of a signature into its fingerprint
+        self._multipliers = np.random.RandomState(config.seed).randint(
+            0, np.iinfo(np.int64).max, size=config.sig_width, dtype=np.int64
+        ).astype(np.uint64) | np.uint64(1)
+
+    def __len__(self):
+        return self.size
+
+    def get_fingerprints(self, sigs: np.ndarray) -> np.ndarray:
+        """Fingerprints of (N, sig_width) signatures"""
+        if self.config.sig_width == 1:
+            return sigs[:, 0].astype(np.uint64)
+        fingerprints = np.zeros(len(sigs), dtype=np.uint64)
+        for i in range(self.config.sig_width):
+            fingerprints = (fingerprints ^ sigs[:, i].astype(np.uint64)) * self._multipliers[i]
+            fingerprints ^= fingerprints >> np.uint64(29)
+        fingerprints[fingerprints == self.EMPTY] -= np.uint64(1)
+        return fingerprints
+
+    def get_slots(self, fingerprints: np.ndarray) -> np.ndarray:
+        """First slot of the probe sequence of each fingerprint (fibonacci hashing)"""
+        shift = np.uint64(64 - (len(self.slots).bit_length() - 1))
+        return ((fingerprints * np.uint64(0x9E3779B97F4A7C15)) >> shift).astype(np.int64)
+
+    def probe(self, fingerprints: np.ndarray, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Linear probing from `positions` (modified in place) until each fingerprint or an empty slot is found
+
+        Returns:
+            tuple (positions, found)
+        """
+        mask = len(self.slots) - 1
+        found = np.zeros(len(fingerprints), dtype=bool)
+        active = np.arange(len(fingerprints))
+        while len(active):
+            slots = self.slots[positions[active]]
+            hit = slots == fingerprints[active]
+            found[active[hit]] = True
+            active = active[~hit & (slots != self.EMPTY)]
+            positions[active] = (positions[active] + 1) & mask
+        return positions, found
+
+    def insert_new(self, fingerprints: np.ndarray, positions: np.ndarray):
+        """Insert unique fingerprints that are not in the table, `positions` being the first empty slot of each one"""
+        mask = len(self.slots) - 1
+        while len(fingerprints):
+            # several fingerprints may land on the same empty slot: the first one takes it, the others keep probing
+            taken, winners = np.unique(positions, return_index=True)
+            self.slots[taken] = fingerprints[winners]
+            self.size += len(winners)
+            losers = np.ones(len(fingerprints), dtype=bool)
+            losers[winners] = False
+            fingerprints = fingerprints[losers]
+            positions, _ = self.probe(fingerprints, (positions[losers] + 1) & mask)
+
+    def reserve(self, size: int):
+        """Grow the table so that it stays at most half full with `size` fingerprints"""
+        if 2 * size <= len(self.slots):
+            return
+        capacity = len(self.slots)
+        while 2 * size > capacity:
+            capacity *= 2
+        old = self.slots[self.slots != self.EMPTY]
+        self.slots = np.full(capacity, self.EMPTY, dtype=np.uint64)
+        self.size = 0
+        self.insert_new(old, self.probe(old, self.get_slots(old))[0])
+
+    def contains(self, sigs: np.ndarray) -> np.ndarray:
+        """Check which (N, sig_width) signatures are in the table"""
+        fingerprints = self.get_fingerprints(sigs)
+        return self.probe(fingerprints, self.get_slots(fingerprints))[1]
+
+    def add(self, sigs: np.ndarray) -> np.ndarray:
+        """Add (N, sig_width) signatures to the table
+
+        Returns:
+            boolean array: True for the signatures that were already in the table or that appear earlier in `sigs`
+        """
+        fingerprints, first, inverse = np.unique(self.get_fingerprints(sigs), return_index=True, return_inverse=True)
+        seen = first[inverse] != np.arange(len(sigs))
+        self.reserve(self.size + len(fingerprints))
+        positions, found = self.probe(fingerprints, self.get_slots(fingerprints))
+        self.insert_new(fingerprints[~found], positions[~found])
+        return seen | found[inverse]
+
+
+class MinhashDedupInMemory(MinhashDedupSignature):
+    """Minhash Deduplication in a single streaming pass
+
+    Computes the signatures of each batch of documents and looks them up in one in-memory hash table per bucket
+    (`MinhashSigTable`). A document is dropped if, in any bucket, its signature matches the signature of an earlier
+    document (or of the index). The signatures of every document, dropped or not, are added to the tables.
+
+    Uses the same MinhashConfig and candidate pairs as the multi-stage pipeline: the documents that are removed are
+    the same, except for clusters that are only connected through a later document (A ~ C and B ~ C, but A !~ B keeps
+    both A and B, as B is forwarded before C is seen). Suitable for corpora whose signatures fit in memory
+    (~16 bytes per document per bucket), as each task only deduplicates its own documents: run a single task or
+    shard the data so that duplicates end up in the same task.
+
+    Args:
+        config: minhash configuration (a MinhashConfig object)
+        index_folder: index folder. If set, we will load all index files in this folder and remove any document
+            matching a signature from the index
+        only_dedup_in_index: only deduplicate versus index (ignore any matches between 2 documents in our input dataset)
+            when an index is found. Same default as `MinhashDedupBuckets`
+        create_index_name: if set (requires `index_folder`), the signatures of this task that are not in the loaded
+            index are saved as index files with this name, that other datasets can use as a reference for dedup
+        exclusion_writer: writer to save the removed documents
+        language: language used for word tokenization
+        batch_size: number of documents whose signatures are computed and looked up together
+        table_capacity: initial number of slots of each bucket's hash table
+    """
+
+    name = "🎯 MinHash in memory"
+
+    def __init__(
+        self,
+        config: MinhashConfig = None,
+        index_folder: DataFolderLike = None,
+        only_dedup_in_index: bool = True,
+        create_index_name: str = None,
+        exclusion_writer: DiskWriter = None,
+        language: str = Languages.english,
+        batch_size: int = 1000,
+        table_capacity: int = 2**16,
+    ):
+        if create_index_name and not index_folder:
+            raise ValueError("create_index_name requires an index_folder")
+        super().__init__(output_folder=index_folder, config=config, language=language, batch_size=batch_size)
+        self.index_folder = self.output_folder
+        self.only_dedup_in_index = only_dedup_in_index
+        self.create_index_name = create_index_name
+        self.exclusion_writer = exclusion_writer
+        self.table_capacity = table_capacity
+
+    def load_index(self, table: MinhashSigTable, bucket: int):
+        """Add the signatures of all the index files of a bucket to its table"""
+        index_files = self.index_folder.list_files(subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.index")
+        if self.create_index_name:
+            own_index_regex = re.compile(rf"bucket_{bucket:03d}/{self.create_index_name}_\d{{2}}.minhash.index")
+            index_files = [filename for filename in index_files if not own_index_regex.fullmatch(filename)]
+        if index_files:
+            logger.info(f"Loading {len(index_files)} index file(s) for bucket {bucket:03d}")
+            table.add(read_np_from_files(self.index_folder, index_files, get_sig_dtype(self.config)["sig"]))
+
+    def save_index(self, new_sigs: list[np.ndarray], bucket: int, rank: int):
+        """Save the sorted unique signatures of a bucket as an index segment"""
+        empty = np.zeros((0, self.config.sig_width), dtype=self.config.hash_config.np_dtype)
+        sigs = np.unique(np.concatenate([empty] + new_sigs), axis=0)
+        with MinhashIndexSegmentWriter(
+            self.index_folder, f"bucket_{bucket:03d}/{self.create_index_name}_{rank:02d}.minhash.index"
+        ) as out_f:
+            out_f.write(sigs)
+
+    def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
+        width = self.config.sig_width
+        tables = [MinhashSigTable(self.config, self.table_capacity) for _ in range(self.config.num_buckets)]
+        index_tables = None
+        if self.index_folder:
+            index_tables = [MinhashSigTable(self.config) for _ in range(self.config.num_buckets)]
+            with self.track_time():
+                for bi, index_table in enumerate(index_tables):
+                    self.load_index(index_table, bi)
+            if not any(index_tables):
+                index_tables = None
+        dedup_only_in_index = self.only_dedup_in_index and index_tables is not None
+        new_sigs = [[] for _ in range(self.config.num_buckets)]
+
+        with self.exclusion_writer if self.exclusion_writer else contextlib.nullcontext() as writer:
+            for batch in batched(data, self.batch_size):
+                with self.track_time():
+                    shingles, offsets = self.get_shingles_batch([doc.text for doc in batch])
+                    sigs = self.get_signatures_batch(shingles, offsets)
+                    sig_doc_ids = np.flatnonzero(np.diff(offsets) > 0)
+                    duplicate = np.zeros(len(batch), dtype=bool)
+                    for bi in range(self.config.num_buckets):
+                        bucket_sigs = sigs[:, bi * width : (bi + 1) * width]
+                        in_index = np.zeros(len(bucket_sigs), dtype=bool)
+                        if index_tables is not None:
+                            in_index = index_tables[bi].contains(bucket_sigs)
+                            duplicate[sig_doc_ids[in_index]] = True
+                        if not dedup_only_in_index:
+                            duplicate[sig_doc_ids[tables[bi].add(bucket_sigs)]] = True
+                        if self.create_index_name:
+                            new_sigs[bi].append(bucket_sigs[~in_index])
+                for doc, is_duplicate in zip(batch, duplicate):
+                    self.stat_update(StatHints.total)
+                    if is_duplicate:
+                        self.stat_update(StatHints.dropped)
+                        if self.exclusion_writer:
+                            writer.write(doc, rank)
+                        continue
+                    self.stat_update(StatHints.forwarded)
                     yield doc
 
+        if self.create_index_name:
+            with self.track_time():
+                for bi in range(self.config.num_buckets):
+                    self.save_index(new_sigs[bi], bi, rank)
+        self.stat_update("unique_sigs", value=sum(len(table) for table in tables))
+
 
 class MinhashBuildIndex(PipelineStep):
     """Minhash Deduplication
@@ -656,7 +1700,7 @@ class MinhashBuildIndex(PipelineStep):
         output_folder: DataFolderLike,
         index_name: str,
         config: MinhashConfig = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = 1000,
     ):
         super().__init__()
         self.input_folder = get_datafolder(input_folder)
@@ -668,30 +1712,107 @@ class MinhashBuildIndex(PipelineStep):
     def run(self, data: DocumentsPipeline = None, bucket: int = 0, world_size: int = 1):
         assert data is None, "You should not use an input block before MinhashBuildIndex"
         assert world_size == self.config.num_buckets, "You must run exactly one task per bucket"
-        sig_files = self.input_folder.list_files(subdirectory=f"bucket_{bucket:03d}")
+        sig_files = self.input_folder.list_files(subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.sig")
         sig_readers = [
-            read_sigs(file, file_i, self.config, lines_to_buffer=self.lines_to_buffer)
-            for file_i, file in enumerate(self.input_folder.open_files(sig_files, mode="rb"))
+            read_sig_chunks(file, self.config, chunk_size=self.lines_to_buffer)
+            for file in self.input_folder.open_files(sig_files, mode="rb")
         ]
 
-        pq = [next(sig_reader) for sig_reader in sig_readers]
-        heapq.heapify(pq)
-
         # writes all the sigs for the entire bucket, sequentially
-        out_f = self.output_folder.open(f"bucket_{bucket:03d}/{self.index_name}.minhash.index", mode="wb")
+        with self.track_time():
+            with MinhashIndexSegmentWriter(
+                self.output_folder, f"bucket_{bucket:03d}/{self.index_name}.minhash.index"
+            ) as out_f:
+                for sigs in merge_unique_sigs(sig_readers, self.config):
+                    out_f.write(sigs)
+
+
+class MinhashCompactIndex(PipelineStep):
+    """Minhash Deduplication
+
+    Compact the index of each bucket: the segments (.minhash.index files) smaller than `max_segment_size` bytes are
+    merged into a single new segment, and the fences of all the segments (see `MinhashIndexSegmentWriter`) are saved
+    to the bucket's manifest, so that `MinhashDedupBuckets` only opens the segments overlapping its hash range.
+    Should not run while other steps are reading or writing the index.
+
+    Args:
+        index_folder: index folder
+        config: minhash configuration (a MinhashConfig object)
+        max_segment_size: segments smaller than this (in bytes) are merged together
+        lines_to_buffer: number of signatures read at a time from each segment
+    """
+
+    type = "🫂 - DEDUP"
+    name = "🎯 MinHash compact index"
+
+    def __init__(
+        self,
+        index_folder: DataFolderLike,
+        config: MinhashConfig = None,
+        max_segment_size: int = 2**30,
+        lines_to_buffer: int = 1000,
+    ):
+        super().__init__()
+        self.index_folder = get_datafolder(index_folder)
+        self.config = config or MinhashConfig()
+        self.max_segment_size = max_segment_size
+        self.lines_to_buffer = lines_to_buffer
+
+    def get_fences(self, filename: str) -> dict:
+        """Read the fences of a segment written without them"""
+        sig_dtype = np.dtype([("sig", get_sig_dtype(self.config)["sig"])])
+        with self.index_folder.open(filename, mode="rb") as f:
+            count, rem = divmod(f.size, sig_dtype.itemsize)
+            assert rem == 0, "file size not divisible by line size"
+            if count == 0:
+                return {"min_hash": None, "max_hash": None, "count": 0}
+            first = np.frombuffer(f.read(sig_dtype.itemsize), dtype=sig_dtype)
+            f.seek((count - 1) * sig_dtype.itemsize, os.SEEK_SET)
+            last = np.frombuffer(f.read(sig_dtype.itemsize), dtype=sig_dtype)
+        return {"min_hash": int(first["sig"][0, 0]), "max_hash": int(last["sig"][0, 0]), "count": count}
 
-        last: HashSig | None = None
+    def run(self, data: DocumentsPipeline = None, bucket: int = 0, world_size: int = 1):
+        assert data is None, "You should not use an input block before MinhashCompactIndex"
+        assert world_size == self.config.num_buckets, "You must run exactly one task per bucket"
         with self.track_time():
-            while pq:
-                v: HashSig = heapq.heappop(pq)
-                if not last or last.sig != v.sig:
-                    out_f.write(
-                        struct.pack(
-                            f"<%d{self.config.hash_config.struct_format}" % self.config.hashes_per_bucket, *v.sig
-                        )
-                    )
-                last = v
-                next_sig = next(sig_readers[v.file_id], None)
-                if next_sig:
-                    heapq.heappush(pq, next_sig)
-        out_f.close()
+            segments = self.index_folder.list_files(
+                subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.index"
+            )
+            fences = load_index_fences(self.index_folder, bucket)
+
+            to_merge = [segment for segment in segments if self.index_folder.size(segment) < self.max_segment_size]
+            if len(to_merge) > 1:
+                compacted_ids = [
+                    int(match.group(1))
+                    for segment in segments
+                    if (match := re.fullmatch(r"compacted_(\d+)\.minhash\.index", Path(segment).name))
+                ]
+                new_segment = f"bucket_{bucket:03d}/compacted_{max(compacted_ids, default=-1) + 1:05d}.minhash.index"
+                logger.info(f"Merging {len(to_merge)} index segments into {new_segment}.")
+                sig_readers = [
+                    read_sig_chunks(file, self.config, index_file=True, chunk_size=self.lines_to_buffer)
+                    for file in self.index_folder.open_files(to_merge, mode="rb")
+                ]
+                with MinhashIndexSegmentWriter(self.index_folder, new_segment) as out_f:
+                    for sigs in merge_unique_sigs(sig_readers, self.config):
+                        out_f.write(sigs)
+                fences[Path(new_segment).name] = out_f.fences
+                segments = [segment for segment in segments if segment not in to_merge] + [new_segment]
+                self.stat_update("merged_segments", value=len(to_merge))
+            else:
+                to_merge = []
+
+            manifest = {
+                Path(segment).name: fences.get(Path(segment).name) or self.get_fences(segment) for segment in segments
+            }
+            with self.index_folder.open(f"bucket_{bucket:03d}/{INDEX_MANIFEST}", mode="wt") as f:
+                json.dump({"segments": manifest}, f)
+            self.stat_update("segments", value=len(manifest))
+
+            # the manifest is saved: remove the merged segments and the fences that are now part of it
+            for segment in to_merge:
+                self.index_folder.rm(segment)
+            for file in self.index_folder.list_files(
+                subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.index.json"
+            ):
+                self.index_folder.rm(file)
@@ -9,21 +9,27 @@ from: https://jmlr.org/papers/volume21/20-074/20-074.pdf (C4)
 
 import contextlib
 import dataclasses
-import heapq
-import struct
-from concurrent.futures import ThreadPoolExecutor
+import itertools
+import zlib
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import BinaryIO, Generator
+from typing import Generator
 
 import numpy as np
 from fsspec.spec import AbstractBufferedFile
-from tqdm import tqdm
 
 from datatrove.data import Document, DocumentsPipeline
-from datatrove.io import DataFolderLike, get_datafolder
+from datatrove.io import DataFolder, DataFolderLike, get_datafolder
 from datatrove.pipeline.base import PipelineStep
-from datatrove.utils.binaryio import read_np_from_file, read_tuples_from_file
+from datatrove.utils.batching import batched
+from datatrove.utils.binaryio import (
+    GrowableNpArray,
+    SortedHashLookup,
+    merge_sorted_np_chunks,
+    read_np_chunks_from_file,
+    read_np_from_files,
+    read_tuples_from_file,
+)
 from datatrove.utils.hashing import HashConfig, create_hash_func
 from datatrove.utils.logging import logger
 from datatrove.utils.text import (
@@ -50,6 +56,51 @@ class SentDedupConfig:
     hash_config: HashConfig = field(default_factory=HashConfig)
 
 
+def get_sig_dtype(config: SentDedupConfig) -> np.dtype:
+    """Numpy dtype of a record (hash, doc id, sentence id) in a stage 1 signature file"""
+    return np.dtype([("hash", config.hash_config.np_descr), ("doc", "<u4"), ("sent", "<u2")])
+
+
+# per document record of a sentence spans file: number of sentences and checksum of the text
+SPANS_DOC_DTYPE = np.dtype([("sentences", "<u4"), ("checksum", "<u4")])
+
+
+def get_text_checksum(text: str) -> int:
+    """Checksum used to detect that a document's text changed since its sentence spans were saved"""
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def save_sentence_spans(folder: DataFolder, rank: int, docs: np.ndarray, sentence_ends: np.ndarray):
+    """Save the sentence spans of the documents of a task
+
+    The file contains the number of documents (uint64), one `SPANS_DOC_DTYPE` record per document and the end offset
+    (uint32) of each sentence of each document. Each sentence starts where the previous one ended.
+    """
+    with folder.open(f"{rank:05d}{ExtensionHelperSD.stage_1_sentence_spans}", mode="wb") as f:
+        for array in (np.array([len(docs)], dtype="<u8"), docs.astype(SPANS_DOC_DTYPE), sentence_ends.astype("<u4")):
+            if folder.is_local():
+                array.tofile(f)
+            else:
+                f.write(array.tobytes())
+
+
+def load_sentence_spans(folder: DataFolder, rank: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Load the sentence spans of a task (see `save_sentence_spans`)
+
+    Returns:
+        tuple (checksums, doc_bounds, sentence_ends): the sentence ends of document i are
+        sentence_ends[doc_bounds[i] : doc_bounds[i + 1]]
+    """
+    with folder.open(f"{rank:05d}{ExtensionHelperSD.stage_1_sentence_spans}", mode="rb") as f:
+        data = f.read()
+    nr_docs = int(np.frombuffer(data, dtype="<u8", count=1)[0])
+    docs = np.frombuffer(data, dtype=SPANS_DOC_DTYPE, count=nr_docs, offset=8)
+    sentence_ends = np.frombuffer(data, dtype="<u4", offset=8 + docs.nbytes)
+    doc_bounds = np.zeros(nr_docs + 1, dtype=np.int64)
+    np.cumsum(docs["sentences"], out=doc_bounds[1:])
+    return docs["checksum"], doc_bounds, sentence_ends
+
+
 @dataclass(order=True)
 class HashSig:
     # this also determines the sorting order
@@ -68,11 +119,19 @@ class HashSig:
 class SentenceDedupSignature(PipelineStep):
     """SentenceDedup: First pipeline step
 
-        Creates a signature for each sentence in each document. Each HashSig has n hash, the doc id and the sentence idx. Before saving
-        them the hashes are sorted.
+        Creates a signature for each sentence in each document. Each signature has the hash of n sentences, the doc id
+        and the sentence idx. Documents are hashed in batches and the signatures are accumulated in a numpy buffer,
+        which is sorted before saving.
 
     Args:
         output_folder: folder where signatures are saved
+        finder_workers: number of workers of stage 2. Signatures are split into this many hash ranges
+        config: sentence dedup configuration
+        language: language used for sentence splitting
+        batch_size: number of documents hashed together
+        save_sentence_spans: also save the sentence boundaries of each document (and a checksum of its text) to a
+            .c4_spans file, so that stage 3 does not have to split the documents into sentences again. Requires
+            `split_sentences`
     """
 
     type = "🫂 - DEDUPS"
@@ -84,6 +143,8 @@ class SentenceDedupSignature(PipelineStep):
         finder_workers: int = 1,
         config: SentDedupConfig = None,
         language: str = Languages.english,
+        batch_size: int = 1000,
+        save_sentence_spans: bool = False,
     ):
         super().__init__()
         self.output_folder = get_datafolder(output_folder)
@@ -93,57 +154,100 @@ class SentenceDedupSignature(PipelineStep):
             logger.warning(f"Remember to also set the name of tasks of the finder block to {finder_workers=}!")
         self.finder_workers = finder_workers
         self.config = config or SentDedupConfig()
-        self.hash_fc = create_hash_func(config.hash_config)
+        self.hash_fc = create_hash_func(self.config.hash_config)
         self.language = language
         self.tokenizer = load_word_tokenizer(language)
+        self.batch_size = batch_size
+        if save_sentence_spans and not self.config.split_sentences:
+            raise ValueError("save_sentence_spans requires split_sentences")
+        self.save_sentence_spans = save_sentence_spans
 
-    def save_hashes(self, rank: int, signatures):
-        # explicitly define little endianness
-        signatures = np.array(
-            signatures, dtype=[("hash", self.config.hash_config.np_descr), ("doc", "<u4"), ("sent", "<u2")]
-        )
-        signatures.sort(axis=0)
+    def save_hashes(self, rank: int, signatures: np.ndarray):
+        """Sort the signatures (see `get_sig_dtype`) and save one file per finder worker
+
+        Args:
+            rank: rank of this task
+            signatures: signatures in (doc, sent) order, as returned by `get_hashes_batch`
+        """
+        # a stable sort on the hash keeps the (doc, sent) order of equal hashes: same order as sorting all the fields
+        signatures = signatures[np.argsort(signatures["hash"], kind="stable")]
 
         hashes_per_worker = self.config.hash_config.max // self.finder_workers
+        # last bucket needs to have everything
+        right_hashes = [(hash_i + 1) * hashes_per_worker for hash_i in range(self.finder_workers - 1)]
+        right_hashes.append(self.config.hash_config.max)
+        # end of each worker's range. This obeys the following rule:
+        # signatures['hash'][right_idx - 1] <= right_hash < signatures['hash'][right_idx]
+        right_idxs = np.searchsorted(signatures["hash"], np.array(right_hashes, dtype=np.uint64), side="right")
         left_idx = 0
-        for hash_i in range(self.finder_workers):
+        for hash_i, right_idx in enumerate(right_idxs):
             with self.output_folder.open(
                 f"{hash_i:04d}/{rank:05d}{ExtensionHelperSD.stage_1_signature}", mode="wb"
             ) as f:
-                # last bucket needs to have everything
-                right_hash = (
-                    (hash_i + 1) * hashes_per_worker
-                    if hash_i != self.finder_workers - 1
-                    else self.config.hash_config.max
-                )
-                # find last hash that goes in this bucket. This obeys the following rule:
-                # signatures['hash'][right_idx - 1] <= right_hash <= signatures['hash'][right_idx]
-                right_idx = left_idx + signatures["hash"][left_idx:].searchsorted(right_hash, side="right")
                 # save to file
                 if right_idx > left_idx:
                     if self.output_folder.is_local():
                         signatures[left_idx:right_idx].tofile(f)
                     else:
                         f.write(signatures[left_idx:right_idx].tobytes())
-                left_idx = right_idx
-                # we've reached the end of our data
-                if right_idx >= len(signatures):
-                    break
-
-    def get_hashes(self, doc: Document, doc_idx: int) -> list[None] | list[tuple[int, int, int]]:
-        sentences = self.tokenizer.sent_tokenize(doc.text) if self.config.split_sentences else doc.text.splitlines()
-        if len(sentences) < self.config.n_sentences:
-            return []
-
-        sentences_tokens = [simplify_text(sent, self.config.norm_config) for sent in sentences]
-        n_sent_grams: list = [" ".join(x) for x in ngrams(sentences_tokens, self.config.n_sentences)]
-        hashes = [
-            (self.hash_fc(n_sent_gram), doc_idx, sentence_idx)
-            for sentence_idx, n_sent_gram in enumerate(n_sent_grams)
-            if n_sent_gram.strip() != ""  # we actually do not want to remove all the \n everywhere
-        ]
+            left_idx = right_idx
+            # we've reached the end of our data
+            if right_idx >= len(signatures):
+                break
+
+    def get_hashes_batch(
+        self, docs: list[Document], first_doc_idx: int, sentence_ends: list[np.ndarray] | None = None
+    ) -> np.ndarray:
+        """Get the signatures of a batch of documents
+
+        Args:
+            docs: documents
+            first_doc_idx: index of the first document in this task
+            sentence_ends: if given, the documents are split with `span_tokenize` and the end offsets of the
+                sentences of each document are appended to this list
+
+        Returns:
+            numpy array of signatures (see `get_sig_dtype`), in (doc, sent) order
+        """
+        n_sent_grams = []
+        counts = np.zeros(len(docs), dtype=np.int64)
+        for doc_i, doc in enumerate(docs):
+            if sentence_ends is not None:
+                # empty sentences are dropped, as `sent_tokenize` does
+                spans = [
+                    (start, end)
+                    for start, end in self.tokenizer.span_tokenize(doc.text)
+                    if doc.text[start:end].strip()
+                ]
+                sentence_ends.append(np.array([end for _, end in spans], dtype=np.uint32))
+                sentences = [doc.text[start:end].strip() for start, end in spans]
+            elif self.config.split_sentences:
+                sentences = self.tokenizer.sent_tokenize(doc.text)
+            else:
+                sentences = doc.text.splitlines()
+            if len(sentences) < self.config.n_sentences:
+                continue
+            sentences_tokens = [simplify_text(sent, self.config.norm_config) for sent in sentences]
+            doc_n_sent_grams = [" ".join(x) for x in ngrams(sentences_tokens, self.config.n_sentences)]
+            n_sent_grams.extend(doc_n_sent_grams)
+            counts[doc_i] = len(doc_n_sent_grams)
+
+        # we actually do not want to remove all the \n everywhere
+        keep = np.fromiter(
+            (n_sent_gram.strip() != "" for n_sent_gram in n_sent_grams), dtype=bool, count=len(n_sent_grams)
+        )
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        signatures = np.empty(int(keep.sum()), dtype=get_sig_dtype(self.config))
+        signatures["hash"] = np.fromiter(
+            map(self.hash_fc, itertools.compress(n_sent_grams, keep)), dtype=np.uint64, count=len(signatures)
+        )
+        signatures["doc"] = np.repeat(np.arange(first_doc_idx, first_doc_idx + len(docs)), counts)[keep]
+        signatures["sent"] = (np.arange(len(n_sent_grams)) - starts)[keep]
+        return signatures
 
-        return hashes
+    def get_hashes(self, doc: Document, doc_idx: int) -> np.ndarray:
+        """Get the signatures of a single document (see `get_hashes_batch`)"""
+        return self.get_hashes_batch([doc], doc_idx)
 
     def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
         """Args:
@@ -153,16 +257,28 @@ class SentenceDedupSignature(PipelineStep):
 
         Returns:
 
-        SentenceDedupSignature creates a signature for each document. Each HashSig has n hash, the doc id and the
-        sentence idx. Before saving them the hashes are sorted.
+        SentenceDedupSignature creates a signature for each document. Each signature has the hash of n sentences,
+        the doc id and the sentence idx. Before saving them the hashes are sorted.
 
         """
-        signatures = []
-        for doc_idx, doc in enumerate(data):
+        signatures = GrowableNpArray(get_sig_dtype(self.config))
+        spans_docs, spans_ends = GrowableNpArray(SPANS_DOC_DTYPE), GrowableNpArray(np.uint32)
+        doc_idx = 0
+        for batch in batched(data, self.batch_size):
             with self.stats.time_stats:
-                self.stat_update(StatHints.total)
-                signatures.extend(self.get_hashes(doc, doc_idx))
-        self.save_hashes(rank, signatures)
+                self.stat_update(StatHints.total, value=len(batch))
+                sentence_ends = [] if self.save_sentence_spans else None
+                signatures.extend(self.get_hashes_batch(batch, doc_idx, sentence_ends))
+                doc_idx += len(batch)
+                if self.save_sentence_spans:
+                    batch_docs = np.empty(len(batch), dtype=SPANS_DOC_DTYPE)
+                    batch_docs["sentences"] = [len(ends) for ends in sentence_ends]
+                    batch_docs["checksum"] = [get_text_checksum(doc.text) for doc in batch]
+                    spans_docs.extend(batch_docs)
+                    spans_ends.extend(np.concatenate(sentence_ends))
+        self.save_hashes(rank, signatures.data)
+        if self.save_sentence_spans:
+            save_sentence_spans(self.output_folder, rank, spans_docs.data, spans_ends.data)
 
 
 def read_sigs(
@@ -186,17 +302,45 @@ def read_sigs(
             )
 
 
+def read_sig_chunks(
+    file: AbstractBufferedFile, config: SentDedupConfig, index_file: bool = False, chunk_size: int = 1000
+) -> Generator[np.ndarray, None, None]:
+    """Read a sorted signature file (see `get_sig_dtype`) or index file (hashes only) in numpy chunks"""
+    with file as f:
+        yield from read_np_chunks_from_file(
+            f, np.dtype(config.hash_config.np_descr) if index_file else get_sig_dtype(config), chunk_size
+        )
+
+
+def merge_sig_chunks(
+    sig_readers: list[Generator[np.ndarray, None, None]],
+) -> Generator[tuple[np.ndarray, np.ndarray], None, None]:
+    """Merge sorted signature readers (see `read_sig_chunks`) into sorted batches of (records, reader_ids).
+
+    Records are sorted like `HashSig`: by hash, doc id, reader id and sentence id. All the records with the same hash
+    are always in the same batch.
+    """
+    return merge_sorted_np_chunks(
+        sig_readers,
+        key=lambda records: records["hash"],
+        lexsort_keys=lambda records, reader_ids: (records["sent"], reader_ids, records["doc"], records["hash"]),
+    )
+
+
 class SentenceFindDedups(PipelineStep):
     """SentenceDedup: Second pipeline step
 
-        SentenceFindDedups runs on a single worker. It reads all the signatures from the previous step and loads them
-        in a priority queue to check for duplicates. If a duplicate is found its document id and sentence id are saved.
+        SentenceFindDedups runs on a single worker (or one per hash range, see `finder_workers`). It reads all the
+        signatures from the previous step in numpy chunks and merges them to find runs of equal hashes, which are
+        matched against the index with `searchsorted`. The document id and sentence id of the duplicates are saved in
+        bulk.
 
     Args:
         data_folder: data folder where signatures are saved
         output_folder: folder where duplicates are saved
         index_folder: folder where index files are saved
-        only_dedup_in_index: only dedup in index
+        config: sentence dedup configuration. `only_dedup_in_index` is read from it
+        lines_to_buffer: number of signatures read at a time from each file
     """
 
     type = "🫂 - DEDUPS"
@@ -208,7 +352,7 @@ class SentenceFindDedups(PipelineStep):
         output_folder: DataFolderLike,
         index_folder: DataFolderLike = None,
         config: SentDedupConfig = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = 1000,
     ):
         super().__init__()
         self.data_folder = get_datafolder(data_folder)
@@ -231,62 +375,48 @@ class SentenceFindDedups(PipelineStep):
                     subdirectory=f"{rank:04d}", glob_pattern=ExtensionHelperSD.stage_1_signature
                 )
             sig_readers = [
-                read_sigs(file, file_i, config=self.config, lines_to_buffer=self.lines_to_buffer)
-                for file_i, file in enumerate(self.data_folder.open_files(sig_files))
+                read_sig_chunks(file, self.config, chunk_size=self.lines_to_buffer)
+                for file in self.data_folder.open_files(sig_files)
             ]
+            file_stems = [Path(file).name.removesuffix(ExtensionHelperSD.stage_1_signature) for file in sig_files]
             index_files = self.index_folder.list_files() if self.index_folder else None
+            index = None
             if index_files:
                 logger.info(f"Found index file(s): {', '.join(index_files)}")
-                sig_readers.extend(
+                index = SortedHashLookup(
                     [
-                        read_sigs(
-                            file,
-                            len(sig_readers) + file_i,
-                            config=self.config,
-                            index_file=True,
-                            lines_to_buffer=self.lines_to_buffer,
-                        )
-                        for file_i, file in enumerate(self.index_folder.open_files(index_files))
+                        read_sig_chunks(file, self.config, index_file=True, chunk_size=self.lines_to_buffer)
+                        for file in self.index_folder.open_files(index_files)
                     ]
                 )
 
-            logger.info(f"Initializing pq with {len(sig_readers)} files.")
-            with ThreadPoolExecutor() as executor:
-                pq = [
-                    x
-                    for x in tqdm(
-                        executor.map(lambda x: next(x, None), sig_readers),
-                        total=len(sig_readers),
-                        desc="Initializing pq...",
-                    )
-                    if x
-                ]
-            heapq.heapify(pq)
-            logger.info("PQ initialized.")
-
             output_mg = self.output_folder.get_output_file_manager(mode="wb")
-
-            packer = struct.Struct("<IH")
-
-            last: HashSig | None = None
-            while pq:
-                v: HashSig = heapq.heappop(pq)
-                if (
-                    last and last.hash_value == v.hash_value and not v.is_from_index()
-                ):  # we never want to match samples from the index itself
-                    out_filename = f"{rank:04d}/{v.file_stem}{ExtensionHelperSD.stage_2_duplicates}"
-                    # the previous one we are matching against is part of the index
-                    # OR there are no index files
-                    # OR we are also matching within the main dataset
-                    if last.is_from_index() or not index_files or not self.config.only_dedup_in_index:
-                        output_mg.write(out_filename, packer.pack(v.doc_id, v.sent_id))
-
-                if not last or last.hash_value != v.hash_value or not last.is_from_index():
-                    last = v
-                new_v = next(sig_readers[v.file_id], None)
-
-                if new_v:
-                    heapq.heappush(pq, new_v)
+            dup_dtype = np.dtype([("doc", "<u4"), ("sent", "<u2")])
+
+            for records, reader_ids in merge_sig_chunks(sig_readers):
+                hashes = records["hash"]
+                # first occurrence of each hash in the dataset: the one we keep when there is no index match
+                first = np.ones(len(records), dtype=bool)
+                first[1:] = hashes[1:] != hashes[:-1]
+                # we never want to match samples from the index itself
+                if index is not None:
+                    # hashes from the index always come first, so all the dataset occurrences are duplicates
+                    in_index = index.contains(hashes[first])[np.cumsum(first) - 1]
+                    is_dup = in_index if self.config.only_dedup_in_index else in_index | ~first
+                else:
+                    is_dup = ~first
+                dups = np.flatnonzero(is_dup)
+                if not len(dups):
+                    continue
+                # write the (doc, sent) of the duplicates, grouped by file while keeping their order
+                order = dups[np.argsort(reader_ids[dups], kind="stable")]
+                bounds = np.flatnonzero(np.diff(reader_ids[order])) + 1
+                for group in np.split(order, bounds):
+                    out = np.empty(len(group), dtype=dup_dtype)
+                    out["doc"] = records["doc"][group]
+                    out["sent"] = records["sent"][group]
+                    file_stem = file_stems[reader_ids[group[0]]]
+                    output_mg.write(f"{rank:04d}/{file_stem}{ExtensionHelperSD.stage_2_duplicates}", out.tobytes())
 
         output_mg.close()
 
@@ -301,6 +431,8 @@ class SentenceDedupFilter(PipelineStep):
         n_sentences: n_sentences where duplicates are checked. Should match step1
         min_doc_words: min amount of words (after removing duplicate sentences) to keep a document
         exclusion_writer: writer to save excluded documents
+        sentence_spans_folder: output folder of stage 1, if it was run with `save_sentence_spans`. The sentence
+            boundaries saved there are used instead of splitting the documents again (unless their text changed)
     """
 
     type = "🫂 - DEDUPS"
@@ -312,6 +444,7 @@ class SentenceDedupFilter(PipelineStep):
         config: SentDedupConfig = None,
         exclusion_writer: DiskWriter = None,
         language: str = Languages.english,
+        sentence_spans_folder: DataFolderLike = None,
     ):
         super().__init__()
         self.data_folder = get_datafolder(data_folder)
@@ -319,17 +452,18 @@ class SentenceDedupFilter(PipelineStep):
         self.tokenizer = load_word_tokenizer(language)
         self.exclusion_writer = exclusion_writer
         self.language = language
-
-    def read_duplicates(self, file: BinaryIO) -> np.ndarray:
-        """Helper function to read duplicates from a binary file storing (doc_id, sent_id) pairs as created by the second stage."""
-        return read_np_from_file(
-            file, dtype=np.dtype([("doc", "<u4"), ("sent", "<u2")]), is_local_file=self.data_folder.is_local()
-        )
-
-    def remove_dup_sentences(self, doc: Document, du_lines: np.ndarray) -> tuple[str, str]:
-        sentence_spans = (
-            list(self.tokenizer.span_tokenize(doc.text)) if self.config.split_sentences else doc.text.splitlines()
-        )
+        self.sentence_spans_folder = get_datafolder(sentence_spans_folder) if sentence_spans_folder else None
+
+    def remove_dup_sentences(
+        self, doc: Document, du_lines: np.ndarray, sentence_ends: np.ndarray | None = None
+    ) -> tuple[str, str]:
+        if sentence_ends is not None:
+            # spans saved by stage 1: each sentence starts where the previous one ended
+            sentence_spans = list(zip([0] + sentence_ends[:-1].tolist(), sentence_ends.tolist()))
+        elif self.config.split_sentences:
+            sentence_spans = list(self.tokenizer.span_tokenize(doc.text))
+        else:
+            sentence_spans = doc.text.splitlines()
         kept_sentences = []
         original_formatted = []
         last_s = 0
@@ -393,34 +527,36 @@ class SentenceDedupFilter(PipelineStep):
 
         logger.info(f"Loading duplicate indexes from {len(files)} results files.")
 
-        all_dups = np.array([], dtype=[("doc", "<u4"), ("sent", "<u2")])
-        if files:
-            with ThreadPoolExecutor() as pool:
-                all_dups = np.concatenate(
-                    list(tqdm(pool.map(self.read_duplicates, self.data_folder.open_files(files)), total=len(files))),
-                    axis=0,
-                )
-            all_dups.sort()
-        _, doc_starts = np.unique(all_dups["doc"], return_index=True)
+        all_dups = read_np_from_files(self.data_folder, files, np.dtype([("doc", "<u4"), ("sent", "<u2")]))
+        all_dups.sort()
+        # the duplicate sentences of document i are all_dups["sent"][doc_bounds[i] : doc_bounds[i + 1]]
+        doc_bounds = np.searchsorted(
+            all_dups["doc"], np.arange(int(all_dups["doc"][-1]) + 2 if len(all_dups) else 0), side="left"
+        )
 
         logger.info("Loaded duplicate indexes.")
 
-        dups_doc_i = 0
+        checksums, spans_bounds = None, None
+        if self.sentence_spans_folder:
+            checksums, spans_bounds, sentence_ends = load_sentence_spans(self.sentence_spans_folder, rank)
+
         with self.exclusion_writer if self.exclusion_writer else contextlib.nullcontext() as writer:
             for doc_idx, doc in enumerate(data):
                 self.stat_update(StatHints.total)
                 with self.stats.time_stats:
-                    if dups_doc_i >= len(doc_starts) or all_dups["doc"][doc_starts[dups_doc_i]] > doc_idx:
+                    if doc_idx + 1 >= len(doc_bounds) or doc_bounds[doc_idx] == doc_bounds[doc_idx + 1]:
                         filtered_text, original_formatted = doc.text, None
                     else:
-                        sents_span_l, sents_span_r = (
-                            doc_starts[dups_doc_i],
-                            doc_starts[dups_doc_i + 1] if dups_doc_i + 1 < len(doc_starts) else None,
-                        )
+                        doc_sentence_ends = None
+                        if checksums is not None:
+                            if doc_idx < len(checksums) and checksums[doc_idx] == get_text_checksum(doc.text):
+                                doc_sentence_ends = sentence_ends[spans_bounds[doc_idx] : spans_bounds[doc_idx + 1]]
+                            else:
+                                # the text changed since stage 1: split it again
+                                self.stat_update("sentence_spans_mismatch")
                         filtered_text, original_formatted = self.remove_dup_sentences(
-                            doc, all_dups["sent"][sents_span_l:sents_span_r]
+                            doc, all_dups["sent"][doc_bounds[doc_idx] : doc_bounds[doc_idx + 1]], doc_sentence_ends
                         )
-                        dups_doc_i += 1
 
                 if (
                     (
@@ -458,6 +594,8 @@ class SentenceDedupBuildIndex(PipelineStep):
         data_folder: data folder to get signature files.
         output_folder: folder where index is saved
         index_name: name of the index
+        config: sentence dedup configuration
+        lines_to_buffer: number of signatures read at a time from each file
     """
 
     type = "🫂 - DEDUP"
@@ -469,7 +607,7 @@ class SentenceDedupBuildIndex(PipelineStep):
         output_folder: DataFolderLike,
         index_name: str,
         config: SentDedupConfig = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = 1000,
     ):
         super().__init__()
         self.data_folder = get_datafolder(data_folder)
@@ -483,21 +621,15 @@ class SentenceDedupBuildIndex(PipelineStep):
         with self.stats.time_stats:
             sig_files = self.data_folder.list_files(glob_pattern="*/*" + ExtensionHelperSD.stage_1_signature)
             sig_readers = [
-                read_sigs(file, file_i, self.config, lines_to_buffer=self.lines_to_buffer)
-                for file_i, file in enumerate(self.data_folder.open_files(sig_files))
+                read_sig_chunks(file, self.config, chunk_size=self.lines_to_buffer)
+                for file in self.data_folder.open_files(sig_files)
             ]
 
-            pq = [next(sig_reader) for sig_reader in sig_readers]
-            heapq.heapify(pq)
-
             with self.output_folder.open(f"{self.index_name}.{ExtensionHelperSD.index}", mode="wb") as out_f:
-                last = None
-                while pq:
-                    v: HashSig = heapq.heappop(pq)
-                    if last != v.hash_value:
-                        out_f.write(struct.pack(f"<{self.config.hash_config.struct_format}", v.hash_value))
-                    last = v.hash_value
-                    new_v = next(sig_readers[v.file_id], None)
-
-                    if new_v:
-                        heapq.heappush(pq, new_v)
+                for records, _ in merge_sig_chunks(sig_readers):
+                    # equal hashes are always in the same batch
+                    hashes = np.unique(records["hash"])
+                    if self.output_folder.is_local():
+                        hashes.tofile(out_f)
+                    else:
+                        out_f.write(hashes.tobytes())
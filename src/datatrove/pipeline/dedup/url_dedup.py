@@ -3,22 +3,27 @@ URL based deduplication.
 """
 
 import contextlib
-import heapq
-import struct
-from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from functools import partial
+from functools import lru_cache
 from pathlib import Path
-from typing import BinaryIO, Callable, Generator
+from typing import Callable, Generator
 
 import numpy as np
 from fsspec.spec import AbstractBufferedFile
-from tqdm import tqdm
 
 from datatrove.data import Document, DocumentsPipeline
 from datatrove.io import DataFolderLike, get_datafolder
 from datatrove.pipeline.base import PipelineStep
-from datatrove.utils.binaryio import read_np_from_file, read_tuples_from_file
+from datatrove.utils.batching import batched
+from datatrove.utils.binaryio import (
+    GrowableNpArray,
+    SortedHashLookup,
+    get_lookup_array,
+    merge_sorted_np_chunks,
+    read_np_chunks_from_file,
+    read_np_from_files,
+    read_tuples_from_file,
+)
 from datatrove.utils.hashing import HashConfig, create_hash_func
 from datatrove.utils.logging import logger
 from datatrove.utils.typeshelper import ExtensionHelperSD, StatHints
@@ -68,13 +73,17 @@ def get_sig_dtype(config: HashConfig) -> np.dtype:
 
 class UrlDedupSignature(PipelineStep):
     """UrlDedup: First pipeline step
-        Creates a signature for url in each document. Each HashSig has n hash, the priority the doc id. Before saving
+        Creates a signature for url in each document. Each signature has the hash of the url, the priority and the doc
+        id. Documents are processed in batches and the signatures are accumulated in a numpy buffer. Before saving
         them the hashes are sorted based on (hash, -priority, doc_id).
 
     Args:
         output_folder: folder where signatures are saved
         finder_workers: number of workers used in finder stage of deduplication
         config: configuration for the dedup
+        batch_size: number of documents whose urls are normalized and hashed together
+        url_cache_size: maximum number of normalized urls kept in a LRU cache (crawls often repeat the same urls),
+            to call `url_normalizer` once per distinct url. Set to 0 to disable
     """
 
     type = "🫂 - DEDUPS"
@@ -85,6 +94,8 @@ class UrlDedupSignature(PipelineStep):
         output_folder: DataFolderLike,
         finder_workers: int = 1,
         config: UrlDedupConfig | None = None,
+        batch_size: int = 1000,
+        url_cache_size: int = 2**16,
     ):
         super().__init__()
         self.output_folder = get_datafolder(output_folder)
@@ -95,62 +106,106 @@ class UrlDedupSignature(PipelineStep):
         self.finder_workers = finder_workers
         self.config = config or UrlDedupConfig()
         self.hash_fc = create_hash_func(self.config.hash_config)
+        self.batch_size = batch_size
+        self.url_cache_size = url_cache_size
+        self._url_normalizer = None
+
+    @property
+    def url_normalizer(self) -> Callable[[str], str] | None:
+        """`url_normalizer` of the config, wrapped in a bounded LRU cache"""
+        if self._url_normalizer is None and self.config.url_normalizer:
+            self._url_normalizer = (
+                lru_cache(maxsize=self.url_cache_size)(self.config.url_normalizer)
+                if self.url_cache_size > 0
+                else self.config.url_normalizer
+            )
+        return self._url_normalizer
+
+    def save_hashes(self, rank: int, signatures: np.ndarray):
+        """Sort the signatures (see `get_sig_dtype`) and save one file per finder worker
 
-    def save_hashes(self, rank: int, signatures):
+        Args:
+            rank: rank of this task
+            signatures: signatures in doc_id order, as returned by `get_hashes_batch`
+        """
         sig_dtype = get_sig_dtype(self.config.hash_config)
         priority_max = np.iinfo(sig_dtype["priority"]).max
 
-        # 0 will stay as is, so we can't use 0 as a priority
-        assert all(
-            sig[1] >= 1 and sig[1] <= priority_max for sig in signatures
-        ), f"priority must be between 1 and {priority_max}"
-        signatures = np.array(signatures, dtype=sig_dtype)
-
-        # Ensure that the highest priority is always first
-        signatures["priority"] = -signatures["priority"]
-        signatures.sort(axis=0)
-        signatures["priority"] = -signatures["priority"]
+        # Ensure that the highest priority is always first. lexsort is stable, so equal (hash, priority) keep their
+        # doc_id order
+        signatures = signatures[np.lexsort((priority_max - signatures["priority"], signatures["hash"]))]
 
         # Same code as in sentence_dedup
         hashes_per_worker = self.config.hash_config.max // self.finder_workers
+        # last bucket needs to have everything
+        right_hashes = [(hash_i + 1) * hashes_per_worker for hash_i in range(self.finder_workers - 1)]
+        right_hashes.append(np.iinfo(np.uint64).max)
+        # end of each worker's range. This obeys the following rule:
+        # signatures['hash'][right_idx - 1] <= right_hash < signatures['hash'][right_idx]
+        right_idxs = np.searchsorted(signatures["hash"], np.array(right_hashes, dtype=np.uint64), side="right")
         left_idx = 0
-        for hash_i in range(self.finder_workers):
+        for hash_i, right_idx in enumerate(right_idxs):
             with self.output_folder.open(
                 f"{hash_i:04d}/{rank:05d}{ExtensionHelperSD.stage_1_signature}",
                 mode="wb",
             ) as f:
-                # last bucket needs to have everything
-                right_hash = (
-                    (hash_i + 1) * hashes_per_worker if hash_i != self.finder_workers - 1 else np.iinfo(np.uint64).max
-                )
-                # find last hash that goes in this bucket. This obeys the following rule:
-                # signatures['hash'][right_idx - 1] <= right_hash <= signatures['hash'][right_idx]
-                right_idx = left_idx + signatures["hash"][left_idx:].searchsorted(right_hash, side="right")
                 # save to file
                 if right_idx > left_idx:
-                    bts = signatures[left_idx:right_idx].tobytes()
-                    f.write(bts)
-                left_idx = right_idx
-                # we've reached the end of our data
-                if right_idx >= len(signatures):
-                    break
-
-    def get_hashes(self, doc: Document, doc_idx: int) -> list[None] | list[tuple[int, int, int]]:
-        normalized_url: str = (
-            self.config.url_normalizer(doc.metadata["url"]) if self.config.url_normalizer else doc.metadata["url"]
-        )
-        priority = self.config.document_priority(doc) if self.config.document_priority else 1
-        hashes = [(self.hash_fc(normalized_url), priority, doc_idx)]
+                    if self.output_folder.is_local():
+                        signatures[left_idx:right_idx].tofile(f)
+                    else:
+                        f.write(signatures[left_idx:right_idx].tobytes())
+            left_idx = right_idx
+            # we've reached the end of our data
+            if right_idx >= len(signatures):
+                break
+
+    def get_keys(self, docs: list[Document]) -> list[str]:
+        """Strings that are hashed to build the signatures: the (normalized) url of each document"""
+        urls = [doc.metadata["url"] for doc in docs]
+        if self.url_normalizer:
+            urls = list(map(self.url_normalizer, urls))
+        return urls
+
+    def get_hashes_batch(self, docs: list[Document], first_doc_idx: int) -> np.ndarray:
+        """Get the signatures of a batch of documents
+
+        Args:
+            docs: documents
+            first_doc_idx: index of the first document in this task
+
+        Returns:
+            numpy array of signatures (see `get_sig_dtype`), in doc_id order
+        """
+        sig_dtype = get_sig_dtype(self.config.hash_config)
+        priority_max = np.iinfo(sig_dtype["priority"]).max
 
-        return hashes
+        signatures = np.empty(len(docs), dtype=sig_dtype)
+        signatures["hash"] = np.fromiter(map(self.hash_fc, self.get_keys(docs)), dtype=np.uint64, count=len(docs))
+        if self.config.document_priority:
+            priorities = np.fromiter(map(self.config.document_priority, docs), dtype=np.int64, count=len(docs))
+            # 0 will stay as is, so we can't use 0 as a priority
+            if not np.all((priorities >= 1) & (priorities <= priority_max)):
+                raise ValueError(f"priority must be between 1 and {priority_max}")
+            signatures["priority"] = priorities
+        else:
+            signatures["priority"] = 1
+        signatures["doc"] = np.arange(first_doc_idx, first_doc_idx + len(docs))
+        return signatures
+
+    def get_hashes(self, doc: Document, doc_idx: int) -> np.ndarray:
+        """Get the signature of a single document (see `get_hashes_batch`)"""
+        return self.get_hashes_batch([doc], doc_idx)
 
     def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
-        signatures = []
-        for doc_idx, doc in enumerate(data):
+        signatures = GrowableNpArray(get_sig_dtype(self.config.hash_config))
+        doc_idx = 0
+        for batch in batched(data, self.batch_size):
             with self.stats.time_stats:
-                self.stat_update(StatHints.total)
-                signatures.extend(self.get_hashes(doc, doc_idx))
-        self.save_hashes(rank, signatures)
+                self.stat_update(StatHints.total, value=len(batch))
+                signatures.extend(self.get_hashes_batch(batch, doc_idx))
+                doc_idx += len(batch)
+        self.save_hashes(rank, signatures.data)
 
 
 def read_sigs(
@@ -180,18 +235,49 @@ def read_sigs(
             )
 
 
+def read_sig_chunks(
+    file: AbstractBufferedFile, hash_config: HashConfig, index_file: bool = False, chunk_size: int = 1000
+) -> Generator[np.ndarray, None, None]:
+    """Read a sorted signature file (see `get_sig_dtype`) or index file (hashes only) in numpy chunks"""
+    with file as f:
+        yield from read_np_chunks_from_file(
+            f, np.dtype(hash_config.np_dtype) if index_file else get_sig_dtype(hash_config), chunk_size
+        )
+
+
+def merge_sig_chunks(
+    sig_readers: list[Generator[np.ndarray, None, None]],
+) -> Generator[tuple[np.ndarray, np.ndarray], None, None]:
+    """Merge sorted signature readers (see `read_sig_chunks`) into sorted batches of (records, reader_ids).
+
+    Records are sorted like `HashSig`: by hash, highest priority first and doc id (then reader id). All the records
+    with the same hash are always in the same batch.
+    """
+    priority_max = np.iinfo(np.uint16).max
+    return merge_sorted_np_chunks(
+        sig_readers,
+        key=lambda records: records["hash"],
+        lexsort_keys=lambda records, reader_ids: (
+            reader_ids,
+            records["doc"],
+            priority_max - records["priority"],
+            records["hash"],
+        ),
+    )
+
+
 class UrlFindDedups(PipelineStep):
     """UrlDedup: Second pipeline step
-        UrlFindDedups reads all the signatures from the previous step and loads them
-        in a priority queue to check for duplicates. If a duplicate is found its document id is saved.
-        The document with the highest priority is the one that will be saved out of the duplicates .
+        UrlFindDedups reads all the signatures from the previous step in numpy chunks and merges them to find runs of
+        equal hashes, which are matched against the index with `searchsorted`. If a duplicate is found its document
+        id is saved. The document with the highest priority is the one that will be saved out of the duplicates.
 
     Args:
         data_folder: data folder where signatures are saved
         output_folder: folder where duplicates are saved
         index_folder: folder where index files are saved
         config: configuration for the dedup
-        lines_to_buffer: number of lines to buffer (speed up reading)
+        lines_to_buffer: number of signatures read at a time from each file
     """
 
     type = "🫂 - DEDUPS"
@@ -203,7 +289,7 @@ class UrlFindDedups(PipelineStep):
         output_folder: DataFolderLike,
         index_folder: DataFolderLike | None = None,
         config: UrlDedupConfig | None = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = 1000,
     ):
         super().__init__()
         self.data_folder = get_datafolder(data_folder)
@@ -228,62 +314,47 @@ class UrlFindDedups(PipelineStep):
                     glob_pattern=ExtensionHelperSD.stage_1_signature,
                 )
             sig_readers = [
-                read_sigs(
-                    file,
-                    file_i,
-                    self.config.hash_config,
-                    lines_to_buffer=self.lines_to_buffer,
-                )
-                for file_i, file in enumerate(self.data_folder.open_files(sig_files))
+                read_sig_chunks(file, self.config.hash_config, chunk_size=self.lines_to_buffer)
+                for file in self.data_folder.open_files(sig_files)
             ]
+            file_stems = [Path(file).name.removesuffix(ExtensionHelperSD.stage_1_signature) for file in sig_files]
             index_files = self.index_folder.list_files() if self.index_folder else None
+            index = None
             if index_files:
                 logger.info(f"Found index file(s): {', '.join(index_files)}")
-                sig_readers.extend(
+                index = SortedHashLookup(
                     [
-                        read_sigs(
-                            file,
-                            len(sig_readers) + file_i,
-                            self.config.hash_config,
-                            index_file=True,
-                            lines_to_buffer=self.lines_to_buffer,
+                        read_sig_chunks(
+                            file, self.config.hash_config, index_file=True, chunk_size=self.lines_to_buffer
                         )
-                        for file_i, file in enumerate(self.index_folder.open_files(index_files))
+                        for file in self.index_folder.open_files(index_files)
                     ]
                 )
 
-            logger.info(f"Initializing pq with {len(sig_readers)} files.")
-            with ThreadPoolExecutor() as executor:
-                pq = [
-                    x
-                    for x in tqdm(
-                        executor.map(lambda x: next(x, None), sig_readers),
-                        total=len(sig_readers),
-                        desc="Initializing pq...",
-                    )
-                    if x
-                ]
-            heapq.heapify(pq)
-            logger.info("PQ initialized.")
-
             output_mg = self.output_folder.get_output_file_manager(mode="wb")
-            last: HashSig | None = None
-            packer = struct.Struct("<I")
-            while pq:
-                v: HashSig = heapq.heappop(pq)
-
-                if last and last.hash_value == v.hash_value and not v.is_from_index():
-                    out_filename = f"{rank:04d}/{v.file_stem}{ExtensionHelperSD.stage_2_duplicates}"
-                    if not index_files or last.is_from_index() or not self.config.only_dedup_in_index:
-                        doc_id_bytes = packer.pack(v.doc_id)
-                        output_mg.write(out_filename, doc_id_bytes)
-
-                if not last or last.hash_value != v.hash_value or not last.is_from_index():
-                    last = v
-                new_v = next(sig_readers[v.file_id], None)
-
-                if new_v:
-                    heapq.heappush(pq, new_v)
+            for records, reader_ids in merge_sig_chunks(sig_readers):
+                hashes = records["hash"]
+                # first occurrence of each hash: the document with the highest priority, kept if not in the index
+                first = np.ones(len(records), dtype=bool)
+                first[1:] = hashes[1:] != hashes[:-1]
+                if index is not None:
+                    # hashes from the index always come first, so all the dataset occurrences are duplicates
+                    in_index = index.contains(hashes[first])[np.cumsum(first) - 1]
+                    is_dup = in_index if self.config.only_dedup_in_index else in_index | ~first
+                else:
+                    is_dup = ~first
+                dups = np.flatnonzero(is_dup)
+                if not len(dups):
+                    continue
+                # write the doc ids of the duplicates, grouped by file while keeping their order
+                order = dups[np.argsort(reader_ids[dups], kind="stable")]
+                bounds = np.flatnonzero(np.diff(reader_ids[order])) + 1
+                for group in np.split(order, bounds):
+                    file_stem = file_stems[reader_ids[group[0]]]
+                    output_mg.write(
+                        f"{rank:04d}/{file_stem}{ExtensionHelperSD.stage_2_duplicates}",
+                        records["doc"][group].astype("<u4").tobytes(),
+                    )
 
         output_mg.close()
 
@@ -312,11 +383,6 @@ class UrlDedupFilter(PipelineStep):
         self.config = config or UrlDedupConfig()
         self.exclusion_writer = exclusion_writer
 
-    def read_duplicates(self, file: BinaryIO, dup_dtype: np.dtype) -> np.ndarray:
-        """Helper function to read duplicates from a binary file storing (doc_id) as created by the second stage."""
-        with file as f:
-            return read_np_from_file(f, dtype=dup_dtype, is_local_file=self.data_folder.is_local())
-
     def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
         folders = self.data_folder.list_files(include_directories=True, recursive=False)
         # for performance reasons when having for instance 12k*10k files
@@ -329,33 +395,18 @@ class UrlDedupFilter(PipelineStep):
         logger.info(f"Loading duplicate indexes from {len(files)} results files.")
 
         dup_dtype = get_sig_dtype(self.config.hash_config)[2]
-        all_dups = np.array([], dtype=dup_dtype)
-        if files:
-            with ThreadPoolExecutor() as pool:
-                read_partial = partial(self.read_duplicates, dup_dtype=dup_dtype)
-                all_dups = np.concatenate(
-                    list(
-                        tqdm(
-                            pool.map(read_partial, self.data_folder.open_files(files)),
-                            total=len(files),
-                        )
-                    ),
-                    axis=0,
-                )
-            all_dups.sort()
+        is_duplicate = get_lookup_array(read_np_from_files(self.data_folder, files, dup_dtype))
 
         logger.info("Loaded duplicate indexes.")
-        dups_doc_i = 0
         with self.exclusion_writer if self.exclusion_writer else contextlib.nullcontext() as writer:
             with self.stats.time_stats:
                 for doc_idx, doc in enumerate(data):
                     self.stat_update(StatHints.total)
                     with self.stats.time_stats:
-                        if dups_doc_i < all_dups.shape[0] and all_dups[dups_doc_i] == doc_idx:
+                        if doc_idx < len(is_duplicate) and is_duplicate[doc_idx]:
                             if writer:
                                 writer.write(doc, rank=rank)
                             self.stat_update(StatHints.dropped)
-                            dups_doc_i += 1
                         else:
                             self.stat_update(StatHints.forwarded)
                             self.update_doc_stats(doc)
@@ -381,7 +432,7 @@ class UrlDedupBuildIndex(PipelineStep):
         output_folder: DataFolderLike,
         index_name: str,
         config: UrlDedupConfig | None = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = 1000,
     ):
         super().__init__()
         self.data_folder = get_datafolder(data_folder)
@@ -395,22 +446,15 @@ class UrlDedupBuildIndex(PipelineStep):
         with self.stats.time_stats:
             sig_files = self.data_folder.list_files(glob_pattern="*/*" + ExtensionHelperSD.stage_1_signature)
             sig_readers = [
-                read_sigs(file, file_i, self.config.hash_config, lines_to_buffer=self.lines_to_buffer)
-                for file_i, file in enumerate(self.data_folder.open_files(sig_files))
+                read_sig_chunks(file, self.config.hash_config, chunk_size=self.lines_to_buffer)
+                for file in self.data_folder.open_files(sig_files)
             ]
 
-            pq = [next(sig_reader) for sig_reader in sig_readers]
-            heapq.heapify(pq)
-
             with self.output_folder.open(f"{self.index_name}{ExtensionHelperSD.index}", mode="wb") as out_f:
-                last = None
-                while pq:
-                    v: HashSig = heapq.heappop(pq)
-
-                    if last != v.hash_value:
-                        out_f.write(struct.pack(f"<{self.config.hash_config.struct_format}", v.hash_value))
-                    last = v.hash_value
-                    new_v = next(sig_readers[v.file_id], None)
-
-                    if new_v:
-                        heapq.heappush(pq, new_v)
+                for records, _ in merge_sig_chunks(sig_readers):
+                    # equal hashes are always in the same batch
+                    hashes = np.unique(records["hash"]).astype(f"<{self.config.hash_config.struct_format}")
+                    if self.output_folder.is_local():
+                        hashes.tofile(out_f)
+                    else:
+                        out_f.write(hashes.tobytes())
@@ -86,7 +86,7 @@ class C4QualityFilter(BaseFilter):
         self.language = language
 
     def filter(self, doc: Document) -> bool | tuple[bool, str]:
-        lines = doc.text.splitlines() if self.split_paragraph else split_into_sentences(doc.text, self.language)
+        lines = doc.analysis.lines() if self.split_paragraph else doc.analysis.sentences(self.language)
 
         num_sentences = 0
         kept_lines = []
@@ -151,9 +151,9 @@ class C4ParagraphFilter(BaseFilter):
         self.min_paragraph_len = 200
         self.line_delimiter = "\n"
 
-    def paragraph_filter(self, page):
+    def paragraph_filter(self, doc: Document):
         """Returns False iff a page has too few or too short paragraphs."""
-        lines = page.split(self.line_delimiter)
+        lines = doc.analysis.split(self.line_delimiter)
         # Filter out docs that don't have at least three "paragraphs"
         # (lines >= `min_paragraph_len` chars).
         if (
@@ -164,7 +164,7 @@ class C4ParagraphFilter(BaseFilter):
         return True
 
     def filter(self, doc: Document) -> bool | tuple[bool, str]:
-        if not self.paragraph_filter(doc.text):
+        if not self.paragraph_filter(doc):
             return False, f"< {self.min_paragraphs} paragraphs"
         return True
 
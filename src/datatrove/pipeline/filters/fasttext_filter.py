@@ -7,7 +7,8 @@ from datatrove.data import Document
 from datatrove.io import cached_asset_path_or_download
 from datatrove.pipeline.filters.base_filter import BaseFilter
 from datatrove.pipeline.writers.disk_base import DiskWriter
-from datatrove.utils.text import SPLIT_TEXT_DOCUMENTS, split_into_parts
+from datatrove.utils.model_registry import get_model
+from datatrove.utils.text import SPLIT_TEXT_DOCUMENTS
 
 
 class FastTextClassifierFilter(BaseFilter):
@@ -33,6 +34,7 @@ class FastTextClassifierFilter(BaseFilter):
         newline_replacement: str to replace \n with before predicting scores
         filter_mode: predict and filter on DOCUMENT, PARAGRAPH or SENTENCE level
         exclusion_writer:
+        batch_size: number of documents whose units are all predicted with a single call to the model
     """
 
     name = "🤖 fastText"
@@ -47,8 +49,9 @@ class FastTextClassifierFilter(BaseFilter):
         exclusion_writer: DiskWriter | None = None,
         newline_replacement="",
         filter_mode: str = SPLIT_TEXT_DOCUMENTS,
+        batch_size: int = 1,
     ):
-        super().__init__(exclusion_writer)
+        super().__init__(exclusion_writer, batch_size)
         self.model_url = model_url
         self.keep_labels = keep_labels
         self.remove_labels = remove_labels
@@ -61,28 +64,53 @@ class FastTextClassifierFilter(BaseFilter):
         if remove_labels and isinstance(remove_labels[0], str):
             self.remove_labels = [remove_labels]
         self.save_labels_in_metadata = save_labels_in_metadata
-        self._model = None
+        self._labels_checked = False
 
     @property
     def model(self):
-        if self._model is None:
-            from fasttext.FastText import _FastText
-
-            model_file = cached_asset_path_or_download(
-                self.model_url, namespace="filters", subfolder="fasttext", desc="fast-text model"
-            )
-            self._model = _FastText(model_file)
+        # shared by all the steps of this process using the same model, see `model_registry`
+        model = get_model(("fasttext", self.model_url), self.load_model)
+        if not self._labels_checked:
             # check label values
-            available_labels = [x.removeprefix("__label__") for x in self._model.labels]
+            available_labels = [x.removeprefix("__label__") for x in model.labels]
             for label, _ in self.keep_labels or [] + self.remove_labels or []:
                 if label not in available_labels:
                     raise ValueError(
                         f"Label '{label}' passed as keep_labels or remove_labels is not available in this "
                         f"FastText model. Available labels: {available_labels}"
                     )
-        return self._model
+            self._labels_checked = True
+        return model
+
+    def load_model(self):
+        from fasttext.FastText import _FastText
+
+        model_file = cached_asset_path_or_download(
+            self.model_url, namespace="filters", subfolder="fasttext", desc="fast-text model"
+        )
+        return _FastText(model_file)
+
+    def preload_models(self):
+        self.model
 
     def filter(self, doc: Document) -> bool:
+        return self.filter_batch([doc])[0]
+
+    def filter_batch(self, batch: list[Document]) -> list[bool]:
+        # predict the units of all the documents with a single call, then split the predictions back per document
+        doc_units = [doc.analysis.parts(self.filter_mode) for doc in batch]
+        all_units = [unit.strip().replace("\n", self.newline_replacement) for units in doc_units for unit in units]
+        all_labels, all_scores = self.model.predict(all_units, k=-1) if all_units else ([], [])
+        results, start = [], 0
+        for doc, units in zip(batch, doc_units):
+            predictions = zip(all_labels[start : start + len(units)], all_scores[start : start + len(units)])
+            results.append(self.apply_predictions(doc, units, predictions))
+            start += len(units)
+        return results
+
+    def apply_predictions(self, doc: Document, units: list[str], predictions) -> bool:
+        """Keeps the units of `doc` whose (labels, scores) prediction passes the label thresholds"""
+
         def check_label_scores(unit_scores):
             if self.keep_labels:
                 return any(
@@ -93,11 +121,10 @@ class FastTextClassifierFilter(BaseFilter):
                     unit_scores.get(f"__label__{label}", -9e9) >= min_score for label, min_score in self.remove_labels
                 )
 
-        units = split_into_parts(doc.text, mode=self.filter_mode)
         kept_spans = []
         label_scores = defaultdict(list)
-        for unit in units:
-            labels, scores = self.model.predict(unit.strip().replace("\n", self.newline_replacement), k=-1)
+        for unit, (labels, scores) in zip(units, predictions):
+            scores = np.asarray(scores, dtype=np.float64)
             if self.save_labels_in_metadata:
                 for label, score in zip(labels, scores):
                     label_scores[label].append(score)
@@ -1,7 +1,7 @@
 from datatrove.pipeline.filters.base_filter import BaseFilter
 from datatrove.pipeline.filters.gopher_repetition_filter import find_duplicates
 from datatrove.pipeline.writers.disk_base import DiskWriter
-from datatrove.utils.text import TERMINAL_PUNCTUATION, split_into_words
+from datatrove.utils.text import TERMINAL_PUNCTUATION
 from datatrove.utils.typeshelper import Languages
 
 
@@ -31,7 +31,7 @@ class FineWebQualityFilter(BaseFilter):
         self.language = language
 
     def filter(self, doc) -> tuple[bool, str] | tuple[bool, dict, str] | tuple[bool, dict]:
-        lines = doc.text.split("\n")
+        lines = doc.analysis.split("\n")
         lines = [line for line in lines if line.strip() != ""]
 
         thresholds = {}
@@ -53,7 +53,7 @@ class FineWebQualityFilter(BaseFilter):
         if ratio > self.char_duplicates_ratio:
             return False, thresholds, "char_dup_ratio"
 
-        words = split_into_words(doc.text, self.language)
+        words = doc.analysis.words(self.language)
         new_line = doc.text.count("\n")
         ratio = new_line / len(words)
         thresholds["list_ratio"] = ratio
@@ -3,7 +3,7 @@ import numpy as np
 from datatrove.data import Document
 from datatrove.pipeline.filters.base_filter import BaseFilter
 from datatrove.pipeline.writers.disk_base import DiskWriter
-from datatrove.utils.text import PUNCTUATION_SET, split_into_words
+from datatrove.utils.text import PUNCTUATION_SET
 from datatrove.utils.typeshelper import Languages
 
 
@@ -69,7 +69,7 @@ class GopherQualityFilter(BaseFilter):
 
         """
         text = doc.text
-        words = split_into_words(text, self.language)
+        words = doc.analysis.words(self.language)
         n_words = len(words)
 
         thresholds = {}
@@ -107,7 +107,7 @@ class GopherQualityFilter(BaseFilter):
 
         # any document with more than 90 % of lines starting with a bullet point,
         # or more than 30 % ending with an ellipsis.
-        lines = text.splitlines()
+        lines = doc.analysis.lines()
         ratio = sum(s.lstrip().startswith("•") or s.lstrip().startswith("-") for s in lines) / len(lines)
         thresholds["bullet_ratio"] = ratio
         if (
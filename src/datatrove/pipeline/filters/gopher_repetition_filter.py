@@ -1,10 +1,11 @@
 import re
 from collections import Counter
 
+import numpy as np
+
 from datatrove.data import Document
 from datatrove.pipeline.filters.base_filter import BaseFilter
 from datatrove.pipeline.writers.disk_base import DiskWriter
-from datatrove.utils.text import split_into_words
 from datatrove.utils.typeshelper import Languages
 
 
@@ -70,6 +71,112 @@ def find_all_duplicate(words: list[str], n: int) -> int:
     return repeated_chars
 
 
+# two 31 bit prime moduli: products of two residues fit in an uint64 and both hashes fit together in one uint64 key
+_HASH_MODS = (2147483647, 2147483629)
+_HASH_BASES = (911382323, 972663749)
+
+
+def _powers(size: int, base: int, mod: int) -> np.ndarray:
+    """base**i % mod for i in range(size), filled by doubling"""
+    pows = np.ones(size, dtype=np.uint64)
+    filled = 1
+    while filled < size:
+        step = min(filled, size - filled)
+        pows[filled : filled + step] = pows[:step] * np.uint64(pow(base, filled, mod)) % np.uint64(mod)
+        filled += step
+    return pows
+
+
+class NGramHashes:
+    """Polynomial hashes of the strings `separator.join(words[i : i + n]) + separator`, for any n.
+
+    The hashes are computed from prefix sums over the characters of the whole text, so that the hashes of all the
+    n-grams of a given n are obtained with a few vectorized operations, without building any string.
+    Equal n-gram strings always have the same hash. As different strings can (very rarely) collide, callers should
+    verify the matches they rely on.
+
+    Args:
+        words: list of words
+        separator: string added after each word ("" to hash `"".join` n-grams, " " for `" ".join` n-grams)
+    """
+
+    def __init__(self, words: list[str], separator: str = ""):
+        self.words = words
+        self.separator = separator
+        word_lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words)) + len(separator)
+        # character offset of the start of each word, plus the total length at the end
+        self.offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum(word_lengths, out=self.offsets[1:])
+        text = separator.join(words) + separator if words else ""
+        chars = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32).astype(np.uint64)
+        # for each modulus, prefix sums (at word boundaries) of char * base ** position, and the inverse powers to
+        # shift the sum of each window to position 0
+        self._prefixes, self._inv_powers = [], []
+        for mod, base in zip(_HASH_MODS, _HASH_BASES):
+            prefix = np.zeros(len(chars) + 1, dtype=np.uint64)
+            np.cumsum(chars * _powers(len(chars), base, mod) % np.uint64(mod), out=prefix[1:])
+            self._prefixes.append(prefix[self.offsets] % np.uint64(mod))
+            self._inv_powers.append(_powers(len(chars) + 1, pow(base, mod - 2, mod), mod)[self.offsets])
+
+    def __call__(self, n: int) -> np.ndarray:
+        """uint64 hashes of the len(words) - n + 1 n-grams"""
+        keys = np.zeros(max(len(self.words) - n + 1, 0), dtype=np.uint64)
+        for prefix, inv_powers, mod in zip(self._prefixes, self._inv_powers, _HASH_MODS):
+            mod = np.uint64(mod)
+            window = (prefix[n:] + mod - prefix[: len(keys)]) % mod
+            keys = (keys << np.uint64(31)) | (window * inv_powers[: len(keys)] % mod)
+        return keys
+
+    def char_length(self, start: int, n: int) -> int:
+        """length of separator.join(words[start : start + n])"""
+        return int(self.offsets[start + n] - self.offsets[start]) - len(self.separator)
+
+    def get_string(self, start: int, n: int) -> str:
+        return self.separator.join(self.words[start : start + n])
+
+
+def find_top_duplicate_hashed(n_gram_hashes: NGramHashes, n: int) -> tuple[int, int] | None:
+    """Same result as `find_top_duplicate(get_n_grams(words, n))` (which requires at least one n-gram), computed from
+    the hashes of a `NGramHashes` with separator " ". Returns None if a hash collision was detected.
+    """
+    keys = n_gram_hashes(n)
+    _, first_idx, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    # Counter.most_common breaks ties by insertion order: take the n-gram with the earliest first occurrence
+    top_count = counts.max()
+    candidates = np.flatnonzero(counts == top_count)
+    top = candidates[np.argmin(first_idx[candidates])]
+    if top_count > 1 and len({n_gram_hashes.get_string(i, n) for i in np.flatnonzero(inverse == top).tolist()}) > 1:
+        return None
+    return n_gram_hashes.char_length(int(first_idx[top]), n) * int(top_count), int(top_count)
+
+
+def find_all_duplicate_hashed(n_gram_hashes: NGramHashes, n: int) -> int | None:
+    """Same result as `find_all_duplicate(words, n)`, computed from the hashes of a `NGramHashes` with separator "".
+    Returns None if a hash collision was detected.
+    """
+    keys = n_gram_hashes(n)
+    if len(keys) == 0:
+        return 0
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    # n-grams occurring only once can never be a duplicate, so only positions of repeated n-grams need to be visited
+    repeated_positions = np.flatnonzero(counts[inverse] > 1)
+    seen = {}
+    repeated_chars, next_idx = 0, 0
+    for idx, key in zip(repeated_positions.tolist(), keys[repeated_positions].tolist()):
+        if idx < next_idx:
+            # skipped, as part of the previous duplicate
+            continue
+        if key in seen:
+            if n_gram_hashes.get_string(idx, n) != n_gram_hashes.get_string(seen[key], n):
+                return None
+            repeated_chars += n_gram_hashes.char_length(idx, n)
+            next_idx = idx + n
+        else:
+            seen[key] = idx
+    assert repeated_chars <= n_gram_hashes.char_length(0, len(n_gram_hashes.words))
+    return repeated_chars
+
+
 class GopherRepetitionFilter(BaseFilter):
     name = "👯 Gopher Repetition"
 
@@ -136,13 +243,17 @@ class GopherRepetitionFilter(BaseFilter):
         if self.dup_line_char_frac and ratio > self.dup_line_char_frac:
             return False, thresholds, "dup_line_char_frac"
 
-        words = split_into_words(text, self.language)
+        words = doc.analysis.words(self.language)
+        # n-grams are compared through hashes of their strings: words are joined with " " for the top n-grams and
+        # with "" for the duplicated n-grams. If a hash collision is found we fall back to the string n-grams
+        spaced_n_gram_hashes = NGramHashes(words, " ") if self.top_n_grams else None
+        n_gram_hashes = NGramHashes(words) if self.dup_n_grams else None
 
         for n, n_frac in self.top_n_grams:
-            n_grams = get_n_grams(words, n)
-            if not n_grams:
+            if len(words) < n:
                 continue
-            top_char_length, count = find_top_duplicate(n_grams)
+            top_duplicate = find_top_duplicate_hashed(spaced_n_gram_hashes, n)
+            top_char_length, count = top_duplicate or find_top_duplicate(get_n_grams(words, n))
             if count <= 1:
                 continue
             ratio = top_char_length / len(text)
@@ -151,7 +262,9 @@ class GopherRepetitionFilter(BaseFilter):
                 return False, thresholds, f"top_{n}_gram"
 
         for n, n_frac in self.dup_n_grams:
-            n_duplicates_char = find_all_duplicate(words, n)
+            n_duplicates_char = find_all_duplicate_hashed(n_gram_hashes, n)
+            if n_duplicates_char is None:
+                n_duplicates_char = find_all_duplicate(words, n)
             ratio = n_duplicates_char / len(text)
             thresholds[f"duplicated_{n}_n_grams"] = ratio
             if ratio > n_frac:
@@ -18,6 +18,7 @@ class LanguageFilter(BaseFilter):
         backend: Literal["ft176", "glotlid"] = "ft176",
         label_only: bool = False,
         keep_top_pairs_threshold: float = -1,
+        batch_size: int = 1,
     ):
         """
         filters if the predicted language is not among given language or if the language score is below language
@@ -29,8 +30,9 @@ class LanguageFilter(BaseFilter):
             exclusion_writer:
             label_only: if True, only the language label is added to the metadata and no documents are removed
             keep_top_pairs_threshold: keep a list of all language pairs with at least this score. -1 to disable
+            batch_size: number of documents whose language is predicted with a single call to the model
         """
-        super().__init__(exclusion_writer)
+        super().__init__(exclusion_writer, batch_size)
         self.language_threshold = language_threshold
         if isinstance(languages, str):
             languages = [languages]
@@ -40,6 +42,9 @@ class LanguageFilter(BaseFilter):
         self.label_only = label_only
         self.keep_top_pairs_threshold = keep_top_pairs_threshold
 
+    def preload_models(self):
+        self.model.model
+
     def filter(self, doc: Document) -> bool:
         """Args:
             doc: document
@@ -47,7 +52,16 @@ class LanguageFilter(BaseFilter):
         Returns:
             is_filter
         """
-        best_lang_pair, lang_pairs = self.model.predict(doc)
+        return self.apply_prediction(doc, self.model.predict(doc))
+
+    def filter_batch(self, batch: list[Document]) -> list[bool]:
+        return [
+            self.apply_prediction(doc, prediction) for doc, prediction in zip(batch, self.model.predict_batch(batch))
+        ]
+
+    def apply_prediction(self, doc: Document, prediction: tuple[tuple[str, int], dict[str, float]]) -> bool:
+        """Saves the predicted language in the metadata and decides if the document is kept"""
+        best_lang_pair, lang_pairs = prediction
         lang, lang_score = best_lang_pair
         if self.backend == "glotlid":
             lang, script = lang.split("_")
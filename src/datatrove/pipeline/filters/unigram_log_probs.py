@@ -9,7 +9,6 @@ from datatrove.data import Document
 from datatrove.pipeline.filters.base_filter import BaseFilter
 from datatrove.pipeline.writers.disk_base import DiskWriter
 from datatrove.utils.logging import logger
-from datatrove.utils.text import split_into_words
 from datatrove.utils.typeshelper import Languages
 
 
@@ -60,7 +59,7 @@ class UnigramLogProbFilter(BaseFilter):
         return {word: count / total_count for word, count in zip(words, counts)}
 
     def get_logprob(self, doc):
-        words = split_into_words(doc.text, self.language)
+        words = doc.analysis.words(self.language)
         freqs = [self.unigram_frequencies.get(word.lower(), 1e-9) for word in words]
 
         if len(freqs) == 0:
@@ -29,6 +29,9 @@ class LangStats(BaseStats):
         self.fasttext = FT176LID([language])
         self.language = language
 
+    def preload_models(self):
+        self.fasttext.model
+
     def extract_stats(self, doc: Document) -> dict[str, int | float]:
         language_score = 0
         if doc.metadata.get("language") == self.language and "language_score" in doc.metadata:
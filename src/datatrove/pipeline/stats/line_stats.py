@@ -62,7 +62,7 @@ class LineStats(BaseStats):
         self.ignore_empty_lines = ignore_empty_lines
 
     def extract_stats(self, doc: Document):
-        lines: list[str] = doc.metadata.get("lines") or doc.text.split("\n")
+        lines: list[str] = doc.metadata.get("lines") or doc.analysis.split("\n")
         # Don't ignore empty lines for count
         n_lines = len(lines)
 
@@ -51,7 +51,7 @@ class ParagraphStats(BaseStats):
         self.long_paragraph_max_chars_threshold = long_paragraph_max_chars_threshold or [1000]
 
     def extract_stats(self, doc: Document) -> dict[str, int | float]:
-        paragraphs = [p for p in doc.text.split("\n\n") if p.strip()]
+        paragraphs = [p for p in doc.analysis.split("\n\n") if p.strip()]
         # Don't ignore empty paragraphs for count
         n_paragraphs = len(paragraphs)
 
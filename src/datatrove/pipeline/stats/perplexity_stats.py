@@ -31,6 +31,10 @@ class CCNetPerplexityStats(BaseStats):
         super().__init__(output_folder, groups_to_compute, histogram_round_digits, top_k_config)
         self.model = KenlmModel(model_dataset=model_dataset, language=language)
 
+    def preload_models(self):
+        self.model.model
+        self.model.tokenizer.model
+
     def extract_stats(self, doc: Document) -> dict[str, int | float]:
         return {
             f"ccnet_perplexity_{self.model.model_dataset}_{self.model.language}": self.model.get_perplexity(doc.text)
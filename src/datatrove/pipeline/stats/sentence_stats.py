@@ -5,7 +5,6 @@ from datatrove.io import DataFolderLike
 from datatrove.pipeline.stats.base import BaseStats
 from datatrove.pipeline.stats.config import DEFAULT_TOP_K_CONFIG, GROUP, TopKConfig
 from datatrove.utils.typeshelper import Languages
-from datatrove.utils.word_tokenizers import load_word_tokenizer
 
 
 def get_short_sentence_ratio(sentences: list[str], threshold: int) -> float:
@@ -51,9 +50,7 @@ class SentenceStats(BaseStats):
         self.language = language
 
     def extract_stats(self, doc: Document) -> dict[str, int | float]:
-        word_tokenizer = load_word_tokenizer(self.language)
-
-        sentences = [s for s in word_tokenizer.sent_tokenize(doc.text) if s.strip()]
+        sentences = [s for s in doc.analysis.sent_tokenize(self.language) if s.strip()]
 
         return {
             "n_sentences": len(sentences),
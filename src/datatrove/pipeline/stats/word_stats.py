@@ -6,7 +6,6 @@ from datatrove.pipeline.filters.gopher_quality_filter import STOP_WORDS
 from datatrove.pipeline.stats.base import BaseStats
 from datatrove.pipeline.stats.config import DEFAULT_TOP_K_CONFIG, GROUP, TopKConfig
 from datatrove.utils.typeshelper import Languages
-from datatrove.utils.word_tokenizers import load_word_tokenizer
 
 
 def get_short_word_ratio(words: list[str], threshold: int) -> float:
@@ -59,10 +58,8 @@ class WordStats(BaseStats):
         self.stop_words = stop_words
 
     def extract_stats(self, doc: Document) -> dict[str, int | float]:
-        word_tokenizer = load_word_tokenizer(self.language)
-
-        words = word_tokenizer.word_tokenize(doc.text)
-        lines = doc.text.splitlines()
+        words = doc.analysis.words(self.language)
+        lines = doc.analysis.lines()
 
         return {
             "n_words": len(words),
@@ -1,10 +1,14 @@
 import os
 import struct
-from functools import cache
-from typing import BinaryIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
+from typing import BinaryIO, Callable, Generator, Iterator, Sequence
 
 import numpy as np
 from fsspec.spec import AbstractBufferedFile
+from tqdm import tqdm
+
+from datatrove.io import DataFolder
 
 
 def read_tuples_from_file(file: BinaryIO, *formats, lines_to_buffer: int = 5):
@@ -51,6 +55,216 @@ def read_np_from_file(
             return np.frombuffer(file.read(), dtype=dtype)
 
 
+def read_np_from_files(data_folder: DataFolder, paths: list[str], dtype: np.dtype) -> np.ndarray:
+    """
+    Utility which bulk reads several files (in parallel) and concatenates their data into a single numpy array.
+    Args:
+        data_folder: the folder containing the files
+        paths: paths of the files to read, relative to data_folder
+        dtype: expected dtype of data
+    Returns:
+        numpy array with the data of all the files, in the order of paths
+    """
+    if not paths:
+        return np.zeros(0, dtype=dtype)
+    with ThreadPoolExecutor() as pool:
+        arrays = list(
+            tqdm(
+                pool.map(
+                    partial(read_np_from_file, dtype=dtype, is_local_file=data_folder.is_local()),
+                    data_folder.open_files(paths),
+                ),
+                total=len(paths),
+                disable=len(paths) == 1,
+            )
+        )
+    return np.concatenate(arrays, axis=0)
+
+
+def get_lookup_array(indices: np.ndarray, values: np.ndarray | bool = True, fill_value=False, dtype=np.bool_):
+    """
+    Utility which builds a dense array `lookup` with `lookup[indices] = values`, so that document indices can be
+    checked in O(1). Use `lookup[idx] if idx < len(lookup) else fill_value` for indices larger than the maximum.
+    Args:
+        indices: document indices
+        values: value of each index
+        fill_value: value of the indices that are not in `indices`
+        dtype: dtype of the lookup array
+    Returns:
+        numpy array of size max(indices) + 1
+    """
+    lookup = np.full(int(indices.max()) + 1 if len(indices) else 0, fill_value, dtype=dtype)
+    lookup[indices] = values
+    return lookup
+
+
+class GrowableNpArray:
+    """
+    Append-only numpy array that doubles its capacity when it is full, to accumulate records (for example
+    signatures) directly in a typed buffer instead of a list of python objects.
+    Args:
+        dtype: dtype of the records
+        capacity: initial number of records
+    """
+
+    def __init__(self, dtype: np.dtype, capacity: int = 1024):
+        self._array = np.empty(max(1, capacity), dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, values: np.ndarray):
+        """Append the records of `values` (an array with the same dtype)"""
+        if self._size + len(values) > len(self._array):
+            capacity = len(self._array)
+            while self._size + len(values) > capacity:
+                capacity *= 2
+            array = np.empty(capacity, dtype=self._array.dtype)
+            array[: self._size] = self._array[: self._size]
+            self._array = array
+        self._array[self._size : self._size + len(values)] = values
+        self._size += len(values)
+
+    @property
+    def data(self) -> np.ndarray:
+        """View of the records appended so far"""
+        return self._array[: self._size]
+
+
+def read_np_chunks_from_file(file: BinaryIO, dtype: np.dtype, chunk_size: int) -> Generator[np.ndarray, None, None]:
+    """
+    Utility which reads records from a file in chunks and yields them as numpy arrays.
+    Args:
+        file: the file to read from. Reading starts at the current position
+        dtype: expected dtype of each record
+        chunk_size: maximum number of records in each yielded array
+    Returns:
+        numpy arrays with at most chunk_size records each
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be >= 1")
+    dtype = np.dtype(dtype)
+    leftover = b""
+    while chunk := file.read(chunk_size * dtype.itemsize - len(leftover)):
+        chunk = leftover + chunk if leftover else chunk
+        usable = len(chunk) - len(chunk) % dtype.itemsize
+        leftover = chunk[usable:]
+        if usable:
+            yield np.frombuffer(chunk, dtype=dtype, count=usable // dtype.itemsize)
+    if leftover:
+        raise ValueError(f"file size is not a multiple of the record size ({dtype.itemsize} bytes)")
+
+
+def merge_sorted_np_chunks(
+    readers: list[Iterator[np.ndarray]],
+    key: Callable[[np.ndarray], np.ndarray],
+    lexsort_keys: Callable[[np.ndarray, np.ndarray], Sequence[np.ndarray]] | None = None,
+) -> Generator[tuple[np.ndarray, np.ndarray], None, None]:
+    """
+    K-way merge of sorted record streams, done on whole chunks instead of one record at a time.
+
+    Each reader yields sorted arrays (all with the same dtype). At each step we compute a watermark: the smallest
+    "last key" among the current chunks of readers that may still have more data. Every record with a key strictly
+    smaller than the watermark is final, so those records are taken from all readers, concatenated and sorted
+    together. As a consequence, all the records sharing the same key are always returned in the same batch.
+
+    Args:
+        readers: iterators of sorted numpy arrays (see `read_np_chunks_from_file`)
+        key: function returning the (monotonic) 1D merge key of a chunk, for example its first field
+        lexsort_keys: function (records, reader_ids) -> keys to pass to `np.lexsort` (last key is the primary one)
+            to order each batch. Defaults to sorting by key and then by reader id.
+    Returns:
+        tuples (records, reader_ids) of merged and sorted batches
+    """
+    if lexsort_keys is None:
+
+        def lexsort_keys(records, reader_ids):
+            return reader_ids, key(records)
+
+    chunks: list[np.ndarray | None] = [None] * len(readers)
+    exhausted = [False] * len(readers)
+
+    def fetch(reader_i):
+        # get the next non-empty chunk of this reader, or mark it as exhausted
+        for chunk in readers[reader_i]:
+            if len(chunk):
+                return chunk
+        exhausted[reader_i] = True
+        return None
+
+    for reader_i in range(len(readers)):
+        chunks[reader_i] = fetch(reader_i)
+
+    while True:
+        # refill empty chunks
+        for reader_i, chunk in enumerate(chunks):
+            if (chunk is None or len(chunk) == 0) and not exhausted[reader_i]:
+                chunks[reader_i] = fetch(reader_i)
+        active = [reader_i for reader_i, chunk in enumerate(chunks) if chunk is not None and len(chunk)]
+        if not active:
+            return
+        open_readers = [reader_i for reader_i in active if not exhausted[reader_i]]
+        watermark_reader = min(open_readers, key=lambda ri: key(chunks[ri])[-1]) if open_readers else None
+        watermark = key(chunks[watermark_reader])[-1] if watermark_reader is not None else None
+
+        taken, taken_ids = [], []
+        for reader_i in active:
+            chunk = chunks[reader_i]
+            split = len(chunk) if watermark is None else np.searchsorted(key(chunk), watermark, side="left")
+            if split:
+                taken.append(chunk[:split])
+                taken_ids.append(np.full(split, reader_i, dtype=np.uint32))
+                chunks[reader_i] = chunk[split:]
+
+        if not taken:
+            # the reader setting the watermark only has records with key == watermark: extend its chunk
+            next_chunk = fetch(watermark_reader)
+            if next_chunk is not None:
+                chunks[watermark_reader] = np.concatenate([chunks[watermark_reader], next_chunk])
+            continue
+
+        records = np.concatenate(taken) if len(taken) > 1 else taken[0]
+        reader_ids = np.concatenate(taken_ids) if len(taken_ids) > 1 else taken_ids[0]
+        if len(taken) > 1:
+            order = np.lexsort(lexsort_keys(records, reader_ids))
+            records, reader_ids = records[order], reader_ids[order]
+        yield records, reader_ids
+
+
+class SortedHashLookup:
+    """Membership checks of sorted batches of hashes against sorted index files, with `searchsorted`.
+
+    The unique hashes of the index files are merged and streamed: only the part of the index overlapping the current
+    batch is kept in memory.
+
+    Args:
+        index_readers: iterators of sorted numpy arrays of hashes, one per index file (see `read_np_chunks_from_file`)
+    """
+
+    def __init__(self, index_readers: list[Generator[np.ndarray, None, None]]):
+        self._chunks = (
+            np.unique(hashes) for hashes, _ in merge_sorted_np_chunks(index_readers, key=lambda hashes: hashes)
+        )
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._exhausted = not index_readers
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Check which hashes are in the index. Each batch must be sorted and start after the previous one"""
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=bool)
+        # index hashes smaller than this batch will never be needed again
+        self._hashes = self._hashes[np.searchsorted(self._hashes, hashes[0], side="left") :]
+        while not self._exhausted and (len(self._hashes) == 0 or self._hashes[-1] < hashes[-1]):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+            else:
+                self._hashes = np.concatenate([self._hashes, chunk.astype(np.uint64)])
+        positions = np.minimum(np.searchsorted(self._hashes, hashes, side="left"), max(len(self._hashes) - 1, 0))
+        return (self._hashes[positions] == hashes) if len(self._hashes) else np.zeros(len(hashes), dtype=bool)
+
+
 def seek_to_start(f: AbstractBufferedFile, start_hash: int, line_format: str, hash_format: str):
     if start_hash == 0:
         return
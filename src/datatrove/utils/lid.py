@@ -1,8 +1,11 @@
 from abc import abstractmethod
 
+import numpy as np
+
 from datatrove.data import Document
 from datatrove.io import cached_asset_path_or_download
 from datatrove.utils._import_utils import check_required_dependencies
+from datatrove.utils.model_registry import get_model
 
 
 class LID:
@@ -20,6 +23,16 @@ class LID:
         """
         raise NotImplementedError
 
+    def predict_batch(self, docs: list[Document]) -> list[tuple[tuple[str, int], dict[str, float]]]:
+        """
+        Same as `predict`, for a list of documents. Overwrite it to predict the whole batch at once
+        Args:
+            docs (list[Document]): Documents to predict languages for
+        Returns:
+            list of the `predict` result of each document
+        """
+        return [self.predict(doc) for doc in docs]
+
 
 class FastTextLID(LID):
     MODEL_URL = None
@@ -32,26 +45,38 @@ class FastTextLID(LID):
             k (int, optional): Number of top-k languages to consider, all languages outside of k will be considered as being predicted with 0.0
         """
         super().__init__(languages)
-        self._model = None
         self.k = k
 
     @property
     def model(self):
-        if self._model is None:
-            check_required_dependencies("lid", [("fasttext", "fasttext-numpy2-wheel")])
-            from fasttext.FastText import _FastText
-
-            model_file = cached_asset_path_or_download(
-                self.MODEL_URL,
-                namespace="lid",
-                subfolder=self.MODEL_SUBFOLDER,
-                desc="fast-text language identifier model",
-            )
-            self._model = _FastText(model_file)
-        return self._model
+        # shared by all the LIDs (and steps) of this process using the same model, see `model_registry`
+        return get_model(("fasttext", self.MODEL_URL), self.load_model)
+
+    def load_model(self):
+        check_required_dependencies("lid", [("fasttext", "fasttext-numpy2-wheel")])
+        from fasttext.FastText import _FastText
+
+        model_file = cached_asset_path_or_download(
+            self.MODEL_URL,
+            namespace="lid",
+            subfolder=self.MODEL_SUBFOLDER,
+            desc="fast-text language identifier model",
+        )
+        return _FastText(model_file)
 
     def predict(self, doc: Document) -> tuple[tuple[str, int], dict[str, float]]:
         langs, scores = self.model.predict(doc.text.replace("\n", " "), k=self.k)
+        return self._get_lang_pairs(langs, scores)
+
+    def predict_batch(self, docs: list[Document]) -> list[tuple[tuple[str, int], dict[str, float]]]:
+        if not docs:
+            return []
+        # a single call to fastText for the whole batch
+        langs, scores = self.model.predict([doc.text.replace("\n", " ") for doc in docs], k=self.k)
+        return [self._get_lang_pairs(doc_langs, doc_scores) for doc_langs, doc_scores in zip(langs, scores)]
+
+    def _get_lang_pairs(self, langs, scores) -> tuple[tuple[str, int], dict[str, float]]:
+        scores = np.asarray(scores, dtype=np.float64)
         lang_pairs = {lang.split("__")[2]: score.item() for lang, score in zip(langs, scores)}
         best_lang_pair = max(lang_pairs.items(), key=lambda x: x[1])
         return best_lang_pair, {
@@ -0,0 +1,90 @@
+"""
+Process wide registry of the models used by pipeline steps (fastText, KenLM, SentencePiece...).
+
+Models are loaded once per process and shared by all the steps (and ranks) that need them. With
+`LocalPipelineExecutor(preload_models=True, start_method="fork")`, the models are loaded in the main process before the
+workers are forked, so that all the workers share the same (copy-on-write) memory pages instead of each loading its
+own copy of the model.
+
+Models stay in the registry until the process exits or `clear_models` is called: steps do not keep their own
+reference, so a cleared model is freed once it is no longer in use. `LocalPipelineExecutor` clears the models it
+preloaded once all of its workers are done.
+"""
+
+import os
+from typing import Any, Callable, Hashable, Iterable
+
+
+_MODELS: dict[Hashable, Any] = {}
+# increase of the resident memory of the process when each model was loaded
+_MODELS_MEMORY: dict[Hashable, int] = {}
+
+
+def get_rss() -> int | None:
+    """Resident memory of the current process in bytes, or None if it can not be read (only supported on linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_model(key: Hashable, loader: Callable[[], Any]) -> Any:
+    """
+    Returns the model registered under `key`, calling `loader` to load it the first time it is requested in this
+    process.
+    Args:
+        key: unique key of the model, for example ("fasttext", model_url)
+        loader: function (without arguments) that loads and returns the model
+
+    Returns:
+        the model
+    """
+    if key not in _MODELS:
+        rss_before = get_rss()
+        _MODELS[key] = loader()
+        rss_after = get_rss()
+        if rss_before is not None and rss_after is not None:
+            _MODELS_MEMORY[key] = max(rss_after - rss_before, 0)
+    return _MODELS[key]
+
+
+def is_model_loaded(key: Hashable) -> bool:
+    return key in _MODELS
+
+
+def get_models_memory(keys: Iterable[Hashable] | None = None) -> int:
+    """
+    Increase of the resident memory (in bytes) measured while loading the models with the given keys (all the loaded
+    models by default). Memory mapped models (such as KenLM binaries) are paged in lazily and barely count.
+    """
+    if keys is None:
+        keys = _MODELS_MEMORY
+    return sum(_MODELS_MEMORY.get(key, 0) for key in keys)
+
+
+def clear_models(keys: Iterable[Hashable] | None = None):
+    """
+    Removes the models with the given keys (all the models by default) from the registry of the current process.
+    They are freed once no step uses them anymore, and loaded again the next time they are requested.
+    """
+    for key in list(_MODELS) if keys is None else keys:
+        _MODELS.pop(key, None)
+        _MODELS_MEMORY.pop(key, None)
+
+
+def preload_models(pipeline: list) -> list[Hashable]:
+    """
+    Loads the models of all the steps of a pipeline in the registry of the current process (see
+    `PipelineStep.preload_models`).
+    Args:
+        pipeline: list of pipeline steps (callables without `preload_models` are ignored)
+
+    Returns:
+        keys of the newly loaded models
+    """
+    loaded_before = set(_MODELS)
+    for step in pipeline:
+        if hasattr(step, "preload_models"):
+            step.preload_models()
+    return [key for key in _MODELS if key not in loaded_before]
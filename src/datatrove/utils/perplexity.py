@@ -8,6 +8,7 @@ from typing import Dict
 from huggingface_hub import hf_hub_url
 
 from datatrove.io import cached_asset_path_or_download
+from datatrove.utils.model_registry import get_model
 from datatrove.utils.text import TextNormConfig, simplify_text
 
 
@@ -23,19 +24,20 @@ class SentencePiece:
         super().__init__()
         self.model_name = model_name
         self.model_dataset = model_dataset
-        self._model = None
 
     @property
     def model(self):
+        return get_model(("sentencepiece", self.model_dataset, self.model_name), self.load_model)
+
+    def load_model(self):
         import sentencepiece
 
-        if self._model is None:
-            path = cached_asset_path_or_download(
-                hf_hub_url(MODEL_REPO, str(Path(self.model_dataset, f"{self.model_name}.sp.model")))
-            )
-            self._model = sentencepiece.SentencePieceProcessor()
-            self._model.load(path)
-        return self._model
+        path = cached_asset_path_or_download(
+            hf_hub_url(MODEL_REPO, str(Path(self.model_dataset, f"{self.model_name}.sp.model")))
+        )
+        model = sentencepiece.SentencePieceProcessor()
+        model.load(path)
+        return model
 
     def tokenize(self, text: dict) -> dict:
         tokenized = self.model.encode_as_pieces(text)
@@ -91,17 +93,18 @@ class KenlmModel:
         self.model_dataset = model_dataset
         self.language = language
         self._tokenizer = None
-        self._model = None
 
     @property
     def model(self):
+        # shared by all the steps of this process using the same model, see `model_registry`
+        return get_model(("kenlm", self.model_dataset, self.language), self.load_model)
+
+    def load_model(self):
         import kenlm
 
-        if self._model is None:
-            model_path = Path(self.model_dataset, f"{self.language}.arpa.bin")
-            path = cached_asset_path_or_download(hf_hub_url(MODEL_REPO, str(model_path)))
-            self._model = kenlm.Model(path)
-        return self._model
+        model_path = Path(self.model_dataset, f"{self.language}.arpa.bin")
+        path = cached_asset_path_or_download(hf_hub_url(MODEL_REPO, str(model_path)))
+        return kenlm.Model(path)
 
     @property
     def tokenizer(self):
@@ -9,6 +9,7 @@ from dataclasses import dataclass
 from typing import IO, Callable, TextIO
 
 import humanize
+import numpy as np
 
 
 INDENT = " " * 4
@@ -238,6 +239,31 @@ class MetricStats:
         if self.n > 1:
             self._running_variance += delta * (x - self.mean)
 
+    @classmethod
+    def from_values(cls, values: np.ndarray, unit: str = "doc") -> "MetricStats":
+        """
+            Stats equivalent to calling `update` once for each value, computed in bulk.
+        Args:
+          values: np.ndarray: 1D array of values
+          unit: str:  (Default value = "doc")
+
+        Returns:
+
+        """
+        if len(values) == 0:
+            return cls(unit=unit)
+        values = np.asarray(values)
+        mean = float(values.mean())
+        return cls(
+            total=values.sum().item(),
+            n=len(values),
+            mean=mean,
+            min=values.min().item(),
+            max=values.max().item(),
+            _running_variance=float(np.square(values - mean).sum()),
+            unit=unit,
+        )
+
     @property
     def variance(self):
         return self._running_variance / (self.n - 1) if self.n > 1 else 0.0
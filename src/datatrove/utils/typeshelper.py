@@ -4100,6 +4100,7 @@ class StatHints:
 
 class ExtensionHelperSD:
     stage_1_signature = ".c4_sig"
+    stage_1_sentence_spans = ".c4_spans"
     stage_2_duplicates = ".c4_dup"
     index = ".c4_index"
 
@@ -4108,5 +4109,7 @@ class ExtensionHelperES:
     stage_1_sequence = ".es_sequence"
     stage_1_sequence_size = ".es_sequence.size"
     stage_2_big_sequence = ".big_sequence"
+    stage_2_manifest = ".big_sequence.manifest"
     stage_2_bytes_offset = ".info"
+    stage_2_bytes_offset_dtype = ".info.dtype"
     stage_3_bytes_ranges = ".bytearange"
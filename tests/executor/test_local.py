@@ -5,7 +5,9 @@ import unittest
 
 from datatrove.executor.local import LocalPipelineExecutor
 from datatrove.io import get_datafolder
+from datatrove.pipeline.base import PipelineStep
 from datatrove.utils._import_utils import is_boto3_available, is_moto_available, is_s3fs_available
+from datatrove.utils.model_registry import get_model, is_model_loaded
 
 from ..utils import require_boto3, require_moto, require_s3fs
 
@@ -66,3 +68,54 @@ class TestLocalExecutor(unittest.TestCase):
 
                 for file in file_list:
                     assert log_dir.isfile(file)
+
+
+def load_test_model():
+    return {"loaded_by": os.getpid(), "weights": bytearray(2**20)}
+
+
+class ModelStep(PipelineStep):
+    def __init__(self, output_folder: str):
+        super().__init__()
+        self.output_folder = output_folder
+
+    def preload_models(self):
+        get_model(("test", "model"), load_test_model)
+
+    def run(self, data=None, rank: int = 0, world_size: int = 1):
+        was_loaded = is_model_loaded(("test", "model"))
+        model = get_model(("test", "model"), load_test_model)
+        with open(f"{self.output_folder}/{rank}", "w") as f:
+            f.write(f"{was_loaded} {model['loaded_by'] == os.getpid()}")
+        yield from []
+
+
+class TestModelPreloading(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def run_pipeline(self, name, **kwargs):
+        os.makedirs(f"{self.tmp_dir}/{name}")
+        LocalPipelineExecutor(
+            pipeline=[ModelStep(f"{self.tmp_dir}/{name}")],
+            tasks=3,
+            workers=2,
+            logging_dir=f"{self.tmp_dir}/logs_{name}",
+            **kwargs,
+        ).run()
+        results = []
+        for rank in range(3):
+            with open(f"{self.tmp_dir}/{name}/{rank}") as f:
+                results.append(f.read())
+        return results
+
+    def test_preload_models(self):
+        # loaded in the main process, before forking the workers
+        self.assertEqual(self.run_pipeline("fork", start_method="fork", preload_models=True), ["True False"] * 3)
+        # and removed from the main process once the workers are done
+        self.assertFalse(is_model_loaded(("test", "model")))
+        # each worker loads its own copy
+        self.assertEqual(
+            set(self.run_pipeline("spawn", start_method="spawn", preload_models=True)), {"False True", "True True"}
+        )
@@ -1,9 +1,15 @@
+import fcntl
+import multiprocessing
+import os
 import shutil
 import tempfile
+import time
 import unittest
 
+import numpy as np
+
 from datatrove.data import Document
-from datatrove.pipeline.dedup.bloom_filter import BloomFilterConfig, SingleBloomFilter
+from datatrove.pipeline.dedup.bloom_filter import BloomFilterConfig, SharedBloomFilter, SingleBloomFilter
 from tests.utils import use_hash_configs
 
 
@@ -91,7 +97,7 @@ class BloomFilter(unittest.TestCase):
         self.tmp_dir = tempfile.mkdtemp()
         self.addCleanup(shutil.rmtree, self.tmp_dir)
 
-    @use_hash_configs(precision=[32])
+    @use_hash_configs()
     def test_sd(self, hash_config):
         bloom_filter = SingleBloomFilter(
             output_folder=self.tmp_dir,
@@ -107,3 +113,191 @@ class BloomFilter(unittest.TestCase):
         # print(f"False probability = {fp:.3}")
         # print(f"Optimal K given total shingles = {get_optimal_k(bloom_filter.m_bytes, bloom_filter.total_shingles)}")
         # print(f"{bloom_filter.total_shingles=}")
+
+    @use_hash_configs()
+    def test_shared(self, hash_config):
+        config = BloomFilterConfig(m_bytes=2**10, k=7, hash_config=hash_config)
+
+        def make_filter(shared_file, **kwargs):
+            return SharedBloomFilter(
+                output_folder=self.tmp_dir, config=config, shared_file=f"{self.tmp_dir}/{shared_file}", **kwargs
+            )
+
+        # each rank maps the same file: duplicates are also found across ranks
+        filters = [make_filter("shared.bloom", save_bloom_filter=True) for _ in range(2)]
+        for doc_idx, doc in enumerate(DOCS):
+            self.assertEqual(filters[doc_idx * 2 // len(DOCS)].step(doc), TARGETS[doc_idx])
+        # all the bits of a shingle are in the same 64 bytes block
+        indexes = filters[0].get_indexes(filters[0].get_shingles(TEXT_0))
+        self.assertTrue(np.all(indexes // 512 == indexes[:, :1] // 512))
+
+        # only the last task to finish saves the filter
+        filters[0].task_done(rank=0, world_size=2)
+        self.assertFalse(filters[0].output_folder.exists("bloom_filter.bloom"))
+        filters[1].task_done(rank=1, world_size=2)
+        with filters[0].output_folder.open("bloom_filter.bloom", mode="rb") as f:
+            self.assertEqual(f.read(), filters[0].header.tobytes() + filters[0].bit_vector.tobytes())
+
+        # incremental dedup: a new shared filter initialized with the saved one
+        loaded_filter = make_filter("incremental.bloom", load_bloom_filter=f"{self.tmp_dir}/bloom_filter.bloom")
+        self.assertEqual([loaded_filter.step(doc) for doc in DOCS[:7]], [False] * 7)
+
+        with self.assertRaises(ValueError):
+            SharedBloomFilter(
+                output_folder=self.tmp_dir,
+                config=BloomFilterConfig(m_bytes=2**11, k=7, hash_config=hash_config),
+                shared_file=f"{self.tmp_dir}/shared.bloom",
+            ).bit_vector
+
+    def test_shared_file_checks(self):
+        config = BloomFilterConfig(m_bytes=2**10, k=7)
+
+        def make_filter(config=config, **kwargs):
+            return SharedBloomFilter(
+                output_folder=self.tmp_dir, config=config, shared_file=f"{self.tmp_dir}/shared.bloom", **kwargs
+            )
+
+        # files saved by a SingleBloomFilter have a different layout, with or without the same size
+        for m_bytes in (config.m_bytes, config.m_bytes + SharedBloomFilter.HEADER_BYTES):
+            single_filter = SingleBloomFilter(
+                output_folder=f"{self.tmp_dir}/single_{m_bytes}", config=BloomFilterConfig(m_bytes=m_bytes, k=7)
+            )
+            for doc in DOCS:
+                single_filter.step(doc)
+            single_filter.save_bf()
+            with self.assertRaises(ValueError):
+                make_filter(load_bloom_filter=f"{self.tmp_dir}/single_{m_bytes}/bloom_filter.bloom").bit_vector
+            self.assertFalse(os.path.exists(f"{self.tmp_dir}/shared.bloom"))
+
+        # a file left by an unfinished run is reused
+        unfinished = make_filter()
+        self.assertEqual([unfinished.step(doc) for doc in DOCS], TARGETS)
+        unfinished.task_done(rank=0, world_size=2)
+        self.assertEqual([make_filter().step(doc) for doc in DOCS[:7]], [False] * 7)
+        # but not with a different config
+        with self.assertRaises(ValueError):
+            make_filter(BloomFilterConfig(m_bytes=2**10, k=8)).bit_vector
+        # once all its tasks finished, the file is recreated
+        make_filter().task_done(rank=1, world_size=2)
+        self.assertEqual([make_filter().step(doc) for doc in DOCS], TARGETS)
+
+    def test_shared_crash_rerun(self):
+        config = BloomFilterConfig(m_bytes=2**10, k=7)
+
+        def make_filter():
+            return SharedBloomFilter(
+                output_folder=self.tmp_dir, config=config, shared_file=f"{self.tmp_dir}/shared.bloom"
+            )
+
+        def kept_ids(rank, docs):
+            return [doc.id for doc in make_filter().run(iter(docs), rank=rank, world_size=2)]
+
+        docs = [Document(text=doc.text, id=str(i)) for i, doc in enumerate(DOCS)]
+        expected = [doc.id for doc, target in zip(docs, TARGETS) if target]
+        other_docs = [Document(text=" ".join(f"word{i}" for i in range(50)), id="other")]
+        # rank 0 fails after inserting 5 documents
+        crashed = make_filter().run(iter(docs), rank=0, world_size=2)
+        for _ in range(5):
+            next(crashed)
+        crashed.close()
+        # rerunning it would drop the documents it already inserted
+        with self.assertRaises(ValueError):
+            kept_ids(0, docs)
+        # a task that never started can still run
+        self.assertEqual(kept_ids(1, other_docs), ["other"])
+        # after deleting the file of the unfinished run, a full rerun keeps the same documents as a fresh run
+        os.remove(f"{self.tmp_dir}/shared.bloom")
+        for _ in range(2):
+            self.assertEqual(kept_ids(0, docs), expected)
+            self.assertEqual(kept_ids(1, other_docs), ["other"])
+            # then all the tasks finished: the next run recreates the file
+
+    def test_shared_lock_stripes(self):
+        # 64 blocks of 512 bits, in 8 stripes of 8 blocks
+        bloom_filter = SharedBloomFilter(
+            output_folder=self.tmp_dir,
+            config=BloomFilterConfig(m_bytes=2**12, k=7),
+            shared_file=f"{self.tmp_dir}/shared.bloom",
+            lock_stripes=8,
+        )
+        indexes = np.array([[512 * block] * 7 for block in (0, 1, 17, 30)], dtype=np.uint64)
+        self.assertEqual(bloom_filter.get_stripes(indexes).tolist(), [0, 2, 3])
+
+        def try_lock(stripe, results):
+            # another process: only the stripes locked by the document are busy
+            fd = os.open(f"{self.tmp_dir}/shared.bloom.stripes", os.O_RDWR)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, stripe)
+                results.put((stripe, True))
+            except OSError:
+                results.put((stripe, False))
+
+        ctx = multiprocessing.get_context("fork")
+        results = ctx.Queue()
+        with bloom_filter.bit_vector_lock(indexes):
+            for stripe in range(8):
+                process = ctx.Process(target=try_lock, args=(stripe, results))
+                process.start()
+                process.join()
+        self.assertEqual(
+            sorted(results.get() for _ in range(8)), [(stripe, stripe not in (0, 2, 3)) for stripe in range(8)]
+        )
+
+    @use_hash_configs()
+    def test_indexes(self, hash_config):
+        bloom_filter = SingleBloomFilter(
+            output_folder=self.tmp_dir, config=BloomFilterConfig(m_bytes=2**10 - 1, k=7, hash_config=hash_config)
+        )
+        shingles = np.random.default_rng(0).integers(0, hash_config.max, size=(5000, 1), dtype=np.uint64)
+        indexes = bloom_filter.get_indexes(shingles)
+        self.assertEqual(indexes.shape, (5000, 7))
+        self.assertLess(indexes.max(), bloom_filter.config.m)
+        # the whole filter is used: 35k random positions cover almost all of the 8184 bits
+        self.assertGreater(len(np.unique(indexes)), 0.95 * bloom_filter.config.m)
+
+        bloom_filter.update_bf(indexes[:2500])
+        self.assertTrue(np.all(bloom_filter.query(indexes[:2500])))
+        self.assertEqual(
+            np.unpackbits(bloom_filter.bit_vector.view(np.uint8), bitorder="little").sum(),
+            len(np.unique(indexes[:2500])),
+        )
+
+    def test_benchmark(self):
+        # compare the vectorized filter with a bytearray filter that queries and sets one bit at a time
+        config = BloomFilterConfig(m_bytes=2**16, k=7)
+        docs = [
+            Document(text=" ".join([TEXT_0, TEXT_5, TEXT_6][i % 3].split()[i % 50 :]), id=str(i)) for i in range(300)
+        ]
+
+        bloom_filter = SingleBloomFilter(output_folder=self.tmp_dir, config=config)
+        shingle_indexes = [bloom_filter.get_indexes(bloom_filter.get_shingles(doc.text)) for doc in docs]
+
+        start = time.perf_counter()
+        reference_results, bit_vector = [], bytearray(config.m_bytes)
+        for indexes in shingle_indexes:
+            duplicate_shingles, indexes_to_update = 0, []
+            for shingle in indexes.tolist():
+                if all(bit_vector[idx // 8] & (1 << (idx % 8)) for idx in shingle):
+                    duplicate_shingles += 1
+                else:
+                    indexes_to_update.extend(shingle)
+            for idx in indexes_to_update:
+                bit_vector[idx // 8] |= 1 << (idx % 8)
+            reference_results.append(duplicate_shingles / len(indexes) <= config.duplicate_threshold)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = []
+        for indexes in shingle_indexes:
+            is_duplicate = bloom_filter.query(indexes)
+            bloom_filter.update_bf(indexes[~is_duplicate])
+            results.append(np.count_nonzero(is_duplicate) / len(indexes) <= config.duplicate_threshold)
+        vectorized_time = time.perf_counter() - start
+
+        print(
+            f"bytearray: {len(docs) / reference_time:.0f} docs/s, numpy: {len(docs) / vectorized_time:.0f} docs/s "
+            f"(excluding tokenization and hashing)"
+        )
+        self.assertEqual(results, reference_results)
+        self.assertEqual(bloom_filter.bit_vector.tobytes(), bytes(bit_vector))
+        self.assertIn(False, results)
@@ -0,0 +1,95 @@
+import copy
+import shutil
+import tempfile
+import unittest
+
+from datatrove.data import Document
+from datatrove.pipeline.dedup.exact_dedup import (
+    ExactDedupBuildIndex,
+    ExactDedupConfig,
+    ExactDedupFilter,
+    ExactDedupSignature,
+    ExactFindDedups,
+)
+from tests.utils import require_xxhash, use_hash_configs
+
+
+DOCS = [
+    Document(text="The quick brown fox jumps over the lazy dog.", id="1"),
+    Document(text="the quick brown fox   jumps over the lazy dog", id="2"),
+    Document(text="A completely different document.", id="3"),
+    Document(text="THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG!", id="4"),
+    Document(text="Another document, with 123 numbers.", id="5"),
+    Document(text="Another document with 456 numbers", id="6"),
+]
+
+INDEX = [
+    Document(text="A completely different document", id="1"),
+]
+
+
+@require_xxhash
+class ExactDedup(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_exact_deduplication(self):
+        signature_creation = ExactDedupSignature(output_folder=self.tmp_dir + "/sigs")
+        find_duplicates = ExactFindDedups(data_folder=self.tmp_dir + "/sigs", output_folder=self.tmp_dir + "/dups")
+        dedup_filter = ExactDedupFilter(data_folder=self.tmp_dir + "/dups")
+
+        signature_creation(data=DOCS)
+        find_duplicates()
+        docs = list(dedup_filter(data=copy.deepcopy(DOCS)))
+        self.assertEqual([doc.id for doc in docs], ["1", "3", "5"])
+
+    def test_exact_deduplication_with_priority(self):
+        config = ExactDedupConfig(document_priority=lambda x: int(x.id))
+        signature_creation = ExactDedupSignature(output_folder=self.tmp_dir + "/sigs", config=config)
+        find_duplicates = ExactFindDedups(
+            data_folder=self.tmp_dir + "/sigs", output_folder=self.tmp_dir + "/dups", config=config
+        )
+        dedup_filter = ExactDedupFilter(data_folder=self.tmp_dir + "/dups", config=config)
+
+        signature_creation(data=DOCS)
+        find_duplicates()
+        docs = list(dedup_filter(data=copy.deepcopy(DOCS)))
+        self.assertEqual([doc.id for doc in docs], ["3", "4", "6"])
+
+    def test_exact_deduplication_with_index(self):
+        ExactDedupSignature(output_folder=self.tmp_dir + "/index_sigs")(data=INDEX)
+        ExactDedupBuildIndex(
+            data_folder=self.tmp_dir + "/index_sigs", output_folder=self.tmp_dir + "/index", index_name="index"
+        )()
+        ExactDedupSignature(output_folder=self.tmp_dir + "/sigs")(data=DOCS)
+        ExactFindDedups(
+            data_folder=self.tmp_dir + "/sigs",
+            output_folder=self.tmp_dir + "/dups",
+            index_folder=self.tmp_dir + "/index",
+        )()
+        docs = list(ExactDedupFilter(data_folder=self.tmp_dir + "/dups")(data=copy.deepcopy(DOCS)))
+        # only documents in the index are removed
+        self.assertEqual([doc.id for doc in docs], ["1", "2", "4", "5", "6"])
+
+    @use_hash_configs()
+    def test_distributed_find_dups(self, hash_config):
+        config = ExactDedupConfig(hash_config=hash_config)
+        signature_creation = ExactDedupSignature(
+            output_folder=self.tmp_dir + "/sigs", finder_workers=20, config=config
+        )
+        find_duplicates = ExactFindDedups(
+            data_folder=self.tmp_dir + "/sigs", output_folder=self.tmp_dir + "/dups", config=config
+        )
+        dedup_filter = ExactDedupFilter(data_folder=self.tmp_dir + "/dups", config=config)
+
+        signature_creation(data=DOCS[:3], rank=0, world_size=2)
+        signature_creation(data=DOCS[3:], rank=1, world_size=2)
+        for rank in range(20):
+            find_duplicates(rank=rank, world_size=20)
+
+        docs = list(dedup_filter(data=copy.deepcopy(DOCS[:3]), rank=0, world_size=2)) + list(
+            dedup_filter(data=copy.deepcopy(DOCS[3:]), rank=1, world_size=2)
+        )
+        self.assertEqual([doc.id for doc in docs], ["1", "3", "5"])
@@ -1,11 +1,17 @@
 import copy
+import os
 import shutil
+import struct
 import tempfile
 import unittest
+from collections import Counter
+
+import numpy as np
 
 from datatrove.data import Document
 from datatrove.pipeline.dedup.exact_substrings import (
     ESDatasetToSequence,
+    ESFindDuplicateRanges,
     ESMergeSequences,
     ESRangeRemover,
     read_bytes,
@@ -291,3 +297,92 @@ class TestExactSubstr(unittest.TestCase):
 
         for i, doc in enumerate(dedup_reader(data=data_2, rank=1, world_size=2)):
             self.assertEqual(doc.text, TARGETS_2.get(i))
+
+
+def make_sequence(rng, nr_docs, rank=0):
+    # same format as ESDatasetToSequence, with random tokens and some repeated spans
+    repeated = [np.arange(size, dtype=np.uint16) * 7 % 50 for size in (40, 90, 25)]
+    sequence = b""
+    for doc_id in range(nr_docs):
+        parts = [rng.integers(0, 50, size=rng.integers(0, 60), dtype=np.uint16) for _ in range(3)]
+        if doc_id % 3:
+            parts.insert(1 + doc_id % 2, repeated[doc_id % len(repeated)])
+        sequence += b"\xff\xff" + struct.pack("<I", doc_id) + b"\xff\xff" + struct.pack("<I", rank)
+        sequence += np.concatenate(parts).tobytes()
+    return sequence
+
+
+class TestSequencesWithoutTokenizer(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_find_duplicate_ranges(self):
+        sequence = make_sequence(np.random.default_rng(0), 30)
+        with open(f"{self.tmp_dir}/dataset{ExtensionHelperES.stage_2_big_sequence}", "wb") as f:
+            f.write(sequence)
+        tokens = np.frombuffer(sequence, dtype=np.uint16)
+
+        for length_threshold in (6, 16, 41):
+            # brute force: all the occurrences of the windows that appear more than once, merged
+            window = -(-length_threshold // 2)
+            windows = [tokens[i : i + window].tobytes() for i in range(len(tokens) - window + 1)]
+            counts = Counter(windows)
+            expected = []
+            for i, w in enumerate(windows):
+                if counts[w] > 1:
+                    if expected and 2 * i <= expected[-1][1]:
+                        expected[-1][1] = 2 * (i + window)
+                    else:
+                        expected.append([2 * i, 2 * (i + window)])
+            expected = "out\n" + "".join(f"{a} {b}\n" for a, b in expected)
+
+            for chunk_size in (7, 1000, 2**20):
+                ESFindDuplicateRanges(self.tmp_dir, length_threshold=length_threshold, chunk_size=chunk_size)()
+                with open(f"{self.tmp_dir}/dataset{ExtensionHelperES.stage_3_bytes_ranges}") as f:
+                    self.assertEqual(f.read(), expected)
+
+    def test_merge_sequences(self):
+        rng = np.random.default_rng(0)
+        sequences = [make_sequence(rng, nr_docs, rank) for rank, nr_docs in enumerate((10, 0, 25, 7))]
+        for rank, sequence in enumerate(sequences):
+            with open(f"{self.tmp_dir}/{rank:05d}{ExtensionHelperES.stage_1_sequence}", "wb") as f:
+                f.write(sequence)
+
+        # physical copy, with ranges smaller than the files
+        ESMergeSequences(self.tmp_dir, tasks_stage_1=4, bytes_per_batch=999, max_workers=3)()
+        with open(f"{self.tmp_dir}/dataset{ExtensionHelperES.stage_2_big_sequence}", "rb") as f:
+            self.assertEqual(f.read(), b"".join(sequences))
+        with open(f"{self.tmp_dir}/bytes_offsets{ExtensionHelperES.stage_2_bytes_offset}", "rb") as f:
+            offsets = np.frombuffer(f.read(), dtype="<u8")
+        self.assertEqual(offsets.tolist(), np.cumsum([0] + [len(sequence) for sequence in sequences]).tolist())
+        ESFindDuplicateRanges(self.tmp_dir, length_threshold=30)()
+        with open(f"{self.tmp_dir}/dataset{ExtensionHelperES.stage_3_bytes_ranges}") as f:
+            ranges = f.read()
+        self.assertGreater(len(ranges.splitlines()), 10)
+
+        # virtual concatenation: the ranges are found on the stage 1 files directly
+        ESMergeSequences(self.tmp_dir, tasks_stage_1=4, virtual=True)()
+        self.assertFalse(os.path.exists(f"{self.tmp_dir}/dataset{ExtensionHelperES.stage_2_big_sequence}"))
+        ESFindDuplicateRanges(self.tmp_dir, length_threshold=30, chunk_size=100)()
+        with open(f"{self.tmp_dir}/dataset{ExtensionHelperES.stage_3_bytes_ranges}") as f:
+            self.assertEqual(f.read(), ranges)
+        # a big sequence and a manifest can not be told apart
+        with open(f"{self.tmp_dir}/dataset{ExtensionHelperES.stage_2_big_sequence}", "wb") as f:
+            f.write(b"".join(sequences))
+        with self.assertRaises(ValueError):
+            ESFindDuplicateRanges(self.tmp_dir, length_threshold=30)()
+        ESMergeSequences(self.tmp_dir, tasks_stage_1=4)()
+        self.assertFalse(os.path.exists(f"{self.tmp_dir}/dataset{ExtensionHelperES.stage_2_manifest}"))
+
+        # the dtype of the offsets is read from the dtype file, uint32 without it
+        dedup_reader = ESRangeRemover(sequence_folder=self.tmp_dir)
+        for dtype in ("<u8", "<u4"):
+            if dtype == "<u4":
+                with open(f"{self.tmp_dir}/bytes_offsets{ExtensionHelperES.stage_2_bytes_offset}", "wb") as f:
+                    f.write(offsets.astype("<u4").tobytes())
+                os.remove(f"{self.tmp_dir}/bytes_offsets{ExtensionHelperES.stage_2_bytes_offset_dtype}")
+            dedup_reader.rank = 0
+            dedup_reader.get_sequence_bytes_offset()
+            self.assertEqual(dedup_reader.sequence_bytes_offset.tolist(), offsets.tolist())
@@ -1,7 +1,12 @@
+import copy
+import random
 import unittest
 
+import numpy as np
+
 from datatrove.data import Document
 from datatrove.pipeline.filters import (
+    FastTextClassifierFilter,
     GopherQualityFilter,
     GopherRepetitionFilter,
     LambdaFilter,
@@ -10,6 +15,16 @@ from datatrove.pipeline.filters import (
     UnigramLogProbFilter,
     URLFilter,
 )
+from datatrove.pipeline.filters.gopher_repetition_filter import (
+    NGramHashes,
+    find_all_duplicate,
+    find_all_duplicate_hashed,
+    find_top_duplicate,
+    find_top_duplicate_hashed,
+    get_n_grams,
+)
+from datatrove.utils.model_registry import clear_models, get_model
+from datatrove.utils.text import SPLIT_TEXT_PARAGRAPHS, SPLIT_TEXT_SENTENCES
 
 from ..utils import require_fasttext, require_nltk, require_tldextract
 
@@ -38,6 +53,20 @@ def get_doc(text, url=None):
     return Document(text, id="0", metadata={"url": url})
 
 
+class LengthModel:
+    """fastText-like model: the score of `__label__long` grows with the length of the text"""
+
+    labels = ["__label__long", "__label__short"]
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, texts, k=-1):
+        self.calls += 1
+        scores = [min(len(text) / 100, 1.0) for text in texts]
+        return [tuple(self.labels)] * len(texts), [np.array([score, 1 - score]) for score in scores]
+
+
 class TestFilters(unittest.TestCase):
     def check_filter(self, filter, doc, filter_reason):
         filter_result = filter.filter(doc)
@@ -62,6 +91,20 @@ class TestFilters(unittest.TestCase):
         doc = get_doc("I am a solo traveller " * 4 + TEXT_LF_1)
         self.check_filter(gopher_repetition, doc, "duplicated_5_n_grams")
 
+    def test_gopher_repetition_hashed_n_grams(self):
+        rng = random.Random(0)
+        # short words with shared characters, so that different n-grams often join into the same string
+        vocab = ["a", "b", "ab", "ba", "aba", "é", "a b", "🦠", ""]
+        for _ in range(200):
+            words = [rng.choice(vocab[: rng.randint(2, len(vocab))]) for _ in range(rng.randint(0, 40))]
+            spaced_hashes, hashes = NGramHashes(words, " "), NGramHashes(words)
+            for n in range(1, 11):
+                self.assertEqual(find_all_duplicate_hashed(hashes, n), find_all_duplicate(words, n))
+                if len(words) >= n:
+                    self.assertEqual(
+                        find_top_duplicate_hashed(spaced_hashes, n), find_top_duplicate(get_n_grams(words, n))
+                    )
+
     def test_gopher_quality(self):
         gopher_quality = GopherQualityFilter(min_doc_words=10, max_doc_words=1000)
         self.check_filter(gopher_quality, get_doc("I am too small..."), "gopher_short_doc")
@@ -100,6 +143,46 @@ class TestFilters(unittest.TestCase):
         self.assertTrue(language_filter.filter(doc4))
         self.assertEqual(doc4.metadata["language"], "it")
 
+        # a batch is predicted with a single call to the model, with the same results
+        docs = [Document(text=text, id="0") for text in (TEXT_LF_1, TEXT_LF_2, TEXT_LF_3, TEXT_LF_4)]
+        batch_filter = LanguageFilter(languages=("en", "it"), batch_size=4)
+        self.assertEqual(batch_filter.filter_batch(docs), [True, False, False, True])
+        self.assertEqual([doc.metadata for doc in docs], [doc1.metadata, doc2.metadata, doc3.metadata, doc4.metadata])
+
+    @require_fasttext
+    @require_nltk
+    def test_fasttext_filter_batch(self):
+        model = get_model(("fasttext", "length_model"), LengthModel)
+        self.addCleanup(clear_models, [("fasttext", "length_model")])
+        docs = [
+            Document(text=text, id=str(i))
+            for i, text in enumerate(
+                (
+                    "Short one.\n\n" + TEXT_LF_1,
+                    "",
+                    TEXT_LF_2 + "\nOk.\n\n\nNo. " + TEXT_LF_3,
+                    "Tiny.\nSmall.",
+                    TEXT_LF_4,
+                )
+            )
+        ]
+        for filter_mode in (SPLIT_TEXT_PARAGRAPHS, SPLIT_TEXT_SENTENCES):
+            fasttext_filter = FastTextClassifierFilter(
+                "length_model", keep_labels=("long", 0.5), filter_mode=filter_mode
+            )
+            single_docs = copy.deepcopy(docs)
+            single_results = [fasttext_filter.filter(doc) for doc in single_docs]
+
+            batch_docs = copy.deepcopy(docs)
+            calls = model.calls
+            # all the units of the batch are predicted with a single call to the model
+            self.assertEqual(fasttext_filter.filter_batch(batch_docs), single_results)
+            self.assertEqual(model.calls, calls + 1)
+            self.assertEqual([doc.text for doc in batch_docs], [doc.text for doc in single_docs])
+            self.assertEqual([doc.metadata for doc in batch_docs], [doc.metadata for doc in single_docs])
+            self.assertIn(True, single_results)
+            self.assertIn(False, single_results)
+
     def test_regex(self):
         regex_filter = RegexFilter(regex_exp=r"(?i)copyright")
         self.assertFalse(regex_filter.filter(get_doc(TEXT_LF_1 + "\n\nCoPyRiGhT")))
@@ -3,6 +3,7 @@ import os
 import shutil
 import struct
 import tempfile
+import threading
 import unittest
 from collections import defaultdict, deque
 from math import floor
@@ -12,13 +13,23 @@ import numpy as np
 from datatrove.data import Document
 from datatrove.io import get_datafolder
 from datatrove.pipeline.dedup.minhash import (
+    SENTINEL,
+    MinhashBuildIndex,
+    MinhashCompactIndex,
     MinhashConfig,
     MinhashDedupBuckets,
     MinhashDedupCluster,
     MinhashDedupFilter,
+    MinhashDedupInMemory,
     MinhashDedupSignature,
+    MinhashIndexSegmentWriter,
+    MinhashSigTable,
+    _mersenne_prime,
+    get_sig_dtype,
+    load_index_fences,
     read_sigs,
 )
+from datatrove.utils.binaryio import read_np_from_files
 
 from ..utils import require_nltk, require_xxhash, use_hash_configs
 
@@ -86,6 +97,131 @@ class TestMinhash(unittest.TestCase):
                     doc_ids.add(doc_id)
                 assert len(doc_ids) == 100
 
+    @use_hash_configs()
+    def test_signatures_batch(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config)
+        minhash = MinhashDedupSignature(output_folder=os.path.join(self.tmp_dir, "signatures"), config=config)
+        texts = [lorem_ipsum[i : i + 50 * i] for i in range(40)] + ["", "too short", lorem_ipsum]
+        shingles, offsets = minhash.get_shingles_batch(texts)
+        assert len(offsets) == len(texts) + 1
+        # small chunk_size: documents larger than a chunk and chunks with several documents
+        sigs = minhash.get_signatures_batch(shingles, offsets, chunk_size=200)
+        expected = [
+            np.concatenate(minhash.get_signature(doc_shingles)).tolist()
+            for doc_shingles in map(minhash.get_shingles, texts)
+            if doc_shingles.size != 0
+        ]
+        assert sigs.tolist() == expected
+
+    @use_hash_configs()
+    def test_signatures_spill(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config)
+        samples = [Document(f"sample {i}, {lorem_ipsum[i:: 10]}", id="test") for i in range(100)]
+        in_memory = MinhashDedupSignature(output_folder=os.path.join(self.tmp_dir, "sigs_memory"), config=config)
+        in_memory(samples)
+        # room for ~7 docs: forces several sorted chunks to be spilled and merged
+        spilled = MinhashDedupSignature(
+            output_folder=os.path.join(self.tmp_dir, "sigs_spilled"),
+            config=config,
+            sig_buffer_size=7 * config.num_buckets * (config.hashes_per_bucket * 8 + 4),
+        )
+        spilled(samples)
+        for bi in range(config.num_buckets):
+            filename = f"bucket_{bi:03d}/00000.minhash.sig"
+            with in_memory.output_folder.open(filename, "rb") as f1, spilled.output_folder.open(filename, "rb") as f2:
+                assert f1.read() == f2.read()
+        assert not spilled.output_folder.list_files(subdirectory="tmp")
+
+    @use_hash_configs()
+    def test_compact_signatures(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config, one_permutation=True, bits_per_hash=8)
+        assert config.sig_width == (2 if hash_config.precision == 64 else 3)
+        minhash = MinhashDedupSignature(output_folder=os.path.join(self.tmp_dir, "signatures"), config=config)
+        texts = [lorem_ipsum[i : i + 50 * i] for i in range(40)] + ["", "too short", lorem_ipsum]
+        shingles, offsets = minhash.get_shingles_batch(texts)
+        sigs = minhash.get_signatures_batch(shingles, offsets, chunk_size=200)
+        assert sigs.shape[1] == config.num_buckets * config.sig_width
+        expected = [
+            np.concatenate(minhash.get_signature(doc_shingles)).tolist()
+            for doc_shingles in map(minhash.get_shingles, texts)
+            if doc_shingles.size != 0
+        ]
+        assert sigs.tolist() == expected
+
+        # packed words stay below the maximum hash considered by stage 2
+        hash_max = _mersenne_prime if hash_config.precision == 64 else hash_config.max
+        assert sigs.max() < hash_max
+
+        # same document, same signature. the text reversed from the middle shares about half of its shingles
+        half = len(lorem_ipsum) // 2
+        sig = minhash.get_signature_array(minhash.get_shingles(lorem_ipsum))
+        assert np.array_equal(sig, minhash.get_signature_array(minhash.get_shingles(lorem_ipsum)))
+        sigd = minhash.get_signature_array(minhash.get_shingles(lorem_ipsum[:half] + lorem_ipsum[:half:-1]))
+        assert 0 < np.mean(sig == sigd) < 1
+
+    @use_hash_configs()
+    def test_compact_signatures_pipeline(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config, one_permutation=True, bits_per_hash=4)
+        clusters = [[0, 10, 20], [1000, 1010], [2000], [3000]]
+        samples = [
+            Document(text=lorem_ipsum[x : x + 1000], id=f"{ci}_{xi}", metadata={"ci": ci})
+            for ci, cluster in enumerate(clusters)
+            for xi, x in enumerate(cluster)
+        ]
+        sigs_folder = os.path.join(self.tmp_dir, "signatures")
+        buckets_folder = os.path.join(self.tmp_dir, "buckets")
+        MinhashDedupSignature(output_folder=sigs_folder, config=config)(samples)
+        with get_datafolder(sigs_folder).open("bucket_000/00000.minhash.sig", "rb") as f:
+            assert len(f.read()) == len(samples) * get_sig_dtype(config).itemsize
+        buckets_block = MinhashDedupBuckets(input_folder=sigs_folder, output_folder=buckets_folder, config=config)
+        for bi in range(config.num_buckets):
+            buckets_block(None, rank=bi, world_size=config.num_buckets)
+        MinhashDedupCluster(buckets_folder, os.path.join(self.tmp_dir, "clusters"), config=config)(None)
+        filtered = MinhashDedupFilter(os.path.join(self.tmp_dir, "clusters"))(samples)
+        assert sorted(doc.metadata["ci"] for doc in filtered) == list(range(len(clusters)))
+
+    def test_compact_signatures_benchmark(self):
+        # LSH candidate rate of synthetic document pairs with a known jaccard similarity, for the standard scheme
+        # (one permutation per hash, full 64 bits hashes) and for the compact signature options
+        rng = np.random.default_rng(0)
+        nr_pairs, doc_size = 300, 200
+
+        def make_pairs(min_jaccard, max_jaccard):
+            shingles, jaccards = [], rng.uniform(min_jaccard, max_jaccard, nr_pairs)
+            for jaccard in jaccards:
+                # |A & B| / |A | B| = jaccard with |A| = |B| = doc_size
+                common = int(round(2 * doc_size * jaccard / (1 + jaccard)))
+                values = rng.integers(0, 2**63, size=2 * doc_size - common, dtype=np.uint64)
+                shingles.append(values[:doc_size])
+                shingles.append(values[doc_size - common :])
+            offsets = np.cumsum([0] + [len(x) for x in shingles])
+            return np.concatenate(shingles), offsets
+
+        duplicates, non_duplicates = make_pairs(0.8, 0.95), make_pairs(0.2, 0.5)
+
+        def candidate_rate(config, pairs):
+            minhash = MinhashDedupSignature(output_folder=os.path.join(self.tmp_dir, "benchmark"), config=config)
+            sigs = minhash.get_signatures_batch(*pairs).reshape((-1, 2, config.num_buckets, config.sig_width))
+            return np.mean(np.any(np.all(sigs[:, 0] == sigs[:, 1], axis=-1), axis=-1))
+
+        configs = {
+            "standard": MinhashConfig(),
+            "one permutation": MinhashConfig(one_permutation=True),
+            "8 bits": MinhashConfig(bits_per_hash=8),
+            "one permutation + 8 bits": MinhashConfig(one_permutation=True, bits_per_hash=8),
+        }
+        results = {
+            name: (candidate_rate(c, duplicates), candidate_rate(c, non_duplicates)) for name, c in configs.items()
+        }
+        base_recall, base_fp = results["standard"]
+        for name, (recall, fp) in results.items():
+            summary = (
+                f"{name}: {get_sig_dtype(configs[name]).itemsize} bytes/sig, recall={recall:.3f} "
+                f"({recall - base_recall:+.3f}), false positives={fp:.3f} ({fp - base_fp:+.3f})"
+            )
+            assert recall > base_recall - 0.05, summary
+            assert fp < base_fp + 0.05, summary
+
     @use_hash_configs()
     def test_buckets_and_cluster(self, hash_config):
         sigs_folder = os.path.join(self.tmp_dir, "b_signatures")
@@ -110,7 +246,7 @@ class TestMinhash(unittest.TestCase):
 
         signatures_block(cluster_samples)
         # test file read
-        for fi, file in enumerate(buckets_block.input_folder.list_files()):
+        for fi, file in enumerate(buckets_block.input_folder.list_files(glob_pattern="**/*.minhash.sig")):
             last = None
             for sig in read_sigs(buckets_block.input_folder.open(file, "rb"), fi, config):
                 assert 0 <= sig.doc_id < 100
@@ -140,6 +276,17 @@ class TestMinhash(unittest.TestCase):
                 assert len(cluster) < 2 or any(a in pairs[b] for b in range(doc_id, doc_id + len(cluster)) if a != b)
             doc_id += len(cluster)
 
+        # lines_to_buffer is the size of the merged chunks: tiny chunks give the same pairs
+        chunked_buckets_block = MinhashDedupBuckets(
+            input_folder=sigs_folder, output_folder=f"{buckets_folder}_chunked", config=config, lines_to_buffer=2
+        )
+        for b in range(config.num_buckets * 10):
+            chunked_buckets_block(None, rank=b, world_size=config.num_buckets * 10)
+        for dup_file in dup_files:
+            with bucket_results_folder.open(dup_file, "rb") as df:
+                with chunked_buckets_block.output_folder.open(dup_file, "rb") as chunked_df:
+                    assert df.read() == chunked_df.read()
+
         # clustering
         cluster_block = MinhashDedupCluster(bucket_results_folder, clusters_folder, config=config)
         cluster_block(None)
@@ -265,7 +412,7 @@ class TestMinhash(unittest.TestCase):
             # check if actually read the same hashes, when using 1 worker or 10
             for bucket in range(config.num_buckets):
                 sigs_df = get_datafolder(sigs_folder)
-                sig_files = sigs_df.list_files(subdirectory=f"bucket_{bucket:03d}")
+                sig_files = sigs_df.list_files(subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.sig")
                 sig_readers = [
                     read_sigs(sigs_df.open(file, mode="rb"), file_i, config) for file_i, file in enumerate(sig_files)
                 ]
@@ -294,3 +441,306 @@ class TestMinhash(unittest.TestCase):
                         next_sig = next(sig_readers[v.reader_id], None)
                         if next_sig:
                             heapq.heappush(pq, next_sig)
+
+    @use_hash_configs()
+    def test_index(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config)
+        index_sigs_folder = os.path.join(self.tmp_dir, "index_signatures")
+        sigs_folder = os.path.join(self.tmp_dir, "b_signatures")
+        index_folder = os.path.join(self.tmp_dir, "index")
+        buckets_folder = os.path.join(self.tmp_dir, "b_buckets")
+
+        index_samples = [Document(text=lorem_ipsum[x : x + 300], id="index") for x in range(0, 1500, 300)]
+        # the first 5 documents are in the index, the 2 last ones are an exact duplicate pair
+        samples = index_samples + [Document(text=lorem_ipsum[2000:2400], id=f"new_{i}") for i in range(2)]
+
+        MinhashDedupSignature(output_folder=index_sigs_folder, config=config)(index_samples)
+        for bucket in range(config.num_buckets):
+            MinhashBuildIndex(index_sigs_folder, index_folder, index_name="lorem", config=config)(
+                None, bucket, config.num_buckets
+            )
+
+        MinhashDedupSignature(output_folder=sigs_folder, config=config)(samples)
+        for only_dedup_in_index in (True, False):
+            buckets_block = MinhashDedupBuckets(
+                input_folder=sigs_folder,
+                output_folder=os.path.join(buckets_folder, str(only_dedup_in_index)),
+                index_folder=index_folder,
+                only_dedup_in_index=only_dedup_in_index,
+                config=config,
+            )
+            for bucket in range(config.num_buckets):
+                buckets_block(None, rank=bucket, world_size=config.num_buckets)
+            pairs = set()
+            for dup_file in buckets_block.output_folder.list_files(glob_pattern="*.dups"):
+                with buckets_block.output_folder.open(dup_file, "rb") as df:
+                    while data := df.read(4 * struct.calcsize("I")):
+                        pairs.add(struct.unpack("<4I", data))
+            expected = {(SENTINEL, SENTINEL, 0, doc_id) for doc_id in range(len(index_samples))}
+            if not only_dedup_in_index:
+                expected.add((0, 5, 0, 6))
+            assert pairs == expected
+
+    def test_sig_table(self):
+        for config in (MinhashConfig(), MinhashConfig(bits_per_hash=4)):
+            rng = np.random.default_rng(0)
+            sigs = rng.integers(0, 2**40, size=(5000, config.sig_width), dtype=np.uint64)
+            sigs[1000:1500] = sigs[:500]
+            # small initial capacity: the table grows several times
+            table = MinhashSigTable(config, capacity=16)
+            seen = table.add(sigs[:3000])
+            _, first = np.unique(sigs[:3000], axis=0, return_index=True)
+            assert seen.sum() == 3000 - len(first) and not seen[first].any()
+            assert len(table) == len(first) and 2 * len(table) <= len(table.slots)
+            assert table.contains(sigs[:3000]).all()
+            assert not table.contains(sigs[3000:]).any()
+            # sigs already in the table and repeated in the same batch
+            seen = table.add(np.concatenate([sigs[2990:3010], sigs[3005:3006]]))
+            assert seen.tolist() == [True] * 10 + [False] * 10 + [True]
+
+    @use_hash_configs()
+    def test_in_memory(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config)
+        clusters = [[0, 20, 50], [400, 420], [800, 810, 820, 840, 860], [1205, 1215, 1225, 1245], [1600], [2000]]
+        samples = [
+            Document(text=lorem_ipsum[x : x + 400], id=f"{ci}_{xi}", metadata={"ci": ci, "xi": xi})
+            for ci, cluster in enumerate(clusters)
+            for xi, x in enumerate(cluster)
+        ] + [Document(text="", id="empty")]
+        # the first document of each cluster is kept, like with the multi stage pipeline
+        in_memory = MinhashDedupInMemory(config=config, batch_size=5, table_capacity=4)
+        assert [doc.id for doc in in_memory(samples)] == [f"{ci}_0" for ci in range(len(clusters))] + ["empty"]
+
+        # the index saved by the in memory step is the same as the one built from the signatures
+        index_folder = get_datafolder(os.path.join(self.tmp_dir, "index"))
+        sigs_folder = os.path.join(self.tmp_dir, "signatures")
+        list(MinhashDedupInMemory(config=config, index_folder=index_folder, create_index_name="memory")(samples))
+        MinhashDedupSignature(output_folder=sigs_folder, config=config)(samples)
+        for bucket in range(config.num_buckets):
+            MinhashBuildIndex(sigs_folder, index_folder, index_name="stages", config=config)(
+                None, bucket, config.num_buckets
+            )
+            with index_folder.open(f"bucket_{bucket:03d}/memory_00.minhash.index", "rb") as f1:
+                with index_folder.open(f"bucket_{bucket:03d}/stages.minhash.index", "rb") as f2:
+                    assert f1.read() == f2.read()
+            index_folder.rm(f"bucket_{bucket:03d}/stages.minhash.index")
+
+        # dedup against the index
+        new_samples = [Document(text=lorem_ipsum[2400:2800], id=f"new_{i}") for i in range(2)]
+        # same default as MinhashDedupBuckets
+        dedup = MinhashDedupInMemory(config=config, index_folder=index_folder)
+        assert [doc.id for doc in dedup(samples[:3] + new_samples)] == ["new_0", "new_1"]
+        for only_dedup_in_index, expected in ((True, ["new_0", "new_1"]), (False, ["new_0"])):
+            dedup = MinhashDedupInMemory(
+                config=config,
+                index_folder=index_folder,
+                only_dedup_in_index=only_dedup_in_index,
+                create_index_name="memory2",
+            )
+            assert [doc.id for doc in dedup(samples[:3] + new_samples)] == expected
+        # only the new signatures are saved to the new index
+        with index_folder.open("bucket_000/memory2_00.minhash.index", "rb") as f:
+            assert len(f.read()) == get_sig_dtype(config)["sig"].itemsize
+
+    def test_cluster_chunked(self):
+        config = MinhashConfig(num_buckets=1)
+        dups_folder = get_datafolder(os.path.join(self.tmp_dir, "dups"))
+        # chain 0-1-2-...-9 in file 0, linked to doc 3 of file 2. docs 5-6 of file 1 are matched with the index
+        pairs = [(0, i, 0, i + 1) for i in range(9)] + [(2, 3, 0, 9), (SENTINEL, SENTINEL, 1, 5), (1, 5, 1, 6)]
+        with dups_folder.open("00000_00.dups", "wb") as f:
+            f.write(np.array(pairs[::-1], dtype="<u4").tobytes())
+        for local_working_dir in (None, os.path.join(self.tmp_dir, "work")):
+            clusters_folder = get_datafolder(os.path.join(self.tmp_dir, f"clusters_{local_working_dir is None}"))
+            MinhashDedupCluster(
+                dups_folder,
+                clusters_folder,
+                config=config,
+                save_cluster_size=True,
+                lines_to_buffer=3,
+                local_working_dir=local_working_dir,
+            )(None)
+            removed = {
+                file: np.frombuffer(clusters_folder.open(file, "rb").read(), dtype="<u4").tolist()
+                for file in clusters_folder.list_files(glob_pattern="*.remove")
+            }
+            # the smallest (file, doc) of each cluster is kept, or none if it matched the index
+            assert removed == {"000000.remove": list(range(1, 10)), "000001.remove": [5, 6], "000002.remove": [3]}
+            with clusters_folder.open("000002.sizes", "rb") as f:
+                assert np.frombuffer(f.read(), dtype="<u4").tolist() == [3, 11]
+
+    def test_cluster_no_duplicates(self):
+        config = MinhashConfig(num_buckets=2)
+        dups_folder = get_datafolder(os.path.join(self.tmp_dir, "dups"))
+        for bucket in range(config.num_buckets):
+            with dups_folder.open(f"{bucket:05d}_00.dups", "wb"):
+                pass
+        clusters_folder = get_datafolder(os.path.join(self.tmp_dir, "clusters"))
+        MinhashDedupCluster(dups_folder, clusters_folder, config=config, save_cluster_id=True, save_cluster_size=True)(
+            None
+        )
+        # nothing to remove
+        assert clusters_folder.list_files(recursive=False) == []
+
+    def write_random_dups(self, folder, config, seed):
+        dups_folder = get_datafolder(os.path.join(self.tmp_dir, folder))
+        rng = np.random.default_rng(seed)
+        for bucket in range(config.num_buckets):
+            pairs = rng.integers(0, 40, size=(200, 4)) % [5, 40, 5, 40]
+            pairs[:10, :2] = SENTINEL
+            with dups_folder.open(f"{bucket:05d}_00.dups", "wb") as f:
+                f.write(pairs.astype("<u4").tobytes())
+        return dups_folder
+
+    def run_distributed_cluster(self, dups_folder, clusters_folder, config, world_size):
+        errors = []
+
+        def run_task(rank):
+            try:
+                MinhashDedupCluster(
+                    dups_folder,
+                    clusters_folder,
+                    config=config,
+                    save_cluster_id=True,
+                    save_cluster_size=True,
+                    poll_interval=0.01,
+                    timeout=60,
+                ).run(rank=rank, world_size=world_size)
+            except Exception as e:
+                errors.append(e)
+
+        tasks = [threading.Thread(target=run_task, args=(rank,)) for rank in range(world_size)]
+        for task in tasks:
+            task.start()
+        for task in tasks:
+            task.join()
+        if errors:
+            raise errors[0]
+        return {file: clusters_folder.open(file, "rb").read() for file in clusters_folder.list_files(recursive=False)}
+
+    def test_cluster_distributed(self):
+        config = MinhashConfig(num_buckets=2)
+        dups_folder = self.write_random_dups("dups", config, 0)
+
+        outputs = {}
+        for world_size in (1, 3):
+            clusters_folder = get_datafolder(os.path.join(self.tmp_dir, f"clusters_{world_size}"))
+            outputs[world_size] = self.run_distributed_cluster(dups_folder, clusters_folder, config, world_size)
+        self.assertTrue(any(file.endswith(".remove") for file in outputs[1]))
+        self.assertEqual(outputs[1], outputs[3])
+
+    def test_cluster_distributed_few_duplicates(self):
+        # more tasks than documents with duplicates: most tasks own no duplicate node
+        config = MinhashConfig(num_buckets=1)
+        dups_folder = get_datafolder(os.path.join(self.tmp_dir, "dups"))
+        with dups_folder.open("00000_00.dups", "wb") as f:
+            f.write(np.array([(0, 1, 0, 2), (2, 3, 2, 5)], dtype="<u4").tobytes())
+        outputs = {}
+        for world_size in (1, 6):
+            clusters_folder = get_datafolder(os.path.join(self.tmp_dir, f"clusters_{world_size}"))
+            outputs[world_size] = self.run_distributed_cluster(dups_folder, clusters_folder, config, world_size)
+        self.assertEqual(
+            set(outputs[1]),
+            {"000000.remove", "000002.remove", "000000.clusters", "000002.clusters", "000000.sizes", "000002.sizes"},
+        )
+        self.assertEqual(outputs[1], outputs[6])
+
+    def test_cluster_distributed_rerun(self):
+        config = MinhashConfig(num_buckets=2)
+        clusters_folder = get_datafolder(os.path.join(self.tmp_dir, "clusters"))
+        self.run_distributed_cluster(self.write_random_dups("dups_1", config, 1), clusters_folder, config, 3)
+        # leftovers of an interrupted run: a task that finished a round and sent edges
+        with clusters_folder.open("cluster_rounds/run_old/round_001/00001.done", "wb") as f:
+            f.write(b"")
+        with clusters_folder.open("cluster_rounds/run_old/round_001/00000_00001.edges", "wb") as f:
+            f.write(np.array([[1, 0]], dtype="<i8").tobytes())
+
+        # rerun on different duplicates over the existing cluster_rounds folder
+        dups_folder = self.write_random_dups("dups_2", config, 2)
+        rerun = self.run_distributed_cluster(dups_folder, clusters_folder, config, 3)
+        expected = self.run_distributed_cluster(
+            dups_folder, get_datafolder(os.path.join(self.tmp_dir, "clusters_expected")), config, 1
+        )
+        self.assertEqual(rerun, expected)
+        # files of the previous runs were removed
+        self.assertEqual(len(clusters_folder.glob("cluster_rounds/run_*")), 1)
+
+        # a single task rerun on its own can not complete: it times out instead of hanging
+        cluster = MinhashDedupCluster(dups_folder, clusters_folder, config=config, poll_interval=0.01, timeout=0.2)
+        with self.assertRaises(TimeoutError):
+            cluster.run(rank=1, world_size=3)
+
+    def test_worker_hash_ranges(self):
+        config = MinhashConfig(num_buckets=1, hashes_per_bucket=2)
+        sigs_folder = get_datafolder(os.path.join(self.tmp_dir, "signatures"))
+        signatures_block = MinhashDedupSignature(output_folder=sigs_folder, config=config)
+        rng = np.random.default_rng(0)
+        # the first file is small and only has high hashes
+        for rank, (nr_sigs, low) in enumerate([(20, 2**60), (5000, 0), (3000, 0)]):
+            sigs = rng.integers(low, _mersenne_prime, size=(nr_sigs, 2), dtype=np.uint64)
+            records = signatures_block.write_sorted_sigs(
+                sigs_folder, f"bucket_000/{rank:05d}.minhash.sig", sigs, np.arange(nr_sigs, dtype=np.uint32)
+            )
+            signatures_block.write_hash_sketch(0, rank, signatures_block.get_sketch_hashes(records), nr_sigs)
+        buckets_block = MinhashDedupBuckets(input_folder=sigs_folder, output_folder=self.tmp_dir, config=config)
+        sig_files = sigs_folder.list_files(subdirectory="bucket_000", glob_pattern="*.minhash.sig")
+        first_hashes = np.sort(
+            np.concatenate(
+                [read_np_from_files(sigs_folder, [file], get_sig_dtype(config))["sig"][:, 0] for file in sig_files]
+            )
+        )
+
+        for with_sketch in (True, False):
+            if not with_sketch:
+                for file in sigs_folder.list_files(subdirectory="bucket_000", glob_pattern="*.minhash.quantiles"):
+                    sigs_folder.rm(file)
+            ranges = [buckets_block.get_worker_hash_range(sig_files, rank, 4) for rank in range(4)]
+            assert ranges[0][0] == 0 and ranges[-1][1] == _mersenne_prime
+            assert all(ranges[i][1] == ranges[i + 1][0] for i in range(3))
+            worker_sigs = [
+                np.searchsorted(first_hashes, hash_max) - np.searchsorted(first_hashes, hash_min)
+                for hash_min, hash_max in ranges
+            ]
+            assert sum(worker_sigs) == len(first_hashes)
+            assert max(worker_sigs) < 1.25 * len(first_hashes) / 4
+
+    def test_index_compaction(self):
+        config = MinhashConfig(num_buckets=2)
+        index_folder = get_datafolder(os.path.join(self.tmp_dir, "index"))
+        sigs_folder = os.path.join(self.tmp_dir, "b_signatures")
+        index_samples = [Document(text=lorem_ipsum[x : x + 300], id="index") for x in range(0, 1500, 300)]
+        samples = index_samples + [Document(text=lorem_ipsum[2000:2400], id="new")]
+
+        # one index segment per previous dump
+        for dump_i, dump_samples in enumerate((index_samples[:2], index_samples[2:])):
+            dump_sigs_folder = os.path.join(self.tmp_dir, f"dump_{dump_i}")
+            MinhashDedupSignature(output_folder=dump_sigs_folder, config=config)(dump_samples)
+            for bucket in range(config.num_buckets):
+                MinhashBuildIndex(dump_sigs_folder, index_folder, index_name=f"dump_{dump_i}", config=config)(
+                    None, bucket, config.num_buckets
+                )
+        for bucket in range(config.num_buckets):
+            MinhashCompactIndex(index_folder, config=config)(None, bucket, config.num_buckets)
+            assert index_folder.list_files(subdirectory=f"bucket_{bucket:03d}") == [
+                f"bucket_{bucket:03d}/compacted_00000.minhash.index",
+                f"bucket_{bucket:03d}/manifest.json",
+            ]
+            assert load_index_fences(index_folder, bucket)["compacted_00000.minhash.index"]["count"] == 5
+            # a new segment with higher hashes than any signature, skipped by the first worker of each bucket
+            with MinhashIndexSegmentWriter(index_folder, f"bucket_{bucket:03d}/high.minhash.index") as writer:
+                writer.write(np.full((1, config.hashes_per_bucket), _mersenne_prime - 1, dtype=np.uint64))
+
+        MinhashDedupSignature(output_folder=sigs_folder, config=config)(samples)
+        buckets_block = MinhashDedupBuckets(
+            input_folder=sigs_folder,
+            output_folder=os.path.join(self.tmp_dir, "b_buckets"),
+            index_folder=index_folder,
+            config=config,
+        )
+        for rank in range(2 * config.num_buckets):
+            buckets_block(None, rank=rank, world_size=2 * config.num_buckets)
+        assert buckets_block.stats["skipped_index_segments"].total == config.num_buckets
+        pairs = set()
+        for dup_file in buckets_block.output_folder.list_files(glob_pattern="*.dups"):
+            with buckets_block.output_folder.open(dup_file, "rb") as df:
+                pairs.update(map(tuple, np.frombuffer(df.read(), dtype="<u4").reshape(-1, 4).tolist()))
+        assert pairs == {(SENTINEL, SENTINEL, 0, doc_id) for doc_id in range(len(index_samples))}
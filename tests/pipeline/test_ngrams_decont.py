@@ -3,9 +3,18 @@ import shutil
 import tempfile
 import unittest
 
+import numpy as np
+
 from datatrove.data import Document
-from datatrove.pipeline.decont import NGramsDecontConfig, NGramsDecontFilter, NGramsDecontIndexer
-from tests.utils import require_xxhash, use_hash_configs
+from datatrove.pipeline.decont import (
+    AhoCorasickDecontFilter,
+    NGramsDecontConfig,
+    NGramsDecontFilter,
+    NGramsDecontIndexer,
+)
+from datatrove.pipeline.decont.n_grams import SORTED_INDEX_NAME
+from datatrove.utils.text import ngrams, simplify_text
+from tests.utils import require_pyahocorasick, require_xxhash, use_hash_configs
 
 
 TEXTS = [
@@ -64,3 +73,84 @@ class TestNGramDecont(unittest.TestCase):
             self.get_test_results(NGramsDecontConfig(find_query_ngrams=False, find_overlap_ngrams=True)),
             (0, 3, 4, 5, 6),
         )
+
+    @use_hash_configs()
+    def test_sorted_index(self, hash_config):
+        config = NGramsDecontConfig(n_grams=5, hash_config=hash_config)
+        nfilter = NGramsDecontFilter(self.tmp_dir, config=config)
+
+        def save_task(task_name, texts):
+            hashes = [
+                nfilter.hash_func(" ".join(n_gram))
+                for text in texts
+                for n_gram in ngrams(nfilter.tokenizer.word_tokenize(simplify_text(text)), config.n_grams)
+            ]
+            np.array(hashes, dtype=hash_config.np_descr).tofile(f"{self.tmp_dir}/{task_name}.index.hashes")
+
+        save_task("suite:task_a", [TEXTS[1], TEXTS[4]])
+        save_task("suite:task_b", [TEXTS[2], TEXTS[4]])
+        docs = list(nfilter(copy.deepcopy(DOCS)))
+        self.assertEqual([doc.id for doc in docs], ["0", "5"])
+        # n-grams present in several tasks are attributed to the last one
+        removed = {
+            doc.id: (doc.metadata["contaminated_task"], doc.metadata["contaminated_ngram"])
+            for doc in copy.deepcopy(DOCS)
+            if nfilter.filter(doc) is not True
+        }
+        self.assertEqual(
+            removed,
+            {
+                "1": ("suite:task_a", "get into formation then begin"),
+                "2": ("suite:task_b", "he is using commercial lawn"),
+                "3": ("suite:task_b", "he is using commercial lawn"),
+                "4": ("suite:task_b", "walks outside plugs his lawn"),
+                "6": ("suite:task_b", "walks outside plugs his lawn"),
+            },
+        )
+
+        # the sorted index is saved once and rebuilt when the index files change
+        all_hashes = np.concatenate(
+            [np.fromfile(f"{self.tmp_dir}/suite:task_{t}.index.hashes", dtype=hash_config.np_descr) for t in "ab"]
+        )
+        sorted_hashes = np.fromfile(f"{self.tmp_dir}/{SORTED_INDEX_NAME}.hashes", dtype=hash_config.np_descr)
+        self.assertEqual(sorted_hashes.tolist(), np.unique(all_hashes).tolist())
+        save_task("suite:task_c", [TEXTS[0]])
+        docs = list(NGramsDecontFilter(self.tmp_dir, config=config)(copy.deepcopy(DOCS)))
+        self.assertEqual([doc.id for doc in docs], ["5"])
+
+    @require_pyahocorasick
+    def test_aho_corasick(self):
+        config = NGramsDecontConfig(n_grams=5)
+        nfilter = NGramsDecontFilter(self.tmp_dir, config=config)
+        for task_name, texts in (("suite:task_a", [TEXTS[1], TEXTS[4]]), ("suite:task_b", [TEXTS[2], TEXTS[3]])):
+            n_grams = sorted(
+                {
+                    " ".join(n_gram)
+                    for text in texts
+                    for n_gram in ngrams(nfilter.tokenizer.word_tokenize(simplify_text(text)), config.n_grams)
+                }
+            )
+            np.array(list(map(nfilter.hash_func, n_grams)), dtype=np.uint64).tofile(
+                f"{self.tmp_dir}/{task_name}.index.hashes"
+            )
+            with open(f"{self.tmp_dir}/{task_name}.index.ngrams", "w") as f:
+                f.writelines(f"{n_gram}\n" for n_gram in n_grams)
+
+        def get_removed(decont_filter):
+            return {
+                doc.id: (doc.metadata["contaminated_task"], doc.metadata["contaminated_ngram"])
+                for doc in copy.deepcopy(DOCS)
+                if decont_filter.filter(doc) is not True
+            }
+
+        removed = get_removed(AhoCorasickDecontFilter(self.tmp_dir, config=config))
+        self.assertEqual(removed, get_removed(nfilter))
+        self.assertEqual(removed["1"], ("suite:task_a", "get into formation then begin"))
+        self.assertEqual(sorted(removed), ["1", "2", "3", "4", "6"])
+        # only whole words match
+        self.assertIs(
+            AhoCorasickDecontFilter(self.tmp_dir, config=config).filter(
+                Document(text="Forget into formation, then beginning", id="0")
+            ),
+            True,
+        )
@@ -1,10 +1,13 @@
 import copy
 import random
+import re
 import shutil
 import string
 import tempfile
 import unittest
 
+import numpy as np
+
 from datatrove.data import Document
 from datatrove.pipeline.dedup.sentence_dedup import (
     SentDedupConfig,
@@ -12,7 +15,9 @@ from datatrove.pipeline.dedup.sentence_dedup import (
     SentenceDedupFilter,
     SentenceDedupSignature,
     SentenceFindDedups,
+    get_sig_dtype,
 )
+from datatrove.utils.word_tokenizers import WordTokenizer, strip_strings
 
 from ..utils import require_nltk, require_xxhash, use_hash_configs
 
@@ -148,6 +153,19 @@ TARGETS_WITH_INDEX = [
 ]
 
 
+class LineBreakTokenizer(WordTokenizer):
+    """Splits sentences on punctuation and line breaks. Like spaCy, it returns spans of whitespace only sentences"""
+
+    def word_tokenize(self, text: str) -> list[str]:
+        return text.split()
+
+    def sent_tokenize(self, text: str) -> list[str]:
+        return strip_strings([text[start:end] for start, end in self.span_tokenize(text)])
+
+    def span_tokenize(self, text: str) -> list[tuple[int, int]]:
+        return [match.span() for match in re.finditer(r"[^.!?\n]+[.!?]*|\n+", text)]
+
+
 @require_nltk
 @require_xxhash
 class SentenceDedup(unittest.TestCase):
@@ -234,3 +252,100 @@ class SentenceDedup(unittest.TestCase):
 
         for i, doc in enumerate(dedup_filter(data=copy.deepcopy(DOCS_2), rank=1, world_size=2)):
             self.assertEqual(doc.text, TARGETS_WS2_1[i])
+
+    @use_hash_configs()
+    def test_signature_batches(self, hash_config):
+        config = SentDedupConfig(hash_config=hash_config)
+        docs = DOCS + DOCS_2 + [Document(text="", id="empty")] + DOCS
+        single = SentenceDedupSignature(
+            output_folder=self.tmp_dir + "/single", finder_workers=3, config=config, batch_size=1
+        )
+        batch = SentenceDedupSignature(
+            output_folder=self.tmp_dir + "/batch", finder_workers=3, config=config, batch_size=4
+        )
+        single(data=docs)
+        batch(data=docs)
+        # one batch per document or several documents per batch: same sorted signature files
+        expected = np.concatenate([single.get_hashes(doc, doc_idx) for doc_idx, doc in enumerate(docs)])
+        expected = np.sort(expected)
+        signatures = []
+        for file in single.output_folder.list_files():
+            with single.output_folder.open(file, "rb") as f1, batch.output_folder.open(file, "rb") as f2:
+                data = f1.read()
+                self.assertEqual(data, f2.read())
+            signatures.append(np.frombuffer(data, dtype=get_sig_dtype(config)))
+        self.assertEqual(np.concatenate(signatures).tolist(), expected.tolist())
+
+    def test_find_dups_chunked(self):
+        config = SentDedupConfig(min_doc_words=0, min_num_sentences=0, only_dedup_in_index=False)
+        SentenceDedupSignature(output_folder=self.tmp_dir + "/index_sigs", config=config)(data=INDEX)
+        SentenceDedupBuildIndex(
+            data_folder=self.tmp_dir + "/index_sigs", output_folder=self.tmp_dir + "/index", index_name="index"
+        )()
+        SentenceDedupSignature(output_folder=self.tmp_dir + "/sigs", config=config)(data=DOCS, rank=0, world_size=2)
+        SentenceDedupSignature(output_folder=self.tmp_dir + "/sigs", config=config)(data=DOCS_2, rank=1, world_size=2)
+        # tiny chunks: runs of equal hashes and index matches span several chunks
+        for lines_to_buffer in (1, 1000):
+            SentenceFindDedups(
+                data_folder=self.tmp_dir + "/sigs",
+                index_folder=self.tmp_dir + "/index",
+                output_folder=self.tmp_dir + f"/dups_{lines_to_buffer}",
+                config=config,
+                lines_to_buffer=lines_to_buffer,
+            )()
+        for rank in range(2):
+            filename = f"0000/{rank:05d}.c4_dup"
+            with open(self.tmp_dir + f"/dups_1/{filename}", "rb") as f1:
+                with open(self.tmp_dir + f"/dups_1000/{filename}", "rb") as f2:
+                    dups = f1.read()
+                    self.assertEqual(dups, f2.read())
+            self.assertGreater(len(dups), 0)
+
+    def test_sd_sentence_spans(self):
+        config = SentDedupConfig(min_doc_words=0, min_num_sentences=0)
+        SentenceDedupSignature(output_folder=self.tmp_dir + "/sigs", config=config)(data=DOCS)
+        SentenceDedupSignature(output_folder=self.tmp_dir + "/sigs_spans", config=config, save_sentence_spans=True)(
+            data=DOCS
+        )
+        # the signatures do not change
+        with open(self.tmp_dir + "/sigs/0000/00000.c4_sig", "rb") as f1:
+            with open(self.tmp_dir + "/sigs_spans/0000/00000.c4_sig", "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+        SentenceFindDedups(
+            data_folder=self.tmp_dir + "/sigs_spans", output_folder=self.tmp_dir + "/dups", config=config
+        )()
+        dedup_filter = SentenceDedupFilter(
+            data_folder=self.tmp_dir + "/dups", config=config, sentence_spans_folder=self.tmp_dir + "/sigs_spans"
+        )
+        # the sentences are not split again
+        dedup_filter.tokenizer = None
+        for i, doc in enumerate(dedup_filter(data=copy.deepcopy(DOCS))):
+            self.assertEqual(doc.text, TARGETS[i])
+
+        # changed texts are split again
+        dedup_filter = SentenceDedupFilter(
+            data_folder=self.tmp_dir + "/dups", config=config, sentence_spans_folder=self.tmp_dir + "/sigs_spans"
+        )
+        docs = copy.deepcopy(DOCS)
+        # a document with duplicates. the trailing whitespace is not part of the last sentence
+        changed = next(i for i, doc in enumerate(DOCS) if doc.text != TARGETS[i])
+        docs[changed].text += " "
+        for i, doc in enumerate(dedup_filter(data=docs)):
+            self.assertEqual(doc.text, TARGETS[i])
+        self.assertEqual(dedup_filter.stats["sentence_spans_mismatch"].total, 1)
+
+    def test_sd_sentence_spans_empty_sentences(self):
+        config = SentDedupConfig(min_doc_words=0, min_num_sentences=0)
+        docs = [Document(text=doc.text.replace(". ", ". \n\n"), id=doc.id) for doc in DOCS]
+        for folder, save_sentence_spans in (("sigs", False), ("sigs_spans", True)):
+            signature = SentenceDedupSignature(
+                output_folder=f"{self.tmp_dir}/{folder}", config=config, save_sentence_spans=save_sentence_spans
+            )
+            signature.tokenizer = LineBreakTokenizer()
+            signature(data=docs)
+        # the empty sentences of span_tokenize are dropped: the signatures do not change
+        with open(self.tmp_dir + "/sigs/0000/00000.c4_sig", "rb") as f1:
+            with open(self.tmp_dir + "/sigs_spans/0000/00000.c4_sig", "rb") as f2:
+                sigs = f1.read()
+                self.assertEqual(sigs, f2.read())
+        self.assertGreater(len(sigs), 0)
@@ -1,6 +1,16 @@
+import dataclasses
 import unittest
 
-from src.datatrove.utils.text import PUNCTUATION, TextNormConfig, simplify_text
+from datatrove.data import Document
+from src.datatrove.utils.text import (
+    PUNCTUATION,
+    TextNormConfig,
+    simplify_text,
+    split_into_paragraphs,
+    split_into_sentences,
+    split_into_words,
+)
+from tests.utils import require_nltk
 
 
 class TestTextTransformation(unittest.TestCase):
@@ -18,3 +28,22 @@ class TestTextTransformation(unittest.TestCase):
         # Should be just 0, because there is a strange 1 in special symbols
         expected_text = "0"
         self.assertEqual(transformed_text, expected_text)
+
+    @require_nltk
+    def test_document_analysis(self):
+        text = "Hello there, general Kenobi.\nYou are a bold one.\n\nKill him!"
+        doc = Document(text=text, id="0")
+        words = doc.analysis.words()
+        self.assertEqual(words, split_into_words(text))
+        self.assertIs(doc.analysis.words(), words)
+        self.assertEqual(doc.analysis.sentences(), split_into_sentences(text))
+        self.assertEqual(doc.analysis.paragraphs(), split_into_paragraphs(text))
+        self.assertEqual(doc.analysis.lines(), text.splitlines())
+        self.assertEqual(doc.analysis.split("\n\n"), text.split("\n\n"))
+
+        # rewriting the text invalidates the cache
+        doc.text = "Kill him!"
+        self.assertEqual(doc.analysis.words(), ["Kill", "him", "!"])
+        # the cache is not a field: it is not serialized or compared
+        self.assertEqual(dataclasses.asdict(doc), {"text": "Kill him!", "id": "0", "media": [], "metadata": {}})
+        self.assertEqual(doc, Document(text="Kill him!", id="0"))
@@ -195,3 +195,35 @@ class UrlDedup(unittest.TestCase):
             {doc.metadata["url"] for doc in dedup_docs_2},
             {doc.metadata["url"] for doc in DOCS},
         )
+
+    def test_batches_and_chunks(self):
+        config = UrlDedupConfig(
+            document_priority=lambda x: 1 + int(x.id) % 3, url_normalizer=lambda x: x.split("?")[0]
+        )
+        docs = [
+            Document(text="", metadata={"url": f"https://example.com/{i % 7}?q={i}"}, id=str(i)) for i in range(40)
+        ]
+
+        def run_dedup(name, batch_size, lines_to_buffer):
+            UrlDedupSignature(output_folder=f"{self.tmp_dir}/{name}/sigs", config=config, batch_size=batch_size)(
+                data=docs
+            )
+            UrlFindDedups(
+                data_folder=f"{self.tmp_dir}/{name}/sigs",
+                output_folder=f"{self.tmp_dir}/{name}/dups",
+                config=config,
+                lines_to_buffer=lines_to_buffer,
+            )()
+            dedup_filter = UrlDedupFilter(data_folder=f"{self.tmp_dir}/{name}/dups", config=config)
+            return [doc.id for doc in dedup_filter(data=copy.deepcopy(docs))]
+
+        kept = run_dedup("large", batch_size=1000, lines_to_buffer=1000)
+        self.assertEqual(kept, run_dedup("small", batch_size=3, lines_to_buffer=1))
+        # highest priority and then lowest id of each url
+        self.assertEqual(kept, ["2", "5", "8", "11", "14", "17", "20"])
+
+    def test_invalid_priority(self):
+        config = UrlDedupConfig(document_priority=lambda x: 0)
+        signature_creation = UrlDedupSignature(output_folder=self.tmp_dir + "/sigs", config=config)
+        with self.assertRaises(ValueError):
+            signature_creation(data=DOCS)